@@ -0,0 +1,58 @@
+# Reports channel startup and extraction timings with and without the shared
+# client factory and the persistent channel id cache.
+# Run from the repository root: python -m benchmarks.bench_channel_cache
+
+from dags.utils import YoutubeChannel, ChannelIdCache, get_youtube_service, clear_youtube_service_cache
+from .fake_youtube import FakeYoutube, make_channels, patched_youtube
+from google.auth.credentials import AnonymousCredentials
+from unittest import mock
+import os
+import tempfile
+import time
+
+
+CHANNEL_COUNT = 5
+LATENCY = 0.05  # A typical round trip to the Data API
+
+
+def time_client_factory(runs: int = 24) -> None:
+    # Real discovery build with anonymous credentials, no network needed
+    with mock.patch('dags.utils.service_account.Credentials.from_service_account_info', return_value=AnonymousCredentials()):
+        clear_youtube_service_cache()
+        start = time.perf_counter()
+        for _ in range(runs):
+            clear_youtube_service_cache()
+            get_youtube_service({'client_email': 'bench'})
+        uncached = (time.perf_counter() - start) / runs
+
+        start = time.perf_counter()
+        for _ in range(runs):
+            get_youtube_service({'client_email': 'bench'})
+        cached = (time.perf_counter() - start) / runs
+        clear_youtube_service_cache()
+    print(f"client build: uncached={uncached * 1000:.2f}ms cached={cached * 1000:.4f}ms per channel")
+
+
+def time_run(label: str, fake: FakeYoutube, channel_id_cache=None) -> None:
+    fake.reset_counters()
+    start = time.perf_counter()
+    with patched_youtube(fake):
+        channels = [YoutubeChannel(service_account_info={}, channel_name=f"channel{i}", channel_id_cache=channel_id_cache)
+                    for i in range(CHANNEL_COUNT)]
+        startup = time.perf_counter() - start
+        startup_quota = fake.total_quota
+        for channelObj in channels:
+            channelObj.get_video_data(fetch_mode='playlist')
+    total = time.perf_counter() - start
+    print(f"  {label:<11} startup={startup:.2f}s ({startup_quota} units) extraction={total:.2f}s ({fake.total_quota} units)")
+
+
+if __name__ == '__main__':
+    time_client_factory()
+    fake = FakeYoutube(make_channels(CHANNEL_COUNT, 100), latency=LATENCY)
+    with tempfile.TemporaryDirectory() as tmp:
+        channel_id_cache = ChannelIdCache(os.path.join(tmp, 'channel_ids.json'))
+        print(f"channels={CHANNEL_COUNT} latency={LATENCY}s")
+        time_run('no cache', fake)
+        time_run('cache cold', fake, channel_id_cache)
+        time_run('cache warm', fake, ChannelIdCache(channel_id_cache.path))
@@ -0,0 +1,109 @@
+# Compares the old DataFrame accumulation of extracted rows (list + per page,
+# pd.concat per channel, four column subsets and drop_duplicates) with
+# ColumnarBuilder, which converts every 64k rows to Arrow arrays, and pyarrow projections,
+# at 10k, 100k and 1M video rows.
+# Every case runs in a fresh process so peak RSS is not shared between cases.
+# Run from the repository root: python -m benchmarks.bench_columnar_builder
+
+from dags.utils import ColumnarBuilder
+import multiprocessing
+import resource
+import time
+
+
+VIDEOS_PER_CHANNEL = 10000
+PAGE_SIZE = 50
+CHANNEL_COLUMNS = ['channel_name','channel_id','title','customUrl','publishedAt','country','viewCount','subscriberCount','videoCount','rptg_dt','etl_ts']
+VIDEO_COLUMNS = ['id','title','url','views','likes','dislikes','comments','publishedAt','channel_name','channel_id','rptg_dt','etl_ts']
+
+
+def video_pages(channel: int, video_count: int):
+    # Rows shaped like YoutubeChannel.get_video_statistics output, one list per API page
+    for start in range(0, video_count, PAGE_SIZE):
+        yield [{
+            'id': f"v{channel:05d}{v:06d}",
+            'title': f"Video {v} of channel {channel}",
+            'url': f"https://www.youtube.com/watch?v=v{channel:05d}{v:06d}",
+            'views': str(1000 + v),
+            'likes': str(100 + v),
+            'dislikes': 0,
+            'comments': str(10 + v),
+            'publishedAt': '2024-08-08T00:00:00Z',
+        } for v in range(start, min(start + PAGE_SIZE, video_count))]
+
+
+def channel_row(channel: int) -> dict:
+    return {'channel_name': f"channel{channel}", 'channel_id': f"UC{channel:022d}", 'title': f"Channel {channel}",
+            'customUrl': f"@channel{channel}", 'publishedAt': '2010-01-01T00:00:00Z', 'country': 'SG',
+            'viewCount': '1000', 'subscriberCount': '100', 'videoCount': '10', 'rptg_dt': '2024-08-08', 'etl_ts': '2024-08-08 00:00:00'}
+
+
+def run_pandas(row_count: int) -> int:
+    import pandas as pd
+    df_channel = pd.DataFrame(columns=CHANNEL_COLUMNS)
+    df_video = pd.DataFrame(columns=VIDEO_COLUMNS)
+    for channel in range(max(row_count // VIDEOS_PER_CHANNEL, 1)):
+        row = channel_row(channel)
+        df_channel = pd.concat([df_channel, pd.DataFrame([row])], ignore_index=True)
+        video_data = []
+        for page in video_pages(channel, min(row_count, VIDEOS_PER_CHANNEL)):
+            video_data = video_data + page
+        df_video_temp = pd.DataFrame(video_data)
+        df_video_temp['channel_name'] = row['channel_name']
+        df_video_temp['channel_id'] = row['channel_id']
+        df_video_temp['rptg_dt'] = row['rptg_dt']
+        df_video_temp['etl_ts'] = row['etl_ts']
+        df_video = pd.concat([df_video, df_video_temp], ignore_index=True)
+    df_video_md = df_video[['id','channel_id','title','url','publishedAt','etl_ts']]
+    df_video = df_video[['id','channel_id','rptg_dt','views','likes','dislikes','comments','etl_ts']]
+    df_channel_md = df_channel[['channel_name','channel_id','title','customUrl','publishedAt','country','etl_ts']]
+    df_channel = df_channel[['channel_id','rptg_dt','viewCount','subscriberCount','videoCount','etl_ts']]
+    df_channel = df_channel.drop_duplicates(subset=['channel_id','rptg_dt'])
+    df_channel_md = df_channel_md.drop_duplicates(subset=['channel_id'])
+    df_video_md = df_video_md.drop_duplicates(subset=['id'])
+    df_video = df_video.drop_duplicates(subset=['id','rptg_dt'])
+    return len(df_video)
+
+
+def run_columnar(row_count: int) -> int:
+    channel_builder = ColumnarBuilder(CHANNEL_COLUMNS, key_columns=['channel_id'])
+    video_builder = ColumnarBuilder(VIDEO_COLUMNS, key_columns=['id'])
+    for channel in range(max(row_count // VIDEOS_PER_CHANNEL, 1)):
+        row = channel_row(channel)
+        channel_builder.append(row)
+        # Each page goes to the builder as it arrives, no rows of the channel are held
+        for page in video_pages(channel, min(row_count, VIDEOS_PER_CHANNEL)):
+            video_builder.extend(page, channel_name=row['channel_name'], channel_id=row['channel_id'],
+                                 rptg_dt=row['rptg_dt'], etl_ts=row['etl_ts'])
+    tbl_channel = channel_builder.to_table()
+    tbl_video = video_builder.to_table()
+    tbl_video_md = tbl_video.select(['id','channel_id','title','url','publishedAt','etl_ts'])
+    tbl_video = tbl_video.select(['id','channel_id','rptg_dt','views','likes','dislikes','comments','etl_ts'])
+    tbl_channel_md = tbl_channel.select(['channel_name','channel_id','title','customUrl','publishedAt','country','etl_ts'])
+    tbl_channel = tbl_channel.select(['channel_id','rptg_dt','viewCount','subscriberCount','videoCount','etl_ts'])
+    return tbl_video.num_rows
+
+
+def _measure(func, row_count: int, queue) -> None:
+    import pandas  # imported up front in both cases so it is not counted in the peak
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    rows = func(row_count)
+    elapsed = time.perf_counter() - start
+    queue.put((rows, elapsed, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) / 1024))
+
+
+def measure(func, row_count: int) -> tuple:
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(func, row_count, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == '__main__':
+    for row_count in [10000, 100000, 1000000]:
+        for name, func in [('pandas', run_pandas), ('columnar', run_columnar)]:
+            rows, elapsed, peak_mb = measure(func, row_count)
+            print(f"rows={row_count:<8} {name:<9} kept={rows:<8} time={elapsed:6.2f}s peak_rss_delta={peak_mb:7.1f}MB")
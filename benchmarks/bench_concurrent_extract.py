@@ -0,0 +1,50 @@
+# Compares the serial per-channel extraction loop with YoutubeExtractor against a
+# fake YouTube client that sleeps for a fixed latency on every call.
+# Run from the repository root: python -m benchmarks.bench_concurrent_extract
+
+from dags.utils import YoutubeChannel, YoutubeExtractor
+from .fake_youtube import FakeYoutube, make_channels, patched_youtube
+import time
+
+
+LATENCY = 0.005
+VIDEOS_PER_CHANNEL = 200
+MAX_WORKERS = 32
+
+
+def run_serial(fake: FakeYoutube, channel_list: list) -> float:
+    start = time.perf_counter()
+    with patched_youtube(fake):
+        for channel_name in channel_list:
+            channelObj = YoutubeChannel(service_account_info={}, channel_name=channel_name)
+            channelObj.get_video_data(fetch_mode='playlist')
+    return time.perf_counter() - start
+
+
+def run_concurrent(fake: FakeYoutube, channel_list: list) -> float:
+    start = time.perf_counter()
+    extractor = YoutubeExtractor(service_account_info={}, max_workers=MAX_WORKERS, youtube=fake)
+    results, errors = extractor.extract(channel_list, fetch_mode='playlist')
+    assert len(results) == len(channel_list) and not errors
+    return time.perf_counter() - start
+
+
+def run_isolation() -> None:
+    # One unknown channel must not abort the others
+    fake = FakeYoutube(make_channels(5, VIDEOS_PER_CHANNEL))
+    extractor = YoutubeExtractor(service_account_info={}, max_workers=MAX_WORKERS, youtube=fake)
+    results, errors = extractor.extract([f"channel{i}" for i in range(5)] + ['missing'], fetch_mode='playlist')
+    print(f"isolation: ok={len(results)} failed={[(k, type(v).__name__) for k, v in errors.items()]}")
+
+
+if __name__ == '__main__':
+    print(f"latency={LATENCY}s videos_per_channel={VIDEOS_PER_CHANNEL} max_workers={MAX_WORKERS}")
+    for channel_count in [5, 50, 500]:
+        fake = FakeYoutube(make_channels(channel_count, VIDEOS_PER_CHANNEL), latency=LATENCY)
+        channel_list = [f"channel{i}" for i in range(channel_count)]
+        serial = run_serial(fake, channel_list)
+        calls = fake.total_calls
+        fake.reset_counters()
+        concurrent = run_concurrent(fake, channel_list)
+        print(f"  channels={channel_count:<4} calls={calls:<5} serial={serial:7.2f}s concurrent={concurrent:6.2f}s speedup={serial / concurrent:5.1f}x")
+    run_isolation()
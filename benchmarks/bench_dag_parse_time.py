@@ -0,0 +1,85 @@
+# Guards the DAG file's parse cost. The scheduler re-parses it every few seconds, so it
+# must not import pyarrow/boto3/snowflake/googleapiclient or open connections at module level.
+#  - lists the module level imports and calls of the DAG file and fails on heavy ones
+#  - reports what importing dags.utils costs (python -X importtime), the work now deferred to the tasks
+#  - times DagBag loads of dags/ when airflow is installed
+# Run from the repository root: python -m benchmarks.bench_dag_parse_time
+
+import ast
+import importlib.util
+import os
+import re
+import subprocess
+import sys
+import time
+
+
+DAG_FILE = 'dags/youtube-data-analytics-loader.py'
+HEAVY_MODULES = ['pyarrow', 'pandas', 'boto3', 'snowflake', 'googleapiclient', 'google']
+# Module level calls allowed while parsing, chained calls with their arguments dropped
+PARSE_TIME_CALLS = ['DAG', 'PythonOperator', 'PythonOperator.partial', 'PythonOperator.partial().expand', 'datetime.datetime']
+
+
+def module_level_work(path: str) -> tuple:
+    tree = ast.parse(open(path).read())
+    imports, calls = [], []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            imports.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            imports.append('.' * node.level + (node.module or ''))
+        elif not isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            calls.extend(ast.unparse(call.func) for call in ast.walk(node) if isinstance(call, ast.Call))
+    return imports, calls
+
+
+def import_time(module: str) -> tuple:
+    """Returns (cumulative microseconds, heavy top level packages loaded) of importing module in a fresh interpreter."""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                         capture_output=True, text=True, check=True).stderr
+    total, loaded = 0, set()
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        if not name.startswith(' ') and name == name.lstrip():
+            total += int(cumulative)
+        if name.strip().split('.')[0] in HEAVY_MODULES:
+            loaded.add(name.strip().split('.')[0])
+    return total, sorted(loaded)
+
+
+def dagbag_load_seconds(repeat: int = 5) -> list:
+    from airflow.models import DagBag
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        dagbag = DagBag(dag_folder=os.path.abspath(DAG_FILE), include_examples=False)
+        timings.append(time.perf_counter() - start)
+        assert not dagbag.import_errors, dagbag.import_errors
+    return timings
+
+
+def run() -> None:
+    imports, calls = module_level_work(DAG_FILE)
+    heavy_imports = [name for name in imports if name.split('.')[0] in HEAVY_MODULES or name.startswith('.')]
+    parse_calls = [name for name in calls if re.sub(r'\(.*\)', '()', name) not in PARSE_TIME_CALLS]
+    print(f"{DAG_FILE}")
+    print(f"  module level imports: {', '.join(imports)}")
+    print(f"  module level calls:   {', '.join(calls)}")
+
+    total_us, loaded = import_time('dags.utils')
+    print(f"  deferred to tasks: import dags.utils {total_us / 1000:.0f} ms ({', '.join(loaded)})")
+
+    if importlib.util.find_spec('airflow') is None:
+        print("  DagBag load: skipped, airflow is not installed")
+    else:
+        timings = dagbag_load_seconds()
+        print(f"  DagBag load: min {min(timings) * 1000:.0f} ms  max {max(timings) * 1000:.0f} ms over {len(timings)} loads")
+
+    assert not heavy_imports, f"heavy imports at parse time: {heavy_imports}"
+    assert not parse_calls, f"unexpected module level calls: {parse_calls}"
+
+
+if __name__ == '__main__':
+    run()
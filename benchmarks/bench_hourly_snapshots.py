@@ -0,0 +1,58 @@
+# Size of the hourly video stats snapshot table over 180 days of hourly loads, with
+# HourlyStatsRetention run once a day as task_compact_stats does, against keeping every
+# snapshot. Runs on the DuckDB warehouse (benchmarks/fake_warehouse.py).
+# Run from the repository root: python -m benchmarks.bench_hourly_snapshots
+
+from dags.utils import HourlyStatsRetention
+from .fake_warehouse import DuckDBWarehouse
+import datetime
+import logging
+import tempfile
+import time
+
+
+VIDEOS = 1000
+DAYS = 180
+REPORT_DAYS = [7, 30, 90, 180]
+FIRST_DT = datetime.date(2024, 1, 1)
+
+
+def load_day(warehouse: DuckDBWarehouse, day: datetime.date, day_num: int) -> None:
+    # 24 hourly snapshots of every video, the counters growing with the hour
+    warehouse.db.execute(f"""
+        INSERT INTO CORE.TBL_YT_VIDEO_STATS_HOURLY
+        SELECT 'v' || v, TIMESTAMP '{day}' + INTERVAL (h) HOUR, 1000 + v + ({day_num} * 24 + h) * 10, 50 + {day_num} * 24 + h, 5 + {day_num}
+        FROM range(24) t1(h), range({VIDEOS}) t2(v)""")
+
+
+def check_windows(warehouse: DuckDBWarehouse, as_of: datetime.datetime, retention: HourlyStatsRetention) -> int:
+    """Downsampled snapshots which are not the last hour of their window, should be 0.
+
+    The window holding the cutoff is only partly downsampled until the next run, it is left out.
+    """
+    full_cutoff = as_of - datetime.timedelta(days=retention.full_days)
+    full_cutoff = full_cutoff.replace(hour=full_cutoff.hour // retention.downsample_hours * retention.downsample_hours)
+    return warehouse.query(f"""
+        SELECT COUNT(*) FROM CORE.TBL_YT_VIDEO_STATS_HOURLY
+        WHERE RPTG_TS < TIMESTAMP '{full_cutoff:%Y-%m-%d %H:%M:%S}'
+        AND (HOUR(RPTG_TS) + 1) % {retention.downsample_hours} <> 0""")[0][0]
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        warehouse = DuckDBWarehouse(tmp)
+        for day_num in range(DAYS):
+            day = FIRST_DT + datetime.timedelta(days=day_num)
+            load_day(warehouse, day, day_num)
+            as_of = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(2))
+            retention = HourlyStatsRetention(warehouse.connect(), tables={'TBL_YT_VIDEO_STATS_HOURLY': ['ID']})
+            start = time.perf_counter()
+            retention.run(as_of=as_of)
+            elapsed = time.perf_counter() - start
+            if day_num + 1 in REPORT_DAYS:
+                rows = warehouse.query("SELECT COUNT(*) FROM CORE.TBL_YT_VIDEO_STATS_HOURLY")[0][0]
+                unbounded = (day_num + 1) * 24 * VIDEOS
+                print(f"day={day_num + 1:<4} rows={rows:<8} snapshots_per_video={rows // VIDEOS:<5} "
+                      f"without_downsampling={unbounded:<8} ({rows / unbounded:.0%}) daily_mode_rows={(day_num + 1) * VIDEOS:<7} "
+                      f"job={elapsed * 1000:.0f}ms misplaced={check_windows(warehouse, as_of, retention)}")
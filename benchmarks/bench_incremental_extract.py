@@ -0,0 +1,58 @@
+# Replays 48 hourly runs against the fake YouTube client and compares the full
+# extraction with the incremental one (VideoStateStore). Reports API calls,
+# response bytes and Parquet bytes written per run.
+# Run from the repository root: python -m benchmarks.bench_incremental_extract
+
+from dags.utils import YoutubeExtractor, VideoStateStore, ColumnarBuilder
+from .fake_youtube import FakeYoutube, make_channels
+import pyarrow.parquet as pq
+import io
+import os
+import tempfile
+import time
+
+
+CHANNEL_COUNT = 5
+VIDEOS_PER_CHANNEL = 1000
+RUNS = 48
+
+
+def parquet_bytes(table) -> int:
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    return buffer.getbuffer().nbytes
+
+
+def run_once(fake: FakeYoutube, state_store) -> tuple:
+    fake.reset_counters()
+    extractor = YoutubeExtractor(service_account_info={}, youtube=fake)
+    results, _ = extractor.extract([f"channel{i}" for i in range(CHANNEL_COUNT)], fetch_mode='playlist', state_store=state_store)
+    video_builder = ColumnarBuilder(['id','channel_id','views','likes','dislikes','comments'], key_columns=['id'])
+    video_md_builder = ColumnarBuilder(['id','channel_id','title','url','publishedAt'], key_columns=['id'])
+    for channelObj, video_data in results.values():
+        video_builder.extend(video_data, channel_id=channelObj.channel_id)
+        video_md_builder.extend([row for row in video_data if row.get('md_changed', True)], channel_id=channelObj.channel_id)
+    if state_store is not None:
+        state_store.save()
+    written = parquet_bytes(video_builder.to_table()) + parquet_bytes(video_md_builder.to_table())
+    return fake.total_calls, fake.response_bytes, written, len(video_builder), len(video_md_builder)
+
+
+if __name__ == '__main__':
+    fake = FakeYoutube(make_channels(CHANNEL_COUNT, VIDEOS_PER_CHANNEL))
+    clock = [time.time()]
+    with tempfile.TemporaryDirectory() as tmp:
+        state_store = VideoStateStore(os.path.join(tmp, 'video_state.json'), clock=lambda: clock[0])
+        totals = {'full': [0, 0, 0], 'incremental': [0, 0, 0]}
+        print(f"channels={CHANNEL_COUNT} videos_per_channel={VIDEOS_PER_CHANNEL} runs={RUNS} (hourly)")
+        for run in range(RUNS):
+            for mode, store in [('full', None), ('incremental', state_store)]:
+                calls, response_bytes, written, video_rows, md_rows = run_once(fake, store)
+                for i, value in enumerate([calls, response_bytes, written]):
+                    totals[mode][i] += value
+                if run in (0, 1, 6, 24) or run == RUNS - 1:
+                    print(f"  run={run:<3} {mode:<12} api_calls={calls:<4} response_kb={response_bytes / 1024:8.1f} "
+                          f"written_kb={written / 1024:7.1f} video_rows={video_rows:<5} video_md_rows={md_rows}")
+            clock[0] += 3600
+        for mode, (calls, response_bytes, written) in totals.items():
+            print(f"  total {mode:<12} api_calls={calls} response_mb={response_bytes / 1e6:.1f} written_mb={written / 1e6:.2f}")
@@ -0,0 +1,128 @@
+# Warehouse queries and wall time of re-running the insights notebook's queries with
+# pd.read_sql style fetches vs insights/data_access.py InsightsData, on the DuckDB
+# warehouse with 90 days of synthetic history and a simulated round trip per statement.
+# InsightsData runs: a cold cache, a warm re-run, an offline re-run without a connection,
+# a new session on the warm cache, and a re-run after a new load, which refetches only the
+# results reading changed tables.
+# Run from the repository root (needs duckdb):
+#   python -m benchmarks.bench_insights_cache [--sf-latency 0.1]
+
+import argparse
+import datetime
+import logging
+import tempfile
+import time
+
+import pandas as pd
+
+from dags.utils import SemanticAggregator
+from insights.data_access import InsightsData
+from .bench_semantic_aggregates import CHANNELS, LAST_DT, load_history
+from .fake_warehouse import DuckDBWarehouse
+
+
+HISTORY_DAYS = 90
+
+# The notebook's queries in portable SQL, the channel level charts first
+QUERIES = {
+    'subscribers': f"""select md.channel_name, md.title as "Channel", stat.subscriber_count as "Number of Subcribers"
+        from CORE.tbl_yt_channel_stats stat inner join CORE.tbl_yt_channel_md md on md.channel_id = stat.channel_id
+        where stat.rptg_dt = DATE '{LAST_DT}' order by 3 desc""",
+    'videos': f"""select md.channel_name, md.title as "Channel", stat.video_count as "Number of Videos"
+        from CORE.tbl_yt_channel_stats stat inner join CORE.tbl_yt_channel_md md on md.channel_id = stat.channel_id
+        where stat.rptg_dt = DATE '{LAST_DT}' order by 3 desc""",
+    'engagement': f"""select chnl.title as "Channel", a.engagement_perc as "Engagement %"
+        from SEMANTIC.tbl_yt_channel_engagement a inner join CORE.tbl_yt_channel_md chnl on chnl.channel_id = a.channel_id
+        where a.rptg_dt = DATE '{LAST_DT}' order by 2 desc""",
+    'daily_subscribers': """select orig.rptg_dt as "Date", md.title as "Channel", coalesce(orig.new_subscribers, 0) as "Daily new subscribers"
+        from SEMANTIC.tbl_yt_channel_daily orig inner join CORE.tbl_yt_channel_md md on md.channel_id = orig.channel_id""",
+    'monthly_uploads': """select a.upload_month, chnl.title as "Channel Name", sum(a.video_count) as "Number of videos"
+        from SEMANTIC.tbl_yt_channel_monthly_uploads a inner join CORE.tbl_yt_channel_md chnl on chnl.channel_id = a.channel_id
+        group by 1, 2 order by 1, 2""",
+    'top_videos': f"""select chnl.title as "Channel Name", vdo.title as "Video Title", a.view_count as "Views"
+        from SEMANTIC.tbl_yt_video_top a inner join CORE.tbl_yt_video_md vdo on vdo.id = a.id
+        inner join CORE.tbl_yt_channel_md chnl on chnl.channel_id = a.channel_id
+        where a.rptg_dt = DATE '{LAST_DT}' and a.metric = 'views' and a.video_rank = 1 order by 3 desc""",
+}
+
+
+def read_sql(conn, sql: str) -> pd.DataFrame:
+    curs = conn.cursor()
+    curs.execute(sql)
+    return pd.DataFrame(curs.fetchall(), columns=[col[0] for col in curs.description])
+
+
+def notebook_run(label: str, run_query) -> dict:
+    start = time.perf_counter()
+    frames = {name: run_query(sql) for name, sql in QUERIES.items()}
+    return {'label': label, 'seconds': time.perf_counter() - start, 'frames': frames}
+
+
+def new_load(warehouse: DuckDBWarehouse) -> None:
+    # An hourly load updating the channel stats of the last date and refreshing the aggregates
+    etl_ts = datetime.datetime.combine(LAST_DT, datetime.time(11))
+    warehouse.db.execute(f"UPDATE CORE.TBL_YT_CHANNEL_STATS SET subscriber_count = subscriber_count + 1, etl_ts = TIMESTAMP '{etl_ts}' "
+                         f"WHERE rptg_dt = DATE '{LAST_DT}'")
+    warehouse.db.execute("DELETE FROM CORE.TBL_STG_YT_VIDEO_STATS")
+    warehouse.db.execute("DELETE FROM CORE.TBL_STG_YT_VIDEO_MD")
+    warehouse.db.execute("DELETE FROM CORE.TBL_STG_YT_CHANNEL_STATS")
+    warehouse.db.execute(f"INSERT INTO CORE.TBL_STG_YT_CHANNEL_STATS SELECT * FROM CORE.TBL_YT_CHANNEL_STATS WHERE rptg_dt = DATE '{LAST_DT}'")
+    SemanticAggregator(warehouse.connect()).run(etl_ts=etl_ts.strftime("%Y-%m-%d %H:%M:%S"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sf-latency', type=float, default=0.1, help='seconds per warehouse statement')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        warehouse = DuckDBWarehouse(tmp)
+        load_history(warehouse, HISTORY_DAYS)
+        warehouse.db.execute(f"""INSERT INTO CORE.TBL_YT_CHANNEL_MD
+            SELECT 'channel' || c, 'UC' || c, 'Channel ' || c, '@channel' || c, TIMESTAMP '2010-01-01', 'SG', TIMESTAMP '{LAST_DT} 10:00:00'
+            FROM range({CHANNELS}) t(c)""")
+        SemanticAggregator(warehouse.connect()).run()
+        warehouse.latency = args.sf_latency
+        print(f"history_days={HISTORY_DAYS} queries={len(QUERIES)} sf_latency={args.sf_latency}s")
+
+        conn = warehouse.connect()
+        statements = len(conn.statements)
+        baseline = notebook_run('read_sql', lambda sql: read_sql(conn, sql))
+        print(f"  {'read_sql':<20} {baseline['seconds']:.3f}s  warehouse_queries={len(conn.statements) - statements}")
+
+        cache_dir = f"{tmp}/insights-cache"
+        data = InsightsData(conn, cache_dir=cache_dir)
+        runs = []
+        for label in ['cold', 'warm']:
+            queries, hits = data.queries, data.cache_hits
+            runs.append(notebook_run(label, data.query))
+            print(f"  {label:<20} {runs[-1]['seconds']:.3f}s  warehouse_queries={data.queries - queries} cache_hits={data.cache_hits - hits}")
+
+        offline = InsightsData(None, cache_dir=cache_dir)
+        runs.append(notebook_run('offline', offline.query))
+        print(f"  {'offline':<20} {runs[-1]['seconds']:.3f}s  warehouse_queries=0 cache_hits={offline.cache_hits}")
+
+        # A new kernel checks the watermarks of every cached result's tables with one query
+        session = InsightsData(conn, cache_dir=cache_dir)
+        runs.append(notebook_run('new session', session.query))
+        print(f"  {'new session':<20} {runs[-1]['seconds']:.3f}s  warehouse_queries={session.queries} cache_hits={session.cache_hits}")
+
+        warehouse.latency = 0.0
+        new_load(warehouse)
+        warehouse.latency = args.sf_latency
+        # The watermarks are checked again once the notebook is re-run after watermark_ttl
+        data.invalidate()
+        queries, hits = data.queries, data.cache_hits
+        after = notebook_run('after load', data.query)
+        changed = [name for name in QUERIES if not after['frames'][name].equals(runs[1]['frames'][name])]
+        print(f"  {'after new load':<20} {after['seconds']:.3f}s  warehouse_queries={data.queries - queries} "
+              f"cache_hits={data.cache_hits - hits} changed_results={changed}")
+
+        fresh = {name: read_sql(conn, sql) for name, sql in QUERIES.items()}
+        same = all(after['frames'][name].astype(str).equals(fresh[name].astype(str)) for name in QUERIES)
+        print(f"  results match read_sql after the load: {same}")
+
+
+if __name__ == '__main__':
+    main()
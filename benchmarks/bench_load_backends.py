@@ -0,0 +1,58 @@
+# Latency of the 's3' and 'direct' load backends (sf_load_backend) on the local harness.
+# 's3' uploads the Parquet files to the bucket and COPYs them through the external stages.
+# 'direct' PUTs them to the stage tables' internal stages, archives them to S3 at the same
+# time, and removes them from the internal stages after the load.
+# Round trips are simulated: --s3-latency per S3 request and per PUT upload, --sf-latency
+# per warehouse statement. Each scale does a first full run and a second incremental run,
+# the size of an hourly load. For each run it reports:
+#  - upload: the critical path of the extraction task's file writes
+#  - archive: the wait on the S3 archive after the PUTs
+#  - load: the load task
+# Run from the repository root (needs duckdb):
+#   python -m benchmarks.bench_load_backends [--s3-latency 0.03] [--sf-latency 0.1]
+
+import argparse
+import logging
+
+from .harness import PipelineHarness
+
+
+SCALES = [(5, 200), (50, 2000)]
+
+
+def stage_seconds(metrics: dict, stage: str) -> float:
+    return metrics['stages'].get(stage, {}).get('seconds', 0.0)
+
+
+def run(channel_count: int, videos_per_channel: int, backend: str, s3_latency: float, sf_latency: float) -> None:
+    harness = PipelineHarness(channel_count, videos_per_channel, config={'sf_load_backend': backend},
+                              s3_latency=s3_latency, sf_latency=sf_latency)
+    try:
+        for label in ['first', 'second']:
+            result = harness.run()
+            extract = result['metrics']['task_load_from_yt_to_s3']
+            upload = stage_seconds(extract, 's3.upload') + stage_seconds(extract, 'snowflake.put')
+            archive = stage_seconds(extract, 's3.archive')
+            load = result['stages']['load']
+            print(f"  {backend:<6} {label:<6} upload={upload:.3f}s archive_wait={archive:.3f}s load={load:.3f}s "
+                  f"upload+load={upload + archive + load:.3f}s video_rows={result['core_rows']['tbl_yt_video_stats']}")
+    finally:
+        harness.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--s3-latency', type=float, default=0.03, help='seconds per S3 request and PUT upload')
+    parser.add_argument('--sf-latency', type=float, default=0.1, help='seconds per warehouse statement')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    for channel_count, videos_per_channel in SCALES:
+        print(f"channels={channel_count} videos_per_channel={videos_per_channel} "
+              f"s3_latency={args.s3_latency}s sf_latency={args.sf_latency}s")
+        for backend in ['s3', 'direct']:
+            run(channel_count, videos_per_channel, backend, args.s3_latency, args.sf_latency)
+
+
+if __name__ == '__main__':
+    main()
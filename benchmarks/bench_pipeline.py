@@ -0,0 +1,70 @@
+# End to end benchmark suite on the local harness (benchmarks/harness.py). Each scale
+# runs in a fresh interpreter: a first run on an empty warehouse, then a second run
+# of the same data, which is incremental. Reports per stage wall time, API calls,
+# quota units, S3 bytes written, core rows and the peak RSS of the process.
+# Run from the repository root (needs duckdb):
+#   python -m benchmarks.bench_pipeline [--latency 0.02] [--output results.json]
+# --output writes the results as JSON so runs can be compared across commits.
+
+import argparse
+import json
+import logging
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+
+SCALES = [(5, 200), (20, 1000), (50, 4000)]
+
+
+def run_scale(channel_count: int, videos_per_channel: int, latency: float) -> dict:
+    from .harness import PipelineHarness
+    harness = PipelineHarness(channel_count, videos_per_channel, latency=latency)
+    try:
+        runs = [harness.run(), harness.run()]
+    finally:
+        harness.close()
+    return {
+        'channels': channel_count,
+        'videos_per_channel': videos_per_channel,
+        'latency': latency,
+        'runs': runs,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per fake YouTube API call')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--child', nargs=2, type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        logging.disable(logging.WARNING)
+        print(json.dumps(run_scale(*args.child, latency=args.latency), default=str))
+        return
+
+    results = []
+    for channel_count, videos_per_channel in SCALES:
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_pipeline', '--latency', str(args.latency),
+                              '--child', str(channel_count), str(videos_per_channel)],
+                             capture_output=True, text=True, check=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        results.append(result)
+        print(f"channels={channel_count} videos_per_channel={videos_per_channel} peak_rss={result['peak_rss_mb']:.0f}MB")
+        for label, run in zip(['first', 'second'], result['runs']):
+            stages = '  '.join(f"{stage}={seconds:.2f}s" for stage, seconds in run['stages'].items())
+            print(f"  {label:<6} {stages}  api_calls={run['api_calls']} quota={run['quota_units']} "
+                  f"s3_bytes={run['s3_bytes_written']} video_rows={run['core_rows']['tbl_yt_video_stats']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'pipeline', 'timestamp': int(time.time()), 'python': platform.python_version(),
+                       'results': results}, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# Runs YoutubeExtractor against a fake YouTube client injecting transient 503 and
+# 429 errors, then with a run budget and a daily quota smaller than the run needs.
+# Reports retries, completion and the quota units each channel consumed.
+# Run from the repository root: python -m benchmarks.bench_rate_limit_retry
+
+from dags.utils import YoutubeExtractor
+from .fake_youtube import FakeYoutube, make_channels
+import logging
+import time
+
+
+CHANNELS = [f"channel{i}" for i in range(5)]
+
+
+def run(label: str, fake: FakeYoutube, **kwargs) -> None:
+    extractor = YoutubeExtractor(service_account_info={}, youtube=fake, **kwargs)
+    # Short backoff so the benchmark does not sleep for minutes
+    extractor._youtube.backoff_base = 0.01
+    start = time.perf_counter()
+    results, errors = extractor.extract(CHANNELS, fetch_mode='playlist')
+    elapsed = time.perf_counter() - start
+    complete = sum(1 for channelObj, _ in results.values() if channelObj.complete)
+    videos = sum(len(video_data) for _, video_data in results.values())
+    print(f"{label}: time={elapsed:.2f}s channels complete={complete} partial={len(results) - complete} "
+          f"skipped={len(errors)} videos={videos} server_calls={fake.total_calls} rate={extractor.rate_limiter.requests_per_sec}")
+    for channel, m in sorted(extractor.channel_metrics().items()):
+        print(f"    {channel:<9} quota_units={m['quota_units']:<4} calls={m['calls']:<4} retries={m['retries']:<3} {m['quota_by_method']}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR)
+    run('503 on 10% of calls', FakeYoutube(make_channels(5, 1000), error_rate=0.1, error_status=503))
+    run('429 on 10% of calls, 50 rps', FakeYoutube(make_channels(5, 1000), error_rate=0.1, error_status=429),
+        max_requests_per_sec=50)
+    run('run budget of 150 units', FakeYoutube(make_channels(5, 1000)), quota_budget=150)
+    run('daily quota of 150 units', FakeYoutube(make_channels(5, 1000), daily_quota=150))
@@ -0,0 +1,95 @@
+# Compares the old BytesIO + put upload of the four datasets with the streaming
+# multipart upload_parquet_datasets, against a moto S3 server running in a child
+# process, so the stored objects do not count towards the measured client memory.
+# Reports peak Python + Arrow buffer memory and upload throughput.
+# Needs moto with its server extras: pip install "moto[server]"
+# Run from the repository root: python -m benchmarks.bench_s3_parquet_upload
+
+from dags.utils import upload_parquet_datasets
+import pyarrow as pa
+import pyarrow.parquet as pq
+import boto3
+import io
+import multiprocessing
+import os
+import time
+import tracemalloc
+from moto.server import ThreadedMotoServer
+
+
+BUCKET = 'youtube-stats-001'
+S3_PATH = 'dump/parquet'
+MOTO_PORT = 5055
+
+
+def serve_moto() -> None:
+    ThreadedMotoServer(port=MOTO_PORT, verbose=False).start()
+    while True:
+        time.sleep(60)
+
+
+def make_datasets(row_count: int) -> dict:
+    video = pa.table({
+        'id': [f"v{i:011d}" for i in range(row_count)],
+        'channel_id': [f"UC{i % 5:022d}" for i in range(row_count)],
+        'title': [f"Video title number {i} " + os.urandom(8).hex() for i in range(row_count)],
+        'url': [f"https://www.youtube.com/watch?v=v{i:011d}" for i in range(row_count)],
+        'views': [str(i * 7) for i in range(row_count)],
+        'etl_ts': ['2024-08-08 00:00:00'] * row_count,
+    })
+    channel = pa.table({'channel_id': [f"UC{i:022d}" for i in range(5)], 'viewCount': ['1000'] * 5})
+    return {
+        'channel_md': (f"{S3_PATH}/channel_md/channel_md_data_0.parquet", channel),
+        'channel': (f"{S3_PATH}/channel/channel_data_0.parquet", channel),
+        'video_md': (f"{S3_PATH}/video_md/video_md_data_0.parquet", video.select(['id', 'channel_id', 'title', 'url', 'etl_ts'])),
+        'video': (f"{S3_PATH}/video/video_data_0.parquet", video.select(['id', 'channel_id', 'views', 'etl_ts'])),
+    }
+
+
+def upload_bytesio(s3, datasets: dict) -> int:
+    total = 0
+    for key, table in datasets.values():
+        parquet_buffer = io.BytesIO()
+        pq.write_table(table, parquet_buffer)
+        body = parquet_buffer.getvalue()
+        total += len(body)
+        s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+    return total
+
+
+def upload_streaming(s3, datasets: dict) -> int:
+    return sum(upload_parquet_datasets(s3, BUCKET, datasets).values())
+
+
+def measure(name: str, func, s3, datasets: dict) -> None:
+    pool = pa.default_memory_pool()
+    tracemalloc.start()
+    arrow_before = pool.bytes_allocated()
+    start = time.perf_counter()
+    total = func(s3, datasets)
+    elapsed = time.perf_counter() - start
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # max_memory is process wide, so only the Python side peak is exact per case
+    print(f"  {name:<9} bytes={total / 1e6:7.1f}MB time={elapsed:5.2f}s throughput={total / 1e6 / elapsed:6.1f}MB/s "
+          f"python_peak={py_peak / 1e6:7.1f}MB arrow_peak={(pool.max_memory() - arrow_before) / 1e6:7.1f}MB")
+
+
+if __name__ == '__main__':
+    server = multiprocessing.Process(target=serve_moto, daemon=True)
+    server.start()
+    time.sleep(1)
+    try:
+        s3 = boto3.client('s3', region_name='us-east-1', endpoint_url=f"http://127.0.0.1:{MOTO_PORT}",
+                          aws_access_key_id='bench', aws_secret_access_key='bench')
+        s3.create_bucket(Bucket=BUCKET)
+        for row_count in [100000, 1000000]:
+            datasets = make_datasets(row_count)
+            print(f"video rows={row_count}")
+            measure('bytesio', upload_bytesio, s3, datasets)
+            measure('streaming', upload_streaming, s3, datasets)
+            # Sanity check that the multipart objects read back
+            body = s3.get_object(Bucket=BUCKET, Key=datasets['video_md'][0])['Body'].read()
+            assert pq.read_table(io.BytesIO(body)).num_rows == row_count
+    finally:
+        server.terminate()
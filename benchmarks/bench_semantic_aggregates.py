@@ -0,0 +1,103 @@
+# Compares the notebook's dashboard queries on the raw CORE tables with reads of the
+# SEMANTIC aggregates kept by SemanticAggregator, as the stats history grows. Runs on
+# the DuckDB warehouse (benchmarks/fake_warehouse.py) with synthetic history, and also
+# times the incremental refresh of one new rptg_dt.
+# Run from the repository root: python -m benchmarks.bench_semantic_aggregates
+
+from dags.utils import SemanticAggregator
+from .fake_warehouse import DuckDBWarehouse
+import datetime
+import logging
+import tempfile
+import time
+
+
+CHANNELS = 5
+VIDEOS_PER_CHANNEL = 2000
+HISTORY_DAYS = [30, 90, 180]
+LAST_DT = datetime.date(2024, 8, 10)
+
+# The notebook's CORE queries, in portable SQL
+CORE_QUERIES = {
+    'daily_subscribers': """
+        SELECT orig.rptg_dt, orig.channel_id, COALESCE(SUM(orig.subscriber_count) - SUM(prev.subscriber_count), 0)
+        FROM CORE.TBL_YT_CHANNEL_STATS orig
+        LEFT JOIN CORE.TBL_YT_CHANNEL_STATS prev ON orig.channel_id = prev.channel_id AND orig.rptg_dt = prev.rptg_dt + 1
+        GROUP BY 1, 2""",
+    'top_video_by_views': f"""
+        SELECT a.channel_id, a.id, a.view_count FROM CORE.TBL_YT_VIDEO_STATS a
+        INNER JOIN CORE.TBL_YT_VIDEO_MD vdo ON vdo.id = a.id
+        WHERE a.rptg_dt = DATE '{LAST_DT}'
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY a.channel_id ORDER BY a.view_count DESC) = 1""",
+    'engagement': f"""
+        SELECT channel_id, (SUM(like_count) - SUM(dislike_count) + SUM(comment_count)) / SUM(view_count) * 100
+        FROM CORE.TBL_YT_VIDEO_STATS WHERE rptg_dt = DATE '{LAST_DT}' GROUP BY 1""",
+    'top_videos_by_engagement': f"""
+        SELECT id, channel_id FROM CORE.TBL_YT_VIDEO_STATS WHERE rptg_dt = DATE '{LAST_DT}'
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY channel_id ORDER BY
+            CASE WHEN view_count > 0 THEN (like_count - dislike_count + comment_count) / view_count * 100 ELSE 0 END DESC) <= 3""",
+    'monthly_uploads': """
+        SELECT DATE_TRUNC('month', published_at), channel_id, COUNT(id) FROM CORE.TBL_YT_VIDEO_MD GROUP BY 1, 2""",
+}
+
+SEMANTIC_QUERIES = {
+    'daily_subscribers': "SELECT rptg_dt, channel_id, COALESCE(new_subscribers, 0) FROM SEMANTIC.TBL_YT_CHANNEL_DAILY",
+    'top_video_by_views': f"SELECT channel_id, id, view_count FROM SEMANTIC.TBL_YT_VIDEO_TOP WHERE rptg_dt = DATE '{LAST_DT}' AND metric = 'views' AND video_rank = 1",
+    'engagement': f"SELECT channel_id, engagement_perc FROM SEMANTIC.TBL_YT_CHANNEL_ENGAGEMENT WHERE rptg_dt = DATE '{LAST_DT}'",
+    'top_videos_by_engagement': f"SELECT id, channel_id FROM SEMANTIC.TBL_YT_VIDEO_TOP WHERE rptg_dt = DATE '{LAST_DT}' AND metric = 'engagement'",
+    'monthly_uploads': "SELECT upload_month, channel_id, video_count FROM SEMANTIC.TBL_YT_CHANNEL_MONTHLY_UPLOADS",
+}
+
+
+def load_history(warehouse: DuckDBWarehouse, days: int) -> None:
+    first_dt = LAST_DT - datetime.timedelta(days=days - 1)
+    db = warehouse.db
+    db.execute(f"""
+        INSERT INTO CORE.TBL_YT_VIDEO_MD
+        SELECT 'v' || c || '_' || v, 'UC' || c, 'Video ' || v, 'https://www.youtube.com/watch?v=' || v,
+               TIMESTAMP '{LAST_DT}' - INTERVAL (v * 6) HOUR, TIMESTAMP '{LAST_DT} 10:00:00'
+        FROM range({CHANNELS}) t1(c), range({VIDEOS_PER_CHANNEL}) t2(v)""")
+    db.execute(f"""
+        INSERT INTO CORE.TBL_YT_CHANNEL_STATS
+        SELECT 'UC' || c, DATE '{first_dt}' + d::INTEGER, 100000 + c * 1000 + d * 37, 5000000 + d * 9000, {VIDEOS_PER_CHANNEL}, TIMESTAMP '{LAST_DT} 10:00:00'
+        FROM range({CHANNELS}) t1(c), range({days}) t2(d)""")
+    db.execute(f"""
+        INSERT INTO CORE.TBL_YT_VIDEO_STATS
+        SELECT 'v' || c || '_' || v, 'UC' || c, DATE '{first_dt}' + d::INTEGER, 1000 + v * 7 + d * 3, 50 + v % 97 + d, 0, 5 + v % 13, TIMESTAMP '{LAST_DT} 10:00:00'
+        FROM range({CHANNELS}) t1(c), range({VIDEOS_PER_CHANNEL}) t2(v), range({days}) t3(d)""")
+    # The stage holds the last load: the newest date and every video's metadata
+    db.execute(f"INSERT INTO CORE.TBL_STG_YT_CHANNEL_STATS SELECT * FROM CORE.TBL_YT_CHANNEL_STATS WHERE rptg_dt = DATE '{LAST_DT}'")
+    db.execute(f"INSERT INTO CORE.TBL_STG_YT_VIDEO_STATS SELECT * FROM CORE.TBL_YT_VIDEO_STATS WHERE rptg_dt = DATE '{LAST_DT}'")
+    db.execute("INSERT INTO CORE.TBL_STG_YT_VIDEO_MD SELECT * FROM CORE.TBL_YT_VIDEO_MD")
+
+
+def timed(warehouse: DuckDBWarehouse, sql: str, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        warehouse.query(sql)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(days: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        warehouse = DuckDBWarehouse(tmp)
+        load_history(warehouse, days)
+        conn = warehouse.connect()
+        start = time.perf_counter()
+        SemanticAggregator(conn).run()
+        refresh = time.perf_counter() - start
+        stats_rows = warehouse.query("SELECT COUNT(*) FROM CORE.TBL_YT_VIDEO_STATS")[0][0]
+        print(f"history_days={days} video_stats_rows={stats_rows} incremental_refresh={refresh * 1000:.0f}ms")
+        for name in CORE_QUERIES:
+            core = timed(warehouse, CORE_QUERIES[name])
+            semantic = timed(warehouse, SEMANTIC_QUERIES[name])
+            print(f"  {name:<26} core={core * 1000:7.1f}ms  semantic={semantic * 1000:6.1f}ms")
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for days in HISTORY_DAYS:
+        run(days)
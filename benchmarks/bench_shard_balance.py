@@ -0,0 +1,108 @@
+# Balance of the sharded extraction (fn_plan_shards and the mapped fn_extract_load_s3)
+# on channels of very uneven size. The shards of a run are compared planned three ways:
+# by a hash of the channel name, by channel count (plan_shards without weights) and by
+# the estimated API calls from the CORE tables (fetch_channel_weights, the DAG default).
+# Reports each shard's API calls and wall time, the heaviest shard against the mean and
+# the speedup when the shards run on parallel worker slots. Every plan must assign each
+# channel exactly once, the weighted one must keep the heaviest shard within 4/3 of the
+# best possible and, replanned with unchanged weights, keep every channel on its shard.
+# Run from the repository root (needs duckdb): python -m benchmarks.bench_shard_balance
+
+from unittest import mock
+import logging
+import random
+import zlib
+
+import dags.utils
+from .harness import PipelineHarness
+
+
+CHANNELS = 120
+LATENCY = 0.002
+# The longest processing time first bound: the heaviest shard against the mean load or,
+# when one channel outweighs the mean, against that channel
+MAX_IMBALANCE = 4 / 3
+
+
+def channel_sizes(channel_count: int, seed: int = 7) -> list:
+    """Pareto distributed videos per channel, a few channels hold most of the videos."""
+    rng = random.Random(seed)
+    return [min(int(20 * rng.paretovariate(1.0)), 5000) for _ in range(channel_count)]
+
+
+def hash_shards(channel_list: list, shard_count: int, weights: dict = None, previous: dict = None) -> list:
+    shards = [[] for _ in range(shard_count)]
+    for channel in channel_list:
+        shards[zlib.crc32(channel.encode()) % shard_count].append(channel)
+    return [shard for shard in shards if shard]
+
+
+STRATEGIES = {
+    'hash': [mock.patch.object(dags.utils, 'plan_shards', hash_shards)],
+    'count': [mock.patch.object(dags.utils, 'fetch_channel_weights', lambda *args, **kwargs: {})],
+    'weighted': [],
+}
+
+
+def run(harness: PipelineHarness, shard_count: int, strategy: str, sticky: bool = False) -> dict:
+    # Without sticky every run plans from scratch, so the strategies do not see each other's plans
+    config = {'yt_shard_count': shard_count}
+    if not sticky:
+        config['yt_shard_assignment_variable'] = None
+    patches = STRATEGIES[strategy]
+    for patch in patches:
+        patch.start()
+    try:
+        return harness.run(config=config)
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+
+
+def assignment(result: dict) -> dict:
+    """{channel: shard} of a run, checking that every channel is in exactly one shard."""
+    names = [name for shard in result['shards'] for name in shard['channel_names']]
+    assert sorted(names) == sorted(f"channel{c}" for c in range(CHANNELS)), 'channels missing or assigned twice'
+    return {name: shard['shard'] for shard in result['shards'] for name in shard['channel_names']}
+
+
+def main() -> None:
+    logging.disable(logging.WARNING)
+    sizes = channel_sizes(CHANNELS)
+    print(f"channels={CHANNELS} videos={sum(sizes)} largest={sorted(sizes)[-3:]} latency={LATENCY}s per call")
+    # Full fetches every run, so the runs are comparable. The first run loads the history the weights come from.
+    harness = PipelineHarness(CHANNELS, sizes, latency=LATENCY, config={'yt_incremental': False})
+    try:
+        baseline = run(harness, 1, 'weighted')
+        print(f"  shards=1  api_calls={baseline['api_calls']} extract={baseline['stages']['extract']:.2f}s")
+        with harness.pool.connection() as conn:
+            heaviest_channel = max(dags.utils.fetch_channel_weights(conn, 'CORE').values())
+        for shard_count in [4, 8]:
+            for strategy in STRATEGIES:
+                result = run(harness, shard_count, strategy)
+                assignment(result)
+                shards = result['shards']
+                calls = [shard['api_calls'] for shard in shards]
+                seconds = [shard['seconds'] for shard in shards]
+                files = sum(len(files) for files in harness.dag.fn_merge_manifests(
+                    ti=mock.Mock(xcom_pull=lambda task_ids: [shard['manifest'] for shard in shards])).values())
+                print(f"  shards={shard_count}  {strategy:<8} channels={[shard['channels'] for shard in shards]}")
+                print(f"            api_calls={calls} max/mean={max(calls) / (sum(calls) / len(calls)):.2f} "
+                      f"makespan={max(seconds):.2f}s speedup={sum(seconds) / max(seconds):.1f}x files={files} "
+                      f"same_rows={result['core_rows'] == baseline['core_rows']}")
+                assert result['core_rows'] == baseline['core_rows']
+                if strategy == 'weighted':
+                    bound = MAX_IMBALANCE * max(sum(calls) / len(calls), heaviest_channel)
+                    assert max(calls) <= bound, f"heaviest shard {max(calls)} calls over {bound:.0f}"
+        # The DAG default: the plan of the last run is kept while the weights do not change
+        plans = [assignment(run(harness, 8, 'weighted', sticky=True)) for _ in range(2)]
+        plans.append(assignment(run(harness, 8, 'weighted')))
+        print(f"  shards=8  replanned with the same weights: sticky same_shards={plans[0] == plans[1]} "
+              f"from scratch same_shards={plans[0] == plans[2]}")
+        assert plans[0] == plans[1] == plans[2]
+    finally:
+        harness.close()
+
+
+if __name__ == '__main__':
+    main()
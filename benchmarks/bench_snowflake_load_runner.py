@@ -0,0 +1,58 @@
+# Compares the four load tasks run one after another on one shared connection
+# (two INFORMATION_SCHEMA queries per table) with SnowflakeLoadRunner over a
+# pool of fake DB-API connections.
+# Run from the repository root: python -m benchmarks.bench_snowflake_load_runner
+
+from dags.utils import SnowflakeLoader, SnowflakeConnectionPool, SnowflakeLoadRunner
+from .fake_warehouse import RecordingConnection
+import time
+
+
+# Rough per statement latencies of a small warehouse
+LATENCY = {'SELECT': 0.05, 'DELETE': 0.05, 'COPY': 0.4, 'MERGE': 0.6, 'INSERT': 0.4}
+
+
+def table_specs() -> list:
+    # The specs are module level config of the DAG, read them without importing airflow
+    source = open('dags/youtube-data-analytics-loader.py').read()
+    start = source.index('sf_table_specs = [')
+    end = source.index('\n]\n', start) + 3
+    namespace = {}
+    exec(source[start:end], namespace)
+    return namespace['sf_table_specs']
+
+
+def run_serial(specs: list) -> tuple:
+    conn = RecordingConnection(latency=LATENCY)
+    start = time.perf_counter()
+    for spec in specs:
+        loader_args = {k: v for k, v in spec.items() if k != 'dataset'}
+        sf_ldr = SnowflakeLoader(conn=conn, schema='CORE', **loader_args)
+        sf_ldr.s3_to_stg(files=[f"{spec['dataset']}.parquet"])
+        sf_ldr.stg_to_core()
+    return time.perf_counter() - start, len(conn.statements)
+
+
+def run_pooled(specs: list) -> tuple:
+    connections = []
+
+    def connect():
+        conn = RecordingConnection(latency=LATENCY)
+        connections.append(conn)
+        return conn
+
+    start = time.perf_counter()
+    runner = SnowflakeLoadRunner(pool=SnowflakeConnectionPool(connect, size=4), schema='CORE', table_specs=specs)
+    timings = runner.run({spec['dataset']: [f"{spec['dataset']}.parquet"] for spec in specs})
+    elapsed = time.perf_counter() - start
+    for dataset, t in timings.items():
+        print(f"    {dataset:<11} s3_to_stg={t['s3_to_stg']:.2f}s stg_to_core={t['stg_to_core']:.2f}s")
+    return elapsed, sum(len(conn.statements) for conn in connections)
+
+
+if __name__ == '__main__':
+    specs = table_specs()
+    serial, serial_statements = run_serial(specs)
+    print(f"  serial  time={serial:.2f}s statements={serial_statements}")
+    pooled, pooled_statements = run_pooled(specs)
+    print(f"  pooled  time={pooled:.2f}s statements={pooled_statements}")
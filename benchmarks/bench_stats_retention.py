@@ -0,0 +1,86 @@
+# Rows scanned by the stats MERGE of the latest rptg_dt (the hourly re-load of today's
+# snapshot) as the video stats history grows:
+# without and with the rptg_dt pruning predicate (SnowflakeLoader prune_on_col), and after
+# StatsRetention compacted the old snapshots. Runs on the DuckDB warehouse
+# (benchmarks/fake_warehouse.py) with the history inserted in rptg_dt order, like a table
+# clustered on it. DuckDB would derive the same filter from the join at runtime, that
+# optimizer is disabled so only literal predicates prune, as in a Snowflake compile time pruning.
+# Run from the repository root: python -m benchmarks.bench_stats_retention
+
+from dags.utils import SnowflakeLoader, StatsRetention
+from .fake_warehouse import DuckDBWarehouse
+import datetime
+import json
+import logging
+import os
+import tempfile
+import time
+
+
+CHANNELS = 5
+VIDEOS_PER_CHANNEL = 1000
+HISTORY_DAYS = [30, 90, 365, 730]
+NEW_DT = datetime.date(2024, 8, 10)
+
+
+def load_history(warehouse: DuckDBWarehouse, days: int) -> None:
+    first_dt = NEW_DT - datetime.timedelta(days=days - 1)
+    warehouse.db.execute(f"""
+        INSERT INTO CORE.TBL_YT_VIDEO_STATS
+        SELECT 'v' || c || '_' || v, 'UC' || c, DATE '{first_dt}' + d::INTEGER, 1000 + v * 7 + d * 3, 50 + v % 97 + d, 0, 5 + v % 13, TIMESTAMP '{NEW_DT} 10:00:00'
+        FROM range({days}) t3(d), range({CHANNELS}) t1(c), range({VIDEOS_PER_CHANNEL}) t2(v)
+        ORDER BY d""")
+    warehouse.db.execute(f"""
+        INSERT INTO CORE.TBL_STG_YT_VIDEO_STATS
+        SELECT 'v' || c || '_' || v, 'UC' || c, DATE '{NEW_DT}', 5000 + v * 7, 50 + v % 97, 0, 5 + v % 13, TIMESTAMP '{NEW_DT} 11:00:00'
+        FROM range({CHANNELS}) t1(c), range({VIDEOS_PER_CHANNEL}) t2(v)""")
+
+
+def profiled_merge(warehouse: DuckDBWarehouse, sql: str, profile_path: str) -> tuple:
+    """Runs the MERGE of the stage, returns (rows scanned, seconds)."""
+    db = warehouse.db
+    db.execute("PRAGMA enable_profiling='json'")
+    db.execute(f"PRAGMA profiling_output='{profile_path}'")
+    start = time.perf_counter()
+    db.execute(sql)
+    elapsed = time.perf_counter() - start
+    db.execute("PRAGMA disable_profiling")
+    with open(profile_path) as f:
+        scanned = json.load(f)['cumulative_rows_scanned']
+    return scanned, elapsed
+
+
+def run(days: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        warehouse = DuckDBWarehouse(tmp)
+        warehouse.db.execute("SET disabled_optimizers = 'join_filter_pushdown'")
+        load_history(warehouse, days)
+        loader = SnowflakeLoader(conn=warehouse.connect(), schema='CORE', s3_stage_name='stg_yt_video_stats',
+                                 stage_table_name='tbl_stg_yt_video_stats', core_table_name='tbl_yt_video_stats',
+                                 s3_col_map={}, load_type='MERGE', merge_on_col=['id', 'rptg_dt'], prune_on_col='rptg_dt')
+        profile_path = os.path.join(tmp, 'profile.json')
+        table_rows = warehouse.query("SELECT COUNT(*) FROM CORE.TBL_YT_VIDEO_STATS")[0][0]
+        full = profiled_merge(warehouse, loader.core_load_sql()[0], profile_path)
+        pruned = profiled_merge(warehouse, loader.core_load_sql((NEW_DT, NEW_DT))[0], profile_path)
+
+        start = time.perf_counter()
+        compacted = StatsRetention(warehouse.connect(), daily_days=90, weekly_days=365).run(as_of=NEW_DT)
+        compact_time = time.perf_counter() - start
+        compacted_rows = warehouse.query("SELECT COUNT(*) FROM CORE.TBL_YT_VIDEO_STATS")[0][0]
+        rollup_rows = warehouse.query("SELECT COUNT(*) FROM CORE.TBL_YT_VIDEO_STATS_ROLLUP")[0][0]
+        full_after = profiled_merge(warehouse, loader.core_load_sql()[0], profile_path)
+        pruned_after = profiled_merge(warehouse, loader.core_load_sql((NEW_DT, NEW_DT))[0], profile_path)
+
+        print(f"history_days={days} video_stats_rows={table_rows}")
+        print(f"  merge             rows_scanned={full[0]:<9} time={full[1] * 1000:7.1f}ms")
+        print(f"  merge pruned      rows_scanned={pruned[0]:<9} time={pruned[1] * 1000:7.1f}ms")
+        print(f"  compaction        daily_rows={compacted_rows} rollup_rows={rollup_rows} "
+              f"deleted={compacted['TBL_YT_VIDEO_STATS']['deleted']} time={compact_time * 1000:.0f}ms")
+        print(f"  merge compacted   rows_scanned={full_after[0]:<9} time={full_after[1] * 1000:7.1f}ms")
+        print(f"  pruned compacted  rows_scanned={pruned_after[0]:<9} time={pruned_after[1] * 1000:7.1f}ms")
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for days in HISTORY_DAYS:
+        run(days)
@@ -0,0 +1,64 @@
+# Compares the Parquet files and COPY statements of the untyped datasets (API strings)
+# with the ones coerced to DATASET_SCHEMAS, for the video and video_md datasets at
+# 10k, 100k and 1M rows. Reports file size, write time, coercion time and the COPY projection.
+# Run from the repository root: python -m benchmarks.bench_typed_parquet
+
+from dags.utils import ColumnarBuilder, DATASET_SCHEMAS, SnowflakeLoader, coerce_table
+from .fake_warehouse import RecordingConnection
+import datetime
+import io
+import random
+import time
+import pyarrow.parquet as pq
+
+
+def build(rows: int) -> tuple:
+    rnd = random.Random(0)
+    now = datetime.datetime(2024, 8, 8, 10, 0, 0)
+    video = ColumnarBuilder(['id','channel_id','rptg_dt','views','likes','dislikes','comments','etl_ts'])
+    video_md = ColumnarBuilder(['id','channel_id','title','url','publishedAt','etl_ts'])
+    for i in range(rows):
+        channel_id = f"UC{i % 50:022d}"
+        views = int(rnd.paretovariate(1.2) * 500)
+        video.append({'id': f"v{i:010d}", 'views': str(views), 'likes': str(views // 20),
+                      'dislikes': '0', 'comments': str(views // 200)},
+                     channel_id=channel_id, rptg_dt='2024-08-08', etl_ts='2024-08-08 10:00:00')
+        published = now - datetime.timedelta(minutes=rnd.randrange(0, 60 * 24 * 730))
+        video_md.append({'id': f"v{i:010d}", 'title': f"Video {i}", 'url': f"https://www.youtube.com/watch?v=v{i:010d}",
+                         'publishedAt': published.strftime("%Y-%m-%dT%H:%M:%SZ")},
+                        channel_id=channel_id, etl_ts='2024-08-08 10:00:00')
+    return {'video': video.to_table(), 'video_md': video_md.to_table()}
+
+
+def write(table) -> tuple:
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression='snappy')
+    return buffer.getbuffer().nbytes, time.perf_counter() - start
+
+
+def copy_sql(s3_schema) -> str:
+    conn = RecordingConnection()
+    loader = SnowflakeLoader(conn=conn, schema='CORE', s3_stage_name='stg_yt_video_stats',
+                             stage_table_name='tbl_stg_yt_video_stats', core_table_name='tbl_yt_video_stats',
+                             s3_col_map={'id': 'id', 'rptg_dt': 'rptg_dt', 'views': 'view_count', 'etl_ts': 'etl_ts'},
+                             load_type='MERGE', merge_on_col=['id', 'rptg_dt'], s3_schema=s3_schema)
+    loader.s3_to_stg(files=['video.parquet'])
+    copy = [sql for sql in conn.statements if 'COPY INTO' in sql][0]
+    return ' '.join(line.strip() for line in copy.splitlines() if '$1:' in line)
+
+
+if __name__ == '__main__':
+    for rows in [10000, 100000, 1000000]:
+        print(f"rows={rows}")
+        for dataset, table in build(rows).items():
+            untyped_bytes, untyped_write = write(table)
+            start = time.perf_counter()
+            typed = coerce_table(table, DATASET_SCHEMAS[dataset])
+            coerce_time = time.perf_counter() - start
+            typed_bytes, typed_write = write(typed)
+            print(f"  {dataset:<9} untyped {untyped_bytes / 1e6:7.2f} MB write {untyped_write:.3f}s   "
+                  f"typed {typed_bytes / 1e6:7.2f} MB write {typed_write:.3f}s coerce {coerce_time:.3f}s   "
+                  f"({typed_bytes / untyped_bytes:.0%})")
+    print("COPY projection, untyped:", copy_sql(None))
+    print("COPY projection, typed:  ", copy_sql(DATASET_SCHEMAS['video']))
@@ -0,0 +1,86 @@
+# HTTP requests and wall time of the videos().list calls with one request per page
+# (YoutubeExtractor default) vs the cross channel VideoIdBatcher (requests_per_batch),
+# on channels of very uneven size: most have a few dozen videos, a few have thousands.
+# Each mode extracts the channels in full, then again incrementally with a VideoStateStore,
+# which splits every page into a 'snippet,statistics' and a 'statistics' request.
+# Both run with and without a checkpoint, with a checkpoint every channel waits for a
+# page's statistics before fetching the next page.
+# Run from the repository root:
+#   python -m benchmarks.bench_video_batching [--latency 0.05] [--max-wait 0.05]
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from dags.utils import ExtractionCheckpoint, VideoStateStore, YoutubeExtractor
+from .bench_shard_balance import channel_sizes
+from .fake_youtube import FakeYoutube, make_channels
+
+
+CHANNELS = 120
+MAX_WORKERS = 8
+
+
+def extract(fake: FakeYoutube, channel_list: list, tmp: str, label: str, checkpoint: bool,
+            requests_per_batch: int, max_wait: float) -> dict:
+    state_store = VideoStateStore(os.path.join(tmp, f"{label}-state.json"))
+    runs = {}
+    for run in ['full', 'incremental']:
+        fake.reset_counters()
+        extractor = YoutubeExtractor(service_account_info={}, max_workers=MAX_WORKERS, youtube=fake,
+                                     requests_per_batch=requests_per_batch, batch_max_wait=max_wait)
+        run_checkpoint = ExtractionCheckpoint(os.path.join(tmp, 'checkpoints'), f"{label}-{run}") if checkpoint else None
+        start = time.perf_counter()
+        results, errors = extractor.extract(channel_list, checkpoint=run_checkpoint, fetch_mode='playlist',
+                                            state_store=state_store if run == 'incremental' else None)
+        seconds = time.perf_counter() - start
+        assert not errors, errors
+        if run == 'full':
+            # Seeds the state, so the incremental run refreshes the due videos only
+            for channel_name in channel_list:
+                state_store.record_batch(results[channel_name][1])
+        runs[run] = {
+            'seconds': seconds,
+            'http_requests': fake.http_requests,
+            'videos_calls': fake.calls.get('videos.list', 0),
+            'quota': fake.total_quota,
+            'rows': {name: sorted(video['id'] for video in results[name][1]) for name in channel_list},
+            'stats': {name: sorted((video['id'], video['views']) for video in results[name][1]) for name in channel_list},
+        }
+    return runs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per HTTP request')
+    parser.add_argument('--max-wait', type=float, default=0.05, help='batch_max_wait of the batcher')
+    parser.add_argument('--requests-per-batch', type=int, default=10)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    sizes = channel_sizes(CHANNELS)
+    small = sum(1 for size in sizes if size < 50)
+    print(f"channels={CHANNELS} videos={sum(sizes)} under_50_videos={small} largest={sorted(sizes)[-3:]} "
+          f"latency={args.latency}s max_wait={args.max_wait}s requests_per_batch={args.requests_per_batch}")
+    fake = FakeYoutube(make_channels(CHANNELS, sizes), latency=args.latency)
+    channel_list = [f"channel{i}" for i in range(CHANNELS)]
+    for checkpoint in [False, True]:
+        with tempfile.TemporaryDirectory() as tmp:
+            per_page = extract(fake, channel_list, tmp, 'per_page', checkpoint, None, args.max_wait)
+            batched = extract(fake, channel_list, tmp, 'batched', checkpoint, args.requests_per_batch, args.max_wait)
+        for run in ['full', 'incremental']:
+            a, b = per_page[run], batched[run]
+            print(f"  checkpoint={str(checkpoint):<5} {run:<11} "
+                  f"http_requests={a['http_requests']}->{b['http_requests']} ({1 - b['http_requests'] / a['http_requests']:.0%} fewer) "
+                  f"videos.list={a['videos_calls']}->{b['videos_calls']} quota={a['quota']}->{b['quota']} "
+                  f"seconds={a['seconds']:.2f}->{b['seconds']:.2f} ({a['seconds'] / b['seconds']:.1f}x) "
+                  f"same_rows={a['rows'] == b['rows'] and a['stats'] == b['stats']}")
+            # The batcher only changes how the calls are packed, never what is fetched
+            assert a['rows'] == b['rows'] and a['stats'] == b['stats']
+            assert b['http_requests'] < a['http_requests'] and b['videos_calls'] < a['videos_calls']
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+# Compares the quota units and HTTP calls spent per channel by the 'search' and
+# 'playlist' fetch modes of YoutubeChannel.get_video_data.
+# Run from the repository root: python -m benchmarks.bench_video_fetch_quota
+
+from dags.utils import YoutubeChannel
+from .fake_youtube import FakeYoutube, make_channels, patched_youtube
+
+
+def run(videos_per_channel: int, days_count: int = 365) -> None:
+    fake = FakeYoutube(make_channels(1, videos_per_channel))
+    with patched_youtube(fake):
+        channelObj = YoutubeChannel(service_account_info={}, channel_name='channel0')
+
+    print(f"videos_per_channel={videos_per_channel} days_count={days_count}")
+    for fetch_mode in ['search', 'playlist']:
+        fake.reset_counters()
+        video_data = channelObj.get_video_data(days_count=days_count, fetch_mode=fetch_mode)
+        calls = ', '.join(f"{k}={v}" for k, v in sorted(fake.calls.items()))
+        print(f"  {fetch_mode:<8} videos={len(video_data):<6} quota_units={fake.total_quota:<6} http_calls={fake.total_calls:<5} ({calls})")
+
+
+if __name__ == '__main__':
+    for videos_per_channel in [20, 500, 5000]:
+        run(videos_per_channel)
@@ -0,0 +1,109 @@
+# Memory held by the video records of one channel per 100k videos: a dict per video with
+# string counts and the url (how get_video_statistics built them before VideoBatch) vs
+# VideoBatch, plus the time to build them from the API pages and to turn them into the
+# typed video and video_md tables of the extract task.
+# Run from the repository root: python -m benchmarks.bench_video_records
+
+from dags.utils import VideoBatch, ColumnarBuilder, DATASET_SCHEMAS, coerce_table
+from .fake_youtube import FakeYoutube, make_channels
+import gc
+import json
+import time
+import tracemalloc
+
+
+VIDEO_COUNTS = [10000, 100000, 300000]
+
+
+def legacy_rows(items: list) -> list:
+    # The rows get_video_statistics returned before VideoBatch
+    rows = []
+    for item in items:
+        snippet = item.get('snippet', {})
+        rows.append({
+            'id': item['id'],
+            'title': snippet.get('title'),
+            'url': f"https://www.youtube.com/watch?v={item['id']}",
+            'views': item['statistics'].get('viewCount', '0'),
+            'likes': item['statistics'].get('likeCount', '0'),
+            'dislikes': item['statistics'].get('dislikeCount', '0'),
+            'comments': item['statistics'].get('commentCount', '0'),
+            'publishedAt': snippet.get('publishedAt')
+        })
+    return rows
+
+
+def api_pages(fake: FakeYoutube, video_ids: list):
+    # Through JSON like a real response, so the records own their strings
+    for start in range(0, len(video_ids), 50):
+        response = fake.videos().list(part='snippet,statistics', id=','.join(video_ids[start:start + 50])).execute()
+        yield json.loads(json.dumps(response['items']))
+
+
+def measure(build, fake: FakeYoutube, video_ids: list) -> tuple:
+    """Returns (records, bytes retained by them, build seconds without tracing and the API pages)."""
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    records = build(api_pages(fake, video_ids))
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    pages = list(api_pages(fake, video_ids))
+    start = time.perf_counter()
+    build(pages)
+    elapsed = time.perf_counter() - start
+    return records, retained, elapsed
+
+
+def build_legacy(pages) -> list:
+    rows = []
+    for items in pages:
+        rows.extend(legacy_rows(items))
+    return rows
+
+
+def build_batch(pages) -> VideoBatch:
+    videos = VideoBatch()
+    for items in pages:
+        videos.extend(VideoBatch.from_items(items))
+    return videos
+
+
+def to_tables_legacy(rows: list) -> tuple:
+    video = ColumnarBuilder(['id', 'channel_id', 'rptg_dt', 'views', 'likes', 'dislikes', 'comments', 'etl_ts'], key_columns=['id'])
+    video_md = ColumnarBuilder(['id', 'channel_id', 'title', 'url', 'publishedAt', 'etl_ts'], key_columns=['id'])
+    extra = {'channel_id': 'UC0', 'etl_ts': '2024-08-10 10:00:00'}
+    video.extend(rows, rptg_dt='2024-08-10', **extra)
+    video_md.extend([row for row in rows if row.get('md_changed', True)], **extra)
+    return coerce_table(video.to_table(), DATASET_SCHEMAS['video']), coerce_table(video_md.to_table(), DATASET_SCHEMAS['video_md'])
+
+
+def to_tables_batch(videos: VideoBatch) -> tuple:
+    video = ColumnarBuilder(['id', 'channel_id', 'rptg_dt', 'views', 'likes', 'dislikes', 'comments', 'etl_ts'], key_columns=['id'])
+    video_md = ColumnarBuilder(['id', 'channel_id', 'title', 'url', 'publishedAt', 'etl_ts'], key_columns=['id'])
+    extra = {'channel_id': 'UC0', 'etl_ts': '2024-08-10 10:00:00'}
+    video.extend_columns(videos.columns(), rptg_dt='2024-08-10', **extra)
+    video_md.extend_columns(videos.changed().columns(), **extra)
+    return coerce_table(video.to_table(), DATASET_SCHEMAS['video']), coerce_table(video_md.to_table(), DATASET_SCHEMAS['video_md'])
+
+
+def run(video_count: int) -> None:
+    fake = FakeYoutube(make_channels(1, video_count))
+    video_ids = [v['id'] for v in fake._channels['channel0'].videos]
+    print(f"videos={video_count}")
+    results = {}
+    for name, build, to_tables in [('dict rows', build_legacy, to_tables_legacy), ('VideoBatch', build_batch, to_tables_batch)]:
+        records, retained, build_time = measure(build, fake, video_ids)
+        start = time.perf_counter()
+        tables = to_tables(records)
+        table_time = time.perf_counter() - start
+        results[name] = tables
+        print(f"  {name:<11} retained={retained / 1e6:7.1f}MB per_100k={retained / video_count * 1e5 / 1e6:6.1f}MB "
+              f"bytes_per_video={retained / video_count:5.0f} build={build_time:.2f}s to_tables={table_time:.2f}s")
+    print(f"  tables_equal={all(a.equals(b) for a, b in zip(results['dict rows'], results['VideoBatch']))}")
+
+
+if __name__ == '__main__':
+    for video_count in VIDEO_COUNTS:
+        run(video_count)
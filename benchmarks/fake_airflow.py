@@ -0,0 +1,113 @@
+# Just enough of the airflow API for the DAG file to be imported and its task
+# callables run by the local harness when airflow is not installed. With airflow
+# installed the harness imports the real one and this module is not used.
+
+import sys
+import types
+
+
+class DAG():
+    def __init__(self, dag_id: str, **kwargs) -> None:
+        self.dag_id = dag_id
+        self.kwargs = kwargs
+        self.tasks = {}
+
+
+class PythonOperator():
+    # The PythonOperator and BaseOperator arguments a DAG may pass. Like airflow 2, anything
+    # else (provide_context, a typo) fails the DAG import.
+    ARGUMENTS = {'op_args', 'op_kwargs', 'templates_dict', 'templates_exts', 'show_return_value_in_logs',
+                 'owner', 'email', 'email_on_retry', 'email_on_failure', 'retries', 'retry_delay',
+                 'retry_exponential_backoff', 'max_retry_delay', 'start_date', 'end_date', 'depends_on_past',
+                 'wait_for_downstream', 'params', 'default_args', 'priority_weight', 'weight_rule', 'queue',
+                 'pool', 'pool_slots', 'sla', 'execution_timeout', 'on_execute_callback', 'on_failure_callback',
+                 'on_success_callback', 'on_retry_callback', 'trigger_rule', 'resources', 'run_as_user',
+                 'task_concurrency', 'max_active_tis_per_dag', 'executor_config', 'do_xcom_push', 'inlets',
+                 'outlets', 'task_group', 'doc', 'doc_md', 'doc_json', 'doc_yaml', 'doc_rst'}
+
+    def __init__(self, task_id: str, python_callable, dag: DAG = None, **kwargs) -> None:
+        self._check_arguments(task_id, kwargs)
+        self.task_id = task_id
+        self.python_callable = python_callable
+        self.downstream = []
+        if dag is not None:
+            dag.tasks[task_id] = self
+
+    @classmethod
+    def _check_arguments(cls, task_id: str, kwargs: dict) -> None:
+        invalid = sorted(set(kwargs) - cls.ARGUMENTS)
+        if invalid:
+            raise TypeError(f"Invalid arguments were passed to PythonOperator (task_id: {task_id}): {invalid}")
+
+    def __rshift__(self, other: 'PythonOperator') -> 'PythonOperator':
+        self.downstream.append(other)
+        return other
+
+    @property
+    def output(self) -> 'XComArg':
+        return XComArg(self)
+
+    @classmethod
+    def partial(cls, task_id: str, python_callable, dag: DAG = None, **kwargs) -> 'PartialOperator':
+        cls._check_arguments(task_id, kwargs)
+        return PartialOperator(cls, task_id, python_callable, dag, kwargs)
+
+
+class XComArg():
+    def __init__(self, operator: PythonOperator) -> None:
+        self.operator = operator
+
+
+class PartialOperator():
+    def __init__(self, operator_class: type, task_id: str, python_callable, dag: DAG, kwargs: dict) -> None:
+        self.operator_class = operator_class
+        self.task_id = task_id
+        self.python_callable = python_callable
+        self.dag = dag
+        self.kwargs = kwargs
+
+    def expand(self, **mapped) -> PythonOperator:
+        # The harness runs the mapped instances itself, the operator only records what it maps over
+        operator = self.operator_class(self.task_id, self.python_callable, dag=self.dag, **self.kwargs)
+        operator.expand_input = mapped
+        return operator
+
+
+class Variable():
+    values = {}
+
+    @classmethod
+    def get(cls, key: str, default_var=None, deserialize_json: bool = False):
+        return cls.values.get(key, default_var)
+
+    @classmethod
+    def set(cls, key: str, value, serialize_json: bool = False) -> None:
+        cls.values[key] = value
+
+
+class BaseHook():
+    @classmethod
+    def get_connection(cls, conn_id: str):
+        raise RuntimeError(f"No airflow connections in the local harness: {conn_id}")
+
+
+def install() -> None:
+    """Registers the stand-in as the airflow package unless a real airflow is importable."""
+    try:
+        import airflow  # noqa: F401
+        return
+    except ImportError:
+        pass
+    modules = {
+        'airflow': {'DAG': DAG},
+        'airflow.operators': {},
+        'airflow.operators.python_operator': {'PythonOperator': PythonOperator},
+        'airflow.operators.python': {'PythonOperator': PythonOperator},
+        'airflow.models': {'Variable': Variable, 'DAG': DAG},
+        'airflow.hooks': {},
+        'airflow.hooks.base': {'BaseHook': BaseHook},
+    }
+    for name, attrs in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
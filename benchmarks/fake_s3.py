@@ -0,0 +1,104 @@
+# Filesystem stand-in for the boto3 S3 client calls made by S3MultipartStream and the
+# S3 extraction checkpoints.
+# Objects are written to <root>/<bucket>/<key>, so a local stage directory can be
+# read back by the warehouse stand-in. Multipart parts are appended to a temp file.
+# latency adds a round trip of that many seconds to every request.
+
+from typing import Dict, Optional
+from botocore.exceptions import ClientError
+import io
+import itertools
+import os
+import threading
+import time
+
+
+class LocalS3Client():
+    def __init__(self, root: str, latency: Optional[float] = 0.0) -> None:
+        self.root = root
+        self.latency = latency
+        self.bytes_written = 0
+        self.requests = 0
+        self._uploads = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def _count(self, nbytes: int = 0) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            self.bytes_written += nbytes
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs) -> Dict:
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(Body)
+        self._count(len(Body))
+        return {}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        self._count()
+        try:
+            with open(self.path(Bucket, Key), 'rb') as f:
+                return {'Body': io.BytesIO(f.read())}
+        except FileNotFoundError:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': Key}}, 'GetObject')
+
+    def list_objects_v2(self, Bucket: str, Prefix: Optional[str] = '', **kwargs) -> Dict:
+        self._count()
+        bucket_dir = os.path.join(self.root, Bucket)
+        keys = sorted(os.path.relpath(os.path.join(directory, name), bucket_dir).replace(os.sep, '/')
+                      for directory, _, names in os.walk(bucket_dir) for name in names)
+        return {'Contents': [{'Key': key} for key in keys if key.startswith(Prefix) and not key.endswith('.part')]}
+
+    def get_paginator(self, operation: str) -> 'LocalPaginator':
+        return LocalPaginator(getattr(self, operation))
+
+    def delete_objects(self, Bucket: str, Delete: Dict, **kwargs) -> Dict:
+        for item in Delete['Objects']:
+            try:
+                os.remove(self.path(Bucket, item['Key']))
+            except FileNotFoundError:
+                pass
+        self._count()
+        return {}
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        upload_id = str(next(self._ids))
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._uploads[upload_id] = f"{path}.{upload_id}.part"
+        open(self._uploads[upload_id], 'wb').close()
+        self._count()
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes, **kwargs) -> Dict:
+        # S3MultipartStream uploads parts in order, so appending keeps them in place
+        with open(self._uploads[UploadId], 'ab') as f:
+            f.write(Body)
+        self._count(len(Body))
+        return {'ETag': f"\"{UploadId}-{PartNumber}\""}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> Dict:
+        os.replace(self._uploads.pop(UploadId), self.path(Bucket, Key))
+        self._count()
+        return {}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> Dict:
+        os.remove(self._uploads.pop(UploadId))
+        self._count()
+        return {}
+
+
+class LocalPaginator():
+    # Everything fits in one page
+    def __init__(self, operation) -> None:
+        self._operation = operation
+
+    def paginate(self, **kwargs):
+        yield self._operation(**kwargs)
@@ -0,0 +1,293 @@
+# Stand-ins for the Snowflake warehouse, both built from database/ddl /object_definition.ddl.
+#
+# RecordingConnection is a minimal DB-API connection. It answers the
+# INFORMATION_SCHEMA.COLUMNS lookups from the DDL's tables, records every statement and
+# sleeps a configurable latency per statement kind, so the SnowflakeLoader SQL flow can
+# be timed and inspected without a warehouse or duckdb.
+#
+# DuckDBWarehouse runs the SQL. Its tables and external stages are created from the DDL
+# (without their CLUSTER BY), with each stage URL mapped to a
+# local directory (see fake_s3.LocalS3Client). A table's internal stage (@SCHEMA.%TABLE) is the
+# directory <s3_root>/_internal/SCHEMA/TABLE. Connections follow the DB-API calls
+# SnowflakeLoader makes and run its SQL, rewriting the Snowflake only parts:
+#  - COPY INTO ... FROM (SELECT $1:col::TYPE AS c FROM @stage) becomes an INSERT from read_parquet
+#  - PUT with a file_stream and REMOVE write and delete files of an internal stage
+#  - INSERT OVERWRITE becomes DELETE + INSERT in one transaction
+#  - MERGE returns (rows inserted, rows updated) like Snowflake does
+#  - execute(num_statements=n) runs n statements in one round trip, nextset() steps through them
+# latency adds a round trip of that many seconds to every statement, put_latency the
+# upload to the stage's cloud storage a PUT makes on top of it.
+# DuckDBWarehouse requires duckdb >= 1.4 (MERGE INTO): pip install duckdb
+
+from typing import Optional, Dict, List
+import glob
+import itertools
+import os
+import re
+import threading
+import time
+
+
+DDL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database', 'ddl ', 'object_definition.ddl')
+
+# Snowflake types of the COPY projections and the DDL, in DuckDB
+_TYPES = {'NUMBER': 'BIGINT', 'TIMESTAMP_NTZ': 'TIMESTAMP', 'VARCHAR': 'VARCHAR', 'DATE': 'DATE'}
+
+_COPY = re.compile(r"COPY INTO\s+(\S+)\s*\(([^)]*)\)\s*FROM\s*\(\s*SELECT(.*?)FROM\s+@([\w.%]+)\s*\)(.*)", re.S | re.I)
+_PUT = re.compile(r"PUT\s+'file://([^']+)'\s+'@([\w.%]+)/?([^']*)'", re.I)
+_REMOVE = re.compile(r"REMOVE\s+'@([\w.%]+)/?([^']*)'", re.I)
+_PROJECTION = re.compile(r"\$1:(\w+)::(\w+)\s+AS\s+(\w+)", re.I)
+_FILES = re.compile(r"FILES\s*=\s*\(([^)]*)\)", re.I)
+_INSERT_OVERWRITE = re.compile(r"insert overwrite into\s+(\S+)", re.I)
+
+_query_ids = itertools.count(1)
+
+
+def parse_ddl(ddl: str) -> tuple:
+    """Returns ({stage name: S3 URL}, [CREATE TABLE statements for DuckDB]) of the DDL file."""
+    stages = {name.upper(): url for name, url in
+              re.findall(r"CREATE OR REPLACE STAGE\s+(\w+)\s+URL\s*=\s*'([^']+)'", ddl, re.I)}
+    tables = []
+    for statement in re.findall(r"create or replace TABLE\s+[^;]+;", ddl, re.I):
+        statement = re.sub(r"\bTESTDB\.", '', statement, flags=re.I)
+        statement = re.sub(r"timestamp_ntz\(\d\)", 'TIMESTAMP', statement, flags=re.I)
+        statement = re.sub(r"\)\s*cluster by\s*\(.*\)\s*;", ');', statement, flags=re.I | re.S)
+        tables.append(statement.upper())
+    return stages, tables
+
+
+def ddl_columns(ddl_path: Optional[str] = DDL_PATH) -> Dict[str, List[str]]:
+    """Returns {table name: [column names]} of the DDL's tables, without their schema."""
+    with open(ddl_path) as f:
+        _, tables = parse_ddl(f.read())
+    columns = {}
+    for statement in tables:
+        name, body = re.match(r"CREATE OR REPLACE TABLE\s+(?:\w+\.)?(\w+)\s*\((.*)\)\s*;", statement, re.S).groups()
+        columns[name] = [line.split()[0] for line in body.split(',\n') if line.strip()]
+    return columns
+
+
+class RecordingCursor():
+    def __init__(self, conn: 'RecordingConnection') -> None:
+        self._conn = conn
+        self._rows = []
+        self.sfqid = None
+        self.rowcount = -1
+
+    def execute(self, sql: str, *args, **kwargs) -> 'RecordingCursor':
+        self._conn._record(sql)
+        self.sfqid = f"fake-{next(_query_ids)}"
+        self._rows = self._conn._answer(sql)
+        self.rowcount = len(self._rows)
+        return self
+
+    def fetchall(self) -> List[tuple]:
+        return self._rows
+
+    def fetchone(self) -> Optional[tuple]:
+        return self._rows[0] if self._rows else None
+
+    def close(self) -> None:
+        pass
+
+
+class RecordingConnection():
+    def __init__(self, tables: Optional[Dict[str, List[str]]] = None, latency: Optional[Dict[str, float]] = None) -> None:
+        # tables defaults to the DDL's tables, {table name: [column names]}
+        self.tables = tables or ddl_columns()
+        # Seconds per statement, keyed by the first keyword of the statement
+        self.latency = latency or {}
+        self.statements = []
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def cursor(self) -> RecordingCursor:
+        return RecordingCursor(self)
+
+    def close(self) -> None:
+        self.closed = True
+
+    def commit(self) -> None:
+        pass
+
+    def _record(self, sql: str) -> None:
+        with self._lock:
+            self.statements.append(sql)
+        kind = sql.split(None, 1)[0].upper() if sql.strip() else ''
+        if self.latency.get(kind):
+            time.sleep(self.latency[kind])
+
+    def _answer(self, sql: str) -> List[tuple]:
+        if 'INFORMATION_SCHEMA.COLUMNS' not in sql.upper():
+            return []
+        single = re.search(r"TABLE_NAME\s*=\s*'([^']+)'", sql)
+        if single:
+            return [(col,) for col in self.tables.get(single.group(1), [])]
+        names = re.findall(r"'([^']+)'", sql.split(' IN ', 1)[1])
+        return [(name, col) for name in sorted(names) for col in self.tables.get(name, [])]
+
+
+class WarehouseCursor():
+    def __init__(self, conn: 'WarehouseConnection') -> None:
+        self._conn = conn
+        self._rows = []
+        self.sfqid = None
+        self.rowcount = -1
+        self.description = None
+
+    def execute(self, sql: str, *args, file_stream=None, num_statements=None, **kwargs) -> 'WarehouseCursor':
+        self._conn.statements.append(sql)
+        self.sfqid = f"duckdb-{next(_query_ids)}"
+        if self._conn._warehouse.latency:
+            time.sleep(self._conn._warehouse.latency)
+        # Like Snowflake, num_statements runs that many ; separated statements in the one
+        # round trip and nextset() moves to the next one's result
+        statements = [statement for statement in sql.split(';') if statement.strip()] if num_statements else [sql]
+        if num_statements and len(statements) != num_statements:
+            raise Exception(f"Actual statement count {len(statements)} did not match the desired statement count {num_statements}.")
+        self._results = []
+        for statement in statements:
+            self._results.append((self._conn._execute(statement, file_stream), self._conn.description))
+        self._result = -1
+        self.nextset()
+        return self
+
+    def nextset(self) -> Optional['WarehouseCursor']:
+        if self._result + 1 >= len(self._results):
+            return None
+        self._result += 1
+        self._rows, self.description = self._results[self._result]
+        self.rowcount = len(self._rows)
+        return self
+
+    def fetchall(self) -> List[tuple]:
+        return self._rows
+
+    def fetchone(self) -> Optional[tuple]:
+        return self._rows[0] if self._rows else None
+
+    def close(self) -> None:
+        pass
+
+
+class WarehouseConnection():
+    def __init__(self, warehouse: 'DuckDBWarehouse') -> None:
+        self._warehouse = warehouse
+        self._db = warehouse.db.cursor()
+        self.statements = []
+        self.closed = False
+        # Column descriptions of the last query's result
+        self.description = None
+
+    def cursor(self) -> WarehouseCursor:
+        return WarehouseCursor(self)
+
+    def commit(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+        self._db.close()
+
+    def _execute(self, sql: str, file_stream=None) -> List[tuple]:
+        self.description = None
+        copy = _COPY.search(sql)
+        if copy:
+            return self._copy(*copy.groups())
+        put = _PUT.match(sql.strip())
+        if put:
+            return self._put(*put.groups(), file_stream)
+        remove = _REMOVE.match(sql.strip())
+        if remove:
+            return self._remove(*remove.groups())
+        overwrite = _INSERT_OVERWRITE.search(sql)
+        if overwrite:
+            table = overwrite.group(1)
+            self._db.execute('BEGIN TRANSACTION')
+            try:
+                self._db.execute(f"DELETE FROM {table}")
+                rows = self._db.execute(_INSERT_OVERWRITE.sub(f"INSERT INTO {table}", sql)).fetchall()
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            return rows
+        if re.match(r"\s*MERGE INTO\s+(\S+)", sql, re.I):
+            table = re.match(r"\s*MERGE INTO\s+(\S+)", sql, re.I).group(1)
+            before = self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            changed = self._db.execute(sql).fetchone()[0]
+            inserted = self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] - before
+            return [(inserted, changed - inserted)]
+        result = self._db.execute(sql)
+        self.description = result.description
+        return result.fetchall() if result.description else []
+
+    def _put(self, file_name: str, stage: str, directory: str, file_stream) -> List[tuple]:
+        if self._warehouse.put_latency:
+            time.sleep(self._warehouse.put_latency)
+        path = os.path.join(self._warehouse.stage_dir(stage), directory, file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = file_stream.read()
+        with open(path, 'wb') as f:
+            f.write(data)
+        # Snowflake returns source, target, source_size, target_size, ..., status per file
+        return [(file_name, file_name, len(data), len(data), 'PARQUET', 'PARQUET', 'UPLOADED', '')]
+
+    def _remove(self, stage: str, prefix: str) -> List[tuple]:
+        stage_dir = self._warehouse.stage_dir(stage)
+        removed = []
+        for path in glob.glob(os.path.join(stage_dir, '**', '*'), recursive=True):
+            name = os.path.relpath(path, stage_dir)
+            if os.path.isfile(path) and name.startswith(prefix):
+                os.remove(path)
+                removed.append((name, 'removed'))
+        return removed
+
+    def _copy(self, table: str, columns: str, projection: str, stage: str, options: str) -> List[tuple]:
+        stage_dir = self._warehouse.stage_dir(stage)
+        files = _FILES.search(options)
+        if files:
+            paths = [os.path.join(stage_dir, f.strip().strip("'")) for f in files.group(1).split(',')]
+        else:
+            paths = sorted(glob.glob(os.path.join(stage_dir, '**', '*.parquet'), recursive=True))
+        if not paths:
+            return []
+        select = ', '.join(f'"{src}"' if sf_type.upper() == 'VARIANT' else f'CAST("{src}" AS {_TYPES[sf_type.upper()]})'
+                           for src, sf_type, _ in _PROJECTION.findall(projection))
+        file_list = ', '.join(f"'{path}'" for path in paths)
+        self._db.execute(f"INSERT INTO {table} ({columns}) SELECT {select} FROM read_parquet([{file_list}])")
+        # Snowflake returns file, status, rows_parsed, rows_loaded, ... per file
+        per_file = dict(self._db.execute(f"SELECT filename, COUNT(*) FROM read_parquet([{file_list}], filename = true) GROUP BY filename").fetchall())
+        return [(path, 'LOADED', per_file.get(path, 0), per_file.get(path, 0)) for path in paths]
+
+
+class DuckDBWarehouse():
+    """DuckDB database with the tables of the DDL, its stages read from s3_root/<bucket>/<prefix>."""
+    def __init__(self, s3_root: str, path: Optional[str] = ':memory:', ddl_path: Optional[str] = DDL_PATH,
+                 latency: Optional[float] = 0.0, put_latency: Optional[float] = 0.0) -> None:
+        self.s3_root = s3_root
+        self.latency = latency
+        self.put_latency = put_latency
+        import duckdb
+        self.db = duckdb.connect(path)
+        with open(ddl_path) as f:
+            self.stages, tables = parse_ddl(f.read())
+        self.db.execute('CREATE SCHEMA IF NOT EXISTS CORE')
+        self.db.execute('CREATE SCHEMA IF NOT EXISTS SEMANTIC')
+        for statement in tables:
+            self.db.execute(statement)
+        self._lock = threading.Lock()
+
+    def stage_dir(self, stage: str) -> str:
+        if '.%' in stage:
+            schema, table = stage.upper().split('.%')
+            return os.path.join(self.s3_root, '_internal', schema, table)
+        url = self.stages[stage.upper()]
+        return os.path.join(self.s3_root, url[len('s3://'):])
+
+    def connect(self) -> WarehouseConnection:
+        with self._lock:
+            return WarehouseConnection(self)
+
+    def query(self, sql: str) -> List[tuple]:
+        return self.db.cursor().execute(sql).fetchall()
@@ -0,0 +1,284 @@
+# In-process stand-in for the googleapiclient YouTube Data API v3 resource.
+# It serves synthetic channels/videos, counts calls and quota units per API method
+# and HTTP requests, a batch request being one HTTP request for all its calls. It can
+# inject latency, transient errors and a daily quota, so the extractor can be
+# benchmarked without Google credentials.
+
+from typing import Any, Optional, Dict, List, Union
+from contextlib import contextmanager
+from unittest import mock
+from googleapiclient.errors import HttpError
+import datetime
+import httplib2
+import json
+import random
+import threading
+import time
+
+
+# Quota units charged by the YouTube Data API per call
+QUOTA_COST = {
+    'search.list': 100,
+    'channels.list': 1,
+    'videos.list': 1,
+    'playlistItems.list': 1,
+}
+
+
+class WorkerKilled(Exception):
+    pass
+
+
+def http_error(status: int, reason: str) -> HttpError:
+    content = json.dumps({'error': {'code': status, 'errors': [{'reason': reason}]}}).encode()
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+class FakeChannel():
+    def __init__(self, name: str, channel_id: str, videos: List[Dict]) -> None:
+        self.name = name
+        self.channel_id = channel_id
+        # Videos are kept newest first, the same order as the uploads playlist
+        self.videos = sorted(videos, key=lambda v: v['publishedAt'], reverse=True)
+
+
+def make_channels(channel_count: int, videos_per_channel: Union[int, List[int]], days_span: int = 730) -> Dict[str, FakeChannel]:
+    """Builds channel_count synthetic channels with videos spread evenly over days_span days.
+
+    videos_per_channel is one count for every channel or a list with each channel's count.
+    """
+    now = datetime.datetime.utcnow()
+    if isinstance(videos_per_channel, int):
+        videos_per_channel = [videos_per_channel] * channel_count
+    channels = {}
+    for c in range(channel_count):
+        channel_id = f"UC{c:022d}"
+        videos = []
+        video_count = videos_per_channel[c]
+        for v in range(video_count):
+            published_at = now - datetime.timedelta(days=days_span * v / max(video_count, 1))
+            videos.append({
+                'id': f"v{c:05d}{v:06d}",
+                'title': f"Video {v} of channel {c}",
+                'publishedAt': published_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                'viewCount': str(1000 + v),
+                'likeCount': str(100 + v),
+                'commentCount': str(10 + v),
+            })
+        channels[f"channel{c}"] = FakeChannel(f"channel{c}", channel_id, videos)
+    return channels
+
+
+class FakeRequest():
+    def __init__(self, client: 'FakeYoutube', method: str, params: Dict) -> None:
+        self._client = client
+        self.method = method
+        self.params = params
+
+    def execute(self, *args, **kwargs) -> Dict:
+        return self._client._execute(self.method, self.params)
+
+
+class FakeBatch():
+    """Stand-in for the BatchHttpRequest of new_batch_http_request, its calls share one round trip."""
+    MAX_CALLS = 1000
+
+    def __init__(self, client: 'FakeYoutube', callback: Optional[Any] = None) -> None:
+        self._client = client
+        self._callback = callback
+        self._calls = []
+
+    def add(self, request: FakeRequest, callback: Optional[Any] = None, request_id: Optional[str] = None) -> None:
+        if len(self._calls) >= self.MAX_CALLS:
+            raise ValueError(f"A batch request holds at most {self.MAX_CALLS} calls")
+        self._calls.append((request, callback or self._callback, request_id or str(len(self._calls) + 1)))
+
+    def execute(self, *args, **kwargs) -> None:
+        self._client._round_trip()
+        for request, callback, request_id in self._calls:
+            try:
+                response, error = self._client._call(request.method, request.params), None
+            except HttpError as e:
+                response, error = None, e
+            callback(request_id, response, error)
+
+
+class FakeResource():
+    def __init__(self, client: 'FakeYoutube', name: str) -> None:
+        self._client = client
+        self._name = name
+
+    def list(self, **params) -> FakeRequest:
+        return FakeRequest(self._client, f"{self._name}.list", params)
+
+    def list_next(self, previous_request: FakeRequest, previous_response: Dict) -> Optional[FakeRequest]:
+        token = previous_response.get('nextPageToken')
+        if not token:
+            return None
+        return FakeRequest(self._client, previous_request.method, {**previous_request.params, 'pageToken': token})
+
+
+class FakeYoutube():
+    def __init__(self,
+                 channels: Dict[str, FakeChannel],
+                 latency: Optional[float] = 0.0,
+                 error_rate: Optional[float] = 0.0,
+                 error_status: Optional[int] = 503,
+                 daily_quota: Optional[int] = None,
+                 seed: Optional[int] = 0,
+                 fail_after_calls: Optional[int] = None) -> None:
+        self._channels = channels
+        self.latency = latency
+        # Share of calls failing with error_status, and the quota after which every call gets 403 quotaExceeded
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.daily_quota = daily_quota
+        # Every call after fail_after_calls raises WorkerKilled, as if the task died mid run
+        self.fail_after_calls = fail_after_calls
+        self._random = random.Random(seed)
+        self._by_id = {c.channel_id: c for c in channels.values()}
+        self._videos = {v['id']: (c, v) for c in channels.values() for v in c.videos}
+        self._lock = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.calls = {}
+            self.quota = {}
+            self.http_requests = 0
+            self.response_bytes = 0
+            # (method, params) of every request that got a response
+            self.served = []
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    @property
+    def total_quota(self) -> int:
+        return sum(self.quota.values())
+
+    # Resource accessors mirroring the discovery built client
+    def search(self) -> FakeResource:
+        return FakeResource(self, 'search')
+
+    def channels(self) -> FakeResource:
+        return FakeResource(self, 'channels')
+
+    def videos(self) -> FakeResource:
+        return FakeResource(self, 'videos')
+
+    def playlistItems(self) -> FakeResource:
+        return FakeResource(self, 'playlistItems')
+
+    def new_batch_http_request(self, callback: Optional[Any] = None) -> FakeBatch:
+        return FakeBatch(self, callback)
+
+    def _execute(self, method: str, params: Dict) -> Dict:
+        self._round_trip()
+        return self._call(method, params)
+
+    def _round_trip(self) -> None:
+        with self._lock:
+            self.http_requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _call(self, method: str, params: Dict) -> Dict:
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.quota[method] = self.quota.get(method, 0) + QUOTA_COST[method]
+            killed = self.fail_after_calls is not None and self.total_calls > self.fail_after_calls
+            over_quota = self.daily_quota is not None and sum(self.quota.values()) > self.daily_quota
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if killed:
+            raise WorkerKilled(method)
+        if over_quota:
+            raise http_error(403, 'quotaExceeded')
+        if failed:
+            raise http_error(self.error_status, 'rateLimitExceeded' if self.error_status in (403, 429) else 'backendError')
+        response = getattr(self, '_' + method.replace('.', '_'))(params)
+        with self._lock:
+            self.response_bytes += len(json.dumps(response))
+            self.served.append((method, params))
+        return response
+
+    @staticmethod
+    def _page(items: List, params: Dict) -> Dict:
+        start = int(params.get('pageToken') or 0)
+        size = int(params.get('maxResults') or 5)
+        response = {'items': items[start:start + size]}
+        if start + size < len(items):
+            response['nextPageToken'] = str(start + size)
+        return response
+
+    def _search_list(self, params: Dict) -> Dict:
+        if params.get('type') == 'channel':
+            channel = self._channels.get(params.get('q'))
+            items = [{'id': {'channelId': channel.channel_id}}] if channel else []
+            return {'items': items[:int(params.get('maxResults') or 5)]}
+        channel = self._by_id.get(params.get('channelId'))
+        published_after = (params.get('publishedAfter') or '').replace('Z', '')
+        items = [{'id': {'videoId': v['id']}} for v in (channel.videos if channel else [])
+                 if v['publishedAt'].replace('Z', '') >= published_after]
+        return self._page(items, params)
+
+    def _channels_list(self, params: Dict) -> Dict:
+        channel = self._by_id.get(params.get('id'))
+        if channel is None:
+            return {'items': []}
+        return {'items': [{
+            'id': channel.channel_id,
+            'snippet': {
+                'title': channel.name.title(),
+                'description': f"Synthetic channel {channel.name}",
+                'customUrl': f"@{channel.name}",
+                'publishedAt': '2010-01-01T00:00:00Z',
+                'country': 'SG',
+            },
+            'statistics': {
+                'viewCount': str(sum(int(v['viewCount']) for v in channel.videos)),
+                'subscriberCount': '1000',
+                'videoCount': str(len(channel.videos)),
+            },
+            'contentDetails': {'relatedPlaylists': {'uploads': 'UU' + channel.channel_id[2:]}},
+        }]}
+
+    def _playlistItems_list(self, params: Dict) -> Dict:
+        channel = self._by_id.get('UC' + params.get('playlistId', '')[2:])
+        items = [{'contentDetails': {'videoId': v['id'], 'videoPublishedAt': v['publishedAt']}}
+                 for v in (channel.videos if channel else [])]
+        return self._page(items, params)
+
+    def _videos_list(self, params: Dict) -> Dict:
+        items = []
+        for video_id in params.get('id', '').split(','):
+            if video_id not in self._videos:
+                continue
+            _, v = self._videos[video_id]
+            item = {'id': v['id']}
+            parts = params.get('part', '').split(',')
+            if 'snippet' in parts:
+                item['snippet'] = {'title': v['title'], 'publishedAt': v['publishedAt'],
+                                   'description': f"Description of {v['title']}. " * 10}
+            if 'statistics' in parts:
+                item['statistics'] = {
+                    'viewCount': v['viewCount'],
+                    'likeCount': v['likeCount'],
+                    'commentCount': v['commentCount'],
+                }
+            items.append(item)
+        return {'items': items}
+
+
+@contextmanager
+def patched_youtube(fake: FakeYoutube):
+    """Makes YoutubeChannel use the fake client instead of building a real one."""
+    from dags.utils import clear_youtube_service_cache
+    clear_youtube_service_cache()
+    try:
+        with mock.patch('dags.utils.build', return_value=fake), \
+                mock.patch('dags.utils.service_account.Credentials.from_service_account_info', return_value=object()):
+            yield fake
+    finally:
+        clear_youtube_service_cache()
@@ -0,0 +1,196 @@
+# Runs the DAG's task callables end to end in-process: fn_plan_shards, fn_extract_load_s3
+# of every shard against the fake YouTube client with uploads to a filesystem S3,
+# fn_merge_manifests, fn_load_s3_to_sf (SnowflakeLoader s3_to_stg and stg_to_core),
+# fn_build_semantic and fn_compact_stats against the DuckDB warehouse.
+# Nothing needs credentials.
+#
+#   harness = PipelineHarness(channel_count=5, videos_per_channel=200)
+#   metrics = harness.run()
+#   harness.warehouse.query('select count(*) from CORE.TBL_YT_VIDEO_STATS')
+
+from typing import Optional, Dict, List, Union
+from unittest import mock
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from . import fake_airflow
+from .fake_s3 import LocalS3Client
+from .fake_warehouse import DuckDBWarehouse
+from .fake_youtube import FakeYoutube, make_channels, patched_youtube
+
+
+DAG_FILE = 'dags/youtube-data-analytics-loader.py'
+DAG_MODULE = 'dags.youtube_data_analytics_loader'
+
+
+def load_dag_module():
+    """Imports the DAG file as dags.youtube_data_analytics_loader, with fake_airflow when airflow is missing."""
+    fake_airflow.install()
+    if DAG_MODULE in sys.modules:
+        return sys.modules[DAG_MODULE]
+    spec = importlib.util.spec_from_file_location(DAG_MODULE, DAG_FILE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[DAG_MODULE] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeTaskInstance():
+    def __init__(self, xcom: Optional[Dict] = None) -> None:
+        self.xcom = xcom or {}
+        self.pushed = {}
+
+    def xcom_pull(self, task_ids: str):
+        return self.xcom.get(task_ids)
+
+    def xcom_push(self, key: str, value) -> None:
+        self.pushed[key] = value
+
+
+class PipelineHarness():
+    def __init__(self,
+                 channel_count: int,
+                 videos_per_channel: Union[int, List[int]],
+                 latency: Optional[float] = 0.0,
+                 workdir: Optional[str] = None,
+                 config: Optional[Dict] = None,
+                 s3_latency: Optional[float] = 0.0,
+                 sf_latency: Optional[float] = 0.0) -> None:
+        # config overrides module level settings of the DAG file, e.g. {'yt_incremental': False}
+        # latency is per YouTube call, s3_latency per S3 request and sf_latency per warehouse
+        # statement. A PUT's upload to the internal stage takes s3_latency too.
+        from dags.utils import SnowflakeConnectionPool, clear_worker_resources
+        clear_worker_resources()
+        self._own_workdir = workdir is None
+        self.workdir = workdir or tempfile.mkdtemp(prefix='yt-harness-')
+        self.youtube = FakeYoutube(make_channels(channel_count, videos_per_channel), latency=latency)
+        self.s3 = LocalS3Client(os.path.join(self.workdir, 's3'), latency=s3_latency)
+        self.warehouse = DuckDBWarehouse(os.path.join(self.workdir, 's3'), latency=sf_latency, put_latency=s3_latency)
+        self.dag = load_dag_module()
+        self.pool = SnowflakeConnectionPool(self.warehouse.connect, size=self.dag.sf_pool_size)
+        self._runs = 0
+
+        settings = {
+            'channel_list': [f"channel{c}" for c in range(channel_count)],
+            'yt_max_requests_per_sec': None,
+            'yt_channel_id_cache_path': os.path.join(self.workdir, 'cache', 'yt_channel_ids.json'),
+            'yt_video_state_path': os.path.join(self.workdir, 'cache', 'yt_video_state.json'),
+            'yt_checkpoint_dir': os.path.join(self.workdir, 'cache', 'yt_checkpoints'),
+            'metrics_dir': os.path.join(self.workdir, 'metrics'),
+            'get_service_account_info': lambda: {},
+            'get_s3_client': lambda: self.s3,
+            'get_sf_pool': lambda: self.pool,
+            'stats_compaction_hour': None,
+            # One shard plan per harness, the fake Variable store is shared by the process
+            'yt_shard_assignment_variable': f"yt_shard_assignment.{os.path.basename(self.workdir)}",
+        }
+        settings.update(config or {})
+        self._patches = [mock.patch.object(self.dag, name, value) for name, value in settings.items()]
+
+    def run(self, run_id: Optional[str] = None, config: Optional[Dict] = None) -> Dict:
+        """Runs the tasks once, returns the per stage wall times and counters of the run.
+
+        config overrides settings of the DAG file for this run only.
+        """
+        import dags.utils
+        self._runs += 1
+        run_id = run_id or f"manual__harness_{self._runs}"
+        self.youtube.reset_counters()
+        s3_bytes, s3_requests = self.s3.bytes_written, self.s3.requests
+        upload_time = []
+
+        def timed_upload(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return upload(*args, **kwargs)
+            finally:
+                upload_time.append(time.perf_counter() - start)
+
+        upload = dags.utils.upload_parquet_datasets
+        patches = self._patches + [mock.patch.object(self.dag, name, value) for name, value in (config or {}).items()]
+        for patch in patches:
+            patch.start()
+        try:
+            plan_ti = FakeTaskInstance()
+            start = time.perf_counter()
+            shard_kwargs = self.dag.fn_plan_shards(run_id=run_id, ti=plan_ti)
+            plan_total = time.perf_counter() - start
+            # The mapped extraction instances run one after the other, each one's counters are its own
+            shards = []
+            with patched_youtube(self.youtube), mock.patch.object(dags.utils, 'upload_parquet_datasets', timed_upload):
+                for kwargs in shard_kwargs:
+                    shard_ti = FakeTaskInstance()
+                    calls, quota, uploads = self.youtube.total_calls, self.youtube.total_quota, len(upload_time)
+                    start = time.perf_counter()
+                    manifest = self.dag.fn_extract_load_s3(run_id=run_id, ti=shard_ti, **kwargs)
+                    shards.append({
+                        'shard': kwargs['shard'],
+                        'channels': len(kwargs['channels']),
+                        'channel_names': list(kwargs['channels']),
+                        'seconds': time.perf_counter() - start,
+                        's3_upload_seconds': sum(upload_time[uploads:]),
+                        'api_calls': self.youtube.total_calls - calls,
+                        'quota_units': self.youtube.total_quota - quota,
+                        'manifest': manifest,
+                        'metrics': shard_ti.pushed.get('metrics'),
+                    })
+            extract_total = sum(shard['seconds'] for shard in shards)
+            merge_ti = FakeTaskInstance({'task_load_from_yt_to_s3': [shard['manifest'] for shard in shards]})
+            start = time.perf_counter()
+            manifest = self.dag.fn_merge_manifests(run_id=run_id, ti=merge_ti)
+            merge_total = time.perf_counter() - start
+            load_ti = FakeTaskInstance({'task_merge_manifests': manifest})
+            start = time.perf_counter()
+            load = self.dag.fn_load_s3_to_sf(run_id=run_id, ti=load_ti)
+            load_total = time.perf_counter() - start
+            semantic_ti = FakeTaskInstance()
+            start = time.perf_counter()
+            semantic = self.dag.fn_build_semantic(run_id=run_id, ti=semantic_ti)
+            semantic_total = time.perf_counter() - start
+            compact_ti = FakeTaskInstance()
+            start = time.perf_counter()
+            compact = self.dag.fn_compact_stats(run_id=run_id, ti=compact_ti)
+            compact_total = time.perf_counter() - start
+        finally:
+            for patch in reversed(patches):
+                patch.stop()
+
+        return {
+            'run_id': run_id,
+            'stages': {
+                'plan': plan_total,
+                'extract': extract_total - sum(upload_time),
+                's3_upload': sum(upload_time),
+                'merge': merge_total,
+                'load': load_total,
+                'semantic': semantic_total,
+                'compact': compact_total,
+            },
+            'shards': shards,
+            'load_tables': load,
+            'semantic_rows': semantic,
+            'compacted_rows': compact,
+            'api_calls': self.youtube.total_calls,
+            'quota_units': self.youtube.total_quota,
+            's3_bytes_written': self.s3.bytes_written - s3_bytes,
+            's3_requests': self.s3.requests - s3_requests,
+            'core_rows': self.core_row_counts(),
+            'metrics': {**{'task_load_from_yt_to_s3' + (f"[{shard['shard']}]" if len(shards) > 1 else ''): shard['metrics']
+                           for shard in shards},
+                        'task_load_s3_to_sf': load_ti.pushed.get('metrics'),
+                        'task_build_semantic': semantic_ti.pushed.get('metrics'),
+                        'task_compact_stats': compact_ti.pushed.get('metrics')},
+        }
+
+    def core_row_counts(self) -> Dict[str, int]:
+        return {spec['core_table_name']: self.warehouse.query(f"SELECT COUNT(*) FROM CORE.{spec['core_table_name']}")[0][0]
+                for spec in self.dag.sf_table_specs}
+
+    def close(self) -> None:
+        self.pool.close_all()
+        if self._own_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
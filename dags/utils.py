@@ -6,11 +6,37 @@
 
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from typing import Any, Optional, Dict, List
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Any, Optional, Dict, Iterable, List, Sequence, Tuple
+from array import array
+from collections import Counter
+import itertools
 import json
 import datetime
+import hashlib
+import io
 import logging
-import snowflake.connector
+import os
+import posixpath
+import random
+import re
+import shutil
+import socket
+import threading
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+# Quota units charged by the YouTube Data API per call
+YOUTUBE_QUOTA_COST = {
+    'search.list': 100,
+    'channels.list': 1,
+    'videos.list': 1,
+    'playlistItems.list': 1,
+}
 
 
 class CredentialError(Exception):
@@ -25,47 +51,1101 @@ class InsufficientInputError(Exception):
 class ChannelNotFoundError(Exception):
     """This exception is raised when a channel is not found."""
 
-class YoutubeChannel():
+class QuotaBudgetExceededError(Exception):
+    """This exception is raised when a call would exceed the configured quota budget."""
+
+
+class RateLimiter():
+    """Thread safe token bucket limiting the request rate, with an optional quota unit budget.
+
+    The rate adapts between min_requests_per_sec and max_requests_per_sec: throttle()
+    halves it when the API pushes back and recover() raises it step by step on success.
+    exhaust() marks the quota as used up, e.g. on a 403 quotaExceeded, after which every
+    acquire() raises QuotaBudgetExceededError without a request being sent.
+    """
     def __init__(self,
-                 service_account_info: json,
-                 scopes: Optional[list] = ['https://www.googleapis.com/auth/youtube.readonly'],
-                 channel_name: Optional[str] = None,
-                channel_id: Optional[str] = None) -> None:
-        # Trying to create the credential object
+                 max_requests_per_sec: Optional[float] = None,
+                 quota_budget: Optional[int] = None,
+                 min_requests_per_sec: Optional[float] = 1.0) -> None:
+        self.max_requests_per_sec = max_requests_per_sec
+        self.min_requests_per_sec = min(min_requests_per_sec, max_requests_per_sec or min_requests_per_sec)
+        self.requests_per_sec = max_requests_per_sec
+        self.quota_budget = quota_budget
+        self.quota_used = 0
+        # Why the quota ran out, set by exhaust()
+        self.exhausted = None
+        self._tokens = max_requests_per_sec or 0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, quota_units: Optional[int] = 1) -> None:
+        with self._lock:
+            # Checking the budget before spending anything
+            if self.exhausted is not None:
+                raise QuotaBudgetExceededError(self.exhausted)
+            if self.quota_budget is not None and self.quota_used + quota_units > self.quota_budget:
+                raise QuotaBudgetExceededError(f"Quota budget of {self.quota_budget} units exhausted ({self.quota_used} used)")
+            self.quota_used += quota_units
+
+            if not self.requests_per_sec:
+                return
+            # Refilling the bucket and reserving a token, going negative when we need to wait
+            now = time.monotonic()
+            self._tokens = min(self.requests_per_sec, self._tokens + (now - self._last) * self.requests_per_sec)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.requests_per_sec if self._tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def exhaust(self, reason: str) -> None:
+        with self._lock:
+            self.exhausted = self.exhausted or reason
+
+    def throttle(self) -> None:
+        with self._lock:
+            if self.requests_per_sec:
+                self.requests_per_sec = max(self.min_requests_per_sec, self.requests_per_sec / 2)
+
+    def recover(self) -> None:
+        with self._lock:
+            if self.requests_per_sec and self.requests_per_sec < self.max_requests_per_sec:
+                self.requests_per_sec = min(self.max_requests_per_sec, self.requests_per_sec + self.max_requests_per_sec / 50)
+
+
+_youtube_service_cache = {}
+_youtube_service_lock = threading.Lock()
+
+
+def get_youtube_service(service_account_info: json,
+                        scopes: Optional[list] = ['https://www.googleapis.com/auth/youtube.readonly']) -> Tuple[Any, Any]:
+    """Returns (credentials, youtube) for the service account, built once per process and reused."""
+    key = hashlib.sha256(json.dumps([service_account_info, sorted(scopes)], sort_keys=True, default=str).encode()).hexdigest()
+    with _youtube_service_lock:
+        if key not in _youtube_service_cache:
+            # Trying to create the credential object
+            try:
+                credentials = service_account.Credentials.from_service_account_info(
+                service_account_info,
+                scopes=scopes
+                )
+            except Exception as e:
+                raise CredentialError(e)
+
+            # Trying to build the youtube object
+            try:
+                youtube = build('youtube', 'v3', credentials=credentials)
+            except Exception as e:
+                raise YoutubeDataError(e)
+
+            _youtube_service_cache[key] = (credentials, youtube)
+        return _youtube_service_cache[key]
+
+
+def clear_youtube_service_cache() -> None:
+    with _youtube_service_lock:
+        _youtube_service_cache.clear()
+
+
+_worker_resources = {}
+_worker_resources_lock = threading.Lock()
+
+
+def get_worker_resource(name: str, factory: Any) -> Any:
+    """Returns the resource cached under name for this worker process, created by factory() on first use.
+
+    A forked child does not reuse its parent's entries, connections must not cross processes.
+    """
+    with _worker_resources_lock:
+        pid, resource = _worker_resources.get(name, (None, None))
+        if pid != os.getpid():
+            resource = factory()
+            _worker_resources[name] = (os.getpid(), resource)
+        return resource
+
+
+def clear_worker_resources() -> None:
+    """Drops the cached resources, closing those that have a close_all() such as connection pools."""
+    with _worker_resources_lock:
+        resources = list(_worker_resources.values())
+        _worker_resources.clear()
+    for pid, resource in resources:
+        if pid == os.getpid() and hasattr(resource, 'close_all'):
+            resource.close_all()
+
+
+def _write_atomic(path: str, text: str) -> None:
+    # Writing to a temp file first so a crash or a concurrent reader never sees a half written file
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _write_json_atomic(path: str, data: Any) -> None:
+    # json.dumps encodes in C, json.dump goes through the pure Python encoder
+    _write_atomic(path, json.dumps(data))
+
+
+def _safe_name(name: str) -> str:
+    # Run ids and channel names as file and directory names
+    return re.sub(r'[^A-Za-z0-9_.=-]', '_', name)
+
+
+def _epoch(ts: str) -> float:
+    # API timestamps look like 2024-08-08T10:00:00Z
+    return datetime.datetime.fromisoformat(ts.replace('Z', '+00:00')).timestamp()
+
+
+# Publish time of the VideoBatch rows which have none
+_NO_TIME = -2 ** 63
+
+
+def _iso_time(epoch: int) -> Optional[str]:
+    # Back to the API format, 2024-08-08T10:00:00Z
+    return None if epoch == _NO_TIME else time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+
+class RunMetrics():
+    """Thread safe per stage measurements of one task run.
+
+    A stage is a dotted name like 'youtube.api.videos.list', 's3.upload.video' or
+    'snowflake.TBL_YT_VIDEO_STATS.MERGE' with its number of calls, wall seconds, summed
+    counters (rows, bytes, quota_units, retries) and the Snowflake query ids.
+    """
+    def __init__(self, run_id: Optional[str] = None, task_id: Optional[str] = None) -> None:
+        self.run_id = run_id
+        self.task_id = task_id
+        self.started_at = time.time()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: Optional[float] = 0.0, count: Optional[int] = 1,
+               query_id: Optional[str] = None, **counters) -> None:
+        with self._lock:
+            entry = self._stages.setdefault(stage, {'count': 0, 'seconds': 0.0})
+            entry['count'] += count
+            entry['seconds'] += seconds
+            for name, value in counters.items():
+                if value is not None:
+                    entry[name] = entry.get(name, 0) + value
+            if query_id is not None:
+                entry.setdefault('query_ids', []).append(query_id)
+
+    @contextmanager
+    def timer(self, stage: str, **counters):
+        """Records the with block as one call of stage. Counters set on the yielded dict inside the block are recorded too."""
+        record = dict(counters)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.record(stage, time.perf_counter() - start, **record)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            stages = {stage: {k: (list(v) if isinstance(v, list) else v) for k, v in entry.items()}
+                      for stage, entry in self._stages.items()}
+        return {'run_id': self.run_id, 'task_id': self.task_id, 'started_at': self.started_at,
+                'seconds': time.time() - self.started_at, 'stages': stages}
+
+    def to_prometheus(self, prefix: Optional[str] = 'yt_loader') -> str:
+        """The stages as gauges in the Prometheus text format, e.g. for the node_exporter textfile collector."""
+        summary = self.summary()
+        labels = f'task="{summary["task_id"]}"'
+        lines = [f"{prefix}_run_seconds{{{labels}}} {summary['seconds']:.6f}",
+                 f"{prefix}_run_timestamp_seconds{{{labels}}} {summary['started_at']:.0f}"]
+        for stage, entry in sorted(summary['stages'].items()):
+            for name, value in entry.items():
+                if name != 'query_ids':
+                    lines.append(f'{prefix}_stage_{name}{{{labels},stage="{stage}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str, prefix: Optional[str] = 'yt_loader') -> None:
+        # Atomic, the textfile collector may read the file at any time
+        _write_atomic(path, self.to_prometheus(prefix))
+
+    def write_json(self, path: str) -> None:
+        _write_json_atomic(path, self.summary())
+
+    def send_statsd(self, host: str, port: Optional[int] = 8125, prefix: Optional[str] = 'yt_loader') -> None:
+        """Sends every stage as a timer of its seconds and gauges of its counters over UDP."""
+        lines = []
+        for stage, entry in self.summary()['stages'].items():
+            lines.append(f"{prefix}.{stage}.seconds:{entry['seconds'] * 1000:.3f}|ms")
+            lines.extend(f"{prefix}.{stage}.{name}:{value}|g" for name, value in entry.items()
+                         if name not in ('seconds', 'query_ids'))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # Packets are kept below a typical MTU
+            packet = ''
+            for line in lines:
+                if packet and len(packet) + len(line) + 1 > 1400:
+                    sock.sendto(packet.encode(), (host, port))
+                    packet = ''
+                packet = f"{packet}\n{line}" if packet else line
+            if packet:
+                sock.sendto(packet.encode(), (host, port))
+        finally:
+            sock.close()
+
+
+def _timed(metrics: Optional[RunMetrics], stage: str, **counters):
+    # metrics.timer(), or a no-op when there is no RunMetrics
+    if metrics is None:
+        return nullcontext(dict(counters))
+    return metrics.timer(stage, **counters)
+
+
+class ChannelIdCache():
+    """Persistent channel_name -> channel_id map in a local JSON file.
+
+    Resolving a name costs a 100 unit search().list call while channel ids never change,
+    so entries are kept for ttl_seconds. Use invalidate() to drop one or all entries.
+    """
+    def __init__(self, path: str, ttl_seconds: Optional[int] = 30 * 24 * 3600) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._entries = {}
+
+    def get(self, channel_name: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(channel_name)
+        if entry is None or time.time() - entry['resolved_at'] > self.ttl_seconds:
+            return None
+        return entry['channel_id']
+
+    def set(self, channel_name: str, channel_id: str) -> None:
+        with self._lock:
+            self._entries[channel_name] = {'channel_id': channel_id, 'resolved_at': time.time()}
+            self._save()
+
+    def invalidate(self, channel_name: Optional[str] = None) -> None:
+        with self._lock:
+            if channel_name is None:
+                self._entries = {}
+            else:
+                self._entries.pop(channel_name, None)
+            self._save()
+
+    def _save(self) -> None:
+        _write_json_atomic(self.path, self._entries)
+
+
+class VideoStateStore():
+    """Persistent per video state for the incremental extraction, in a JSON file.
+
+    path is a local file or an s3://bucket/key URL, which needs s3_client. Tasks run on any
+    worker, so only a state on S3 follows them from run to run.
+
+    For every video seen it keeps the publish time, a hash of the metadata and when the
+    metadata and the statistics were last fetched. plan() splits a page of video ids into
+    ids needing 'snippet,statistics' (new, or metadata older than md_refresh_seconds), ids
+    needing 'statistics' only and ids which can be skipped this run. refresh_schedule is a
+    list of (max_age_seconds, refresh_seconds) checked in order, max_age_seconds None
+    matching any age. The default refreshes videos under 2 days old every run, under 30
+    days every 6 hours and older ones every 20 hours, so each rptg_dt still gets a row.
+
+    save() drops the videos published more than max_age_seconds ago, which fell out of the
+    extraction window (days_count of get_video_data), so the file does not grow forever.
+    Given channels, it also drops the videos of the other channels, e.g. of channels moved to
+    another shard, whose state would be stale if they ever came back. Call save() only
+    after the fetched rows have landed, so a failed run is fetched again.
+    """
+    DEFAULT_REFRESH_SCHEDULE = [(2 * 86400, 0), (30 * 86400, 6 * 3600), (None, 20 * 3600)]
+
+    def __init__(self,
+                 path: str,
+                 refresh_schedule: Optional[List[Tuple[Optional[int], int]]] = None,
+                 md_refresh_seconds: Optional[int] = 20 * 3600,
+                 max_age_seconds: Optional[int] = 365 * 86400,
+                 clock: Optional[Any] = time.time,
+                 s3_client: Optional[Any] = None) -> None:
+        self.path = path
+        self.refresh_schedule = refresh_schedule or self.DEFAULT_REFRESH_SCHEDULE
+        self.md_refresh_seconds = md_refresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        is_s3 = path.startswith('s3://')
+        directory, self._name = (posixpath if is_s3 else os.path).split(path)
+        self._files = _CheckpointFiles(directory or '.', s3_client)
+        self._videos = self._files.read_json(self._name) or {}
+
+    def __len__(self) -> int:
+        return len(self._videos)
+
+    def _refresh_seconds(self, age: float) -> int:
+        for max_age, refresh in self.refresh_schedule:
+            if max_age is None or age < max_age:
+                return refresh
+        return self.refresh_schedule[-1][1]
+
+    def plan(self, video_ids: List[str]) -> Tuple[List[str], List[str]]:
+        """Returns (ids to fetch with snippet and statistics, ids to fetch statistics for)."""
+        now = self.clock()
+        full_ids, stats_ids = [], []
+        with self._lock:
+            for video_id in video_ids:
+                state = self._videos.get(video_id)
+                if state is None or now - state['md_fetched_at'] >= self.md_refresh_seconds:
+                    full_ids.append(video_id)
+                elif now - state['stats_fetched_at'] >= self._refresh_seconds(now - state['published_at']):
+                    stats_ids.append(video_id)
+        return full_ids, stats_ids
+
+    def _record(self, video_id: str, title: Optional[str], published_at: Optional[str], now: float,
+                channel: Optional[str] = None) -> Tuple[bool, str]:
+        # Called with the lock held. Returns (metadata changed, publishedAt)
+        state = self._videos.get(video_id)
+        if title is None and state is not None:
+            state['stats_fetched_at'] = now
+            if channel is not None:
+                state['channel'] = channel
+            return False, state['publishedAt']
+        # A statistics only row of a video without state (e.g. dropped by save) has no
+        # title or publish time, it is recorded as new and fetched in full next time
+        md_hash = hashlib.sha1(f"{title or ''}\x1f{published_at or ''}".encode()).hexdigest()
+        changed = state is None or state['md_hash'] != md_hash
+        self._videos[video_id] = {
+            'md_hash': md_hash,
+            'publishedAt': published_at,
+            'published_at': _epoch(published_at) if published_at else now,
+            'md_fetched_at': now if title is not None else 0,
+            'stats_fetched_at': now,
+            'channel': channel,
+        }
+        return changed, published_at
+
+    def record(self, row: Dict, channel: Optional[str] = None) -> bool:
+        """Records a fetched row of channel, fills the metadata of statistics-only rows from the state.
+
+        Returns True when the metadata is new or changed since the last fetch.
+        """
+        now = self.clock()
+        with self._lock:
+            changed, row['publishedAt'] = self._record(row['id'], row.get('title'), row.get('publishedAt'), now, channel)
+            return changed
+
+    def record_batch(self, videos: 'VideoBatch', channel: Optional[str] = None) -> None:
+        """record() for every row of videos, setting their md_changed flags and missing publish times."""
+        now = self.clock()
+        with self._lock:
+            for i, video_id in enumerate(videos.ids):
+                changed, published_at = self._record(video_id, videos.titles[i], _iso_time(videos.published[i]), now, channel)
+                videos.md_changed[i] = changed
+                if videos.published[i] == _NO_TIME and published_at:
+                    videos.published[i] = int(_epoch(published_at))
+
+    def save(self, channels: Optional[List[str]] = None) -> None:
+        with self._lock:
+            if self.max_age_seconds is not None:
+                cutoff = self.clock() - self.max_age_seconds
+                self._videos = {video_id: state for video_id, state in self._videos.items() if state['published_at'] >= cutoff}
+            if channels is not None:
+                # Videos recorded without a channel are kept
+                channels = set(channels)
+                self._videos = {video_id: state for video_id, state in self._videos.items()
+                                if state.get('channel') is None or state['channel'] in channels}
+            self._files.write_json(self._name, self._videos)
+
+
+def _retry_reason(error: Exception) -> Optional[str]:
+    """Classifies an execute() error as 'quotaExceeded', 'rateLimit', 'serverError', 'timeout' or None."""
+    resp = getattr(error, 'resp', None)
+    if resp is not None and getattr(resp, 'status', None) is not None:
+        status = int(resp.status)
+        try:
+            reason = json.loads(error.content)['error']['errors'][0]['reason']
+        except Exception:
+            reason = ''
+        if status == 403 and reason in ('quotaExceeded', 'dailyLimitExceeded'):
+            return 'quotaExceeded'
+        if status == 429 or (status == 403 and reason in ('rateLimitExceeded', 'userRateLimitExceeded')):
+            return 'rateLimit'
+        if status >= 500:
+            return 'serverError'
+        return None
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return 'timeout'
+    return None
+
+
+class _CheckpointFiles():
+    """JSON files of a checkpoint or a VideoStateStore, in a local directory or under an s3://bucket/prefix URL.
+
+    A retried task can run on another worker, which only finds the first attempt's
+    checkpoint when it is on S3. Local directories only suit single worker deployments.
+    """
+    def __init__(self, root: str, s3_client: Optional[Any] = None) -> None:
+        self.root = root
+        self._s3_client = s3_client
+        self.is_s3 = root.startswith('s3://')
+        if self.is_s3:
+            if s3_client is None:
+                raise InsufficientInputError(f"An s3_client is needed for the checkpoint root {root}")
+            self._bucket, _, self._prefix = root[len('s3://'):].partition('/')
+
+    def child(self, name: str) -> '_CheckpointFiles':
+        return _CheckpointFiles((posixpath if self.is_s3 else os.path).join(self.root, name), self._s3_client)
+
+    def read_json(self, name: str) -> Optional[Any]:
+        if not self.is_s3:
+            try:
+                with open(os.path.join(self.root, name)) as f:
+                    return json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return None
         try:
-            credentials = service_account.Credentials.from_service_account_info(
-            service_account_info,
-            scopes=scopes
-            )
+            response = self._s3_client.get_object(Bucket=self._bucket, Key=posixpath.join(self._prefix, name))
         except Exception as e:
-            raise CredentialError(e)
-        
-        # Trying to build the youtube object
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    def write_json(self, name: str, data: Any) -> None:
+        if not self.is_s3:
+            _write_json_atomic(os.path.join(self.root, name), data)
+            return
+        # A PUT replaces the object atomically, a reader sees the old or the new file
+        self._s3_client.put_object(Bucket=self._bucket, Key=posixpath.join(self._prefix, name), Body=json.dumps(data).encode())
+
+    def remove(self) -> None:
+        if not self.is_s3:
+            shutil.rmtree(self.root, ignore_errors=True)
+            return
+        paginator = self._s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket, Prefix=self._prefix.rstrip('/') + '/'):
+            keys = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if keys:
+                self._s3_client.delete_objects(Bucket=self._bucket, Delete={'Objects': keys, 'Quiet': True})
+
+
+class ChannelCheckpoint():
+    """Listing pages and statistics batches of one channel, persisted as they arrive.
+
+    A listing page is saved with its planned statistics batches (pending) and the next page
+    token before any of the batches is requested, and every batch is saved as soon as it is
+    in, so a resumed extraction never fetches a page or a batch twice. It first requests the
+    pending batches, then pages on from the saved page token.
+    """
+    def __init__(self, files: _CheckpointFiles) -> None:
+        self._files = files
+        self._state = files.read_json('state.json') or {
+            'attributes': None, 'batches': 0, 'pending': [], 'next_page_token': None, 'paging_done': False}
+
+    @property
+    def attributes(self) -> Optional[Dict]:
+        return self._state['attributes']
+
+    @property
+    def batches(self) -> int:
+        return self._state['batches']
+
+    @property
+    def pending(self) -> List[Tuple[List[str], str]]:
+        """(video ids, part) of the statistics batches listed but not fetched yet."""
+        return [(ids, part) for ids, part in self._state['pending']]
+
+    @property
+    def next_page_token(self) -> Optional[str]:
+        return self._state['next_page_token']
+
+    @property
+    def paging_done(self) -> bool:
+        return self._state['paging_done']
+
+    def save_attributes(self, attributes: Dict) -> None:
+        self._state['attributes'] = attributes
+        self._files.write_json('state.json', self._state)
+
+    def save_listing(self, batches: List[Tuple[List[str], str]], next_page_token: Optional[str]) -> None:
+        self._state['pending'] = self._state['pending'] + [[list(ids), part] for ids, part in batches]
+        self._state['next_page_token'] = next_page_token
+        self._state['paging_done'] = next_page_token is None
+        self._files.write_json('state.json', self._state)
+
+    def save_batch(self, videos: 'VideoBatch', video_ids: List[str], part: str) -> None:
+        self._files.write_json(f"batch_{self.batches:06d}.json", videos.to_json())
+        self._state['batches'] += 1
+        self._state['pending'].remove([list(video_ids), part])
+        self._files.write_json('state.json', self._state)
+
+    def load_videos(self) -> 'VideoBatch':
+        videos = VideoBatch()
+        for batch in range(self.batches):
+            videos.extend(VideoBatch.from_json(self._files.read_json(f"batch_{batch:06d}.json")))
+        return videos
+
+
+class ExtractionCheckpoint():
+    """Run scoped checkpoint, root_dir/<run_id>/, holding a ChannelCheckpoint per channel.
+
+    root_dir is a local directory or an s3://bucket/prefix URL read and written with
+    s3_client. A retried task opening the same run_id resumes where the failed attempt
+    stopped. clear() removes the checkpoint once the run's files are uploaded.
+    """
+    def __init__(self, root_dir: str, run_id: str, s3_client: Optional[Any] = None) -> None:
+        self._files = _CheckpointFiles(root_dir, s3_client).child(_safe_name(run_id))
+        self.path = self._files.root
+
+    def run_meta(self, defaults: Dict) -> Dict:
+        """Returns the run level values saved by the first attempt, saving defaults if there are none."""
+        run_meta = self._files.read_json('run.json')
+        if run_meta is None:
+            self._files.write_json('run.json', defaults)
+            return defaults
+        return run_meta
+
+    def channel(self, channel_name: str) -> ChannelCheckpoint:
+        return ChannelCheckpoint(self._files.child('channels').child(_safe_name(channel_name)))
+
+    def clear(self) -> None:
+        self._files.remove()
+
+
+class _ThrottledRequest():
+    def __init__(self, client: 'ThrottledYoutube', request: Any, method: str) -> None:
+        self._client = client
+        self._request = request
+        self.method = method
+
+    def execute(self, *args, **kwargs) -> Any:
+        client = self._client
+        quota_units = YOUTUBE_QUOTA_COST.get(self.method, 1)
+        http = client.thread_http()
+        if http is not None:
+            kwargs['http'] = http
+
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            client.rate_limiter.acquire(quota_units)
+            client.account(self.method, quota_units)
+            try:
+                response = self._request.execute(*args, **kwargs)
+            except Exception as e:
+                reason = _retry_reason(e)
+                if reason == 'quotaExceeded':
+                    # The daily quota does not come back within the run, stop like the run budget.
+                    # The other channels stop at their next acquire() instead of paying for a request.
+                    client.account_time(self.method, time.perf_counter() - start)
+                    client.rate_limiter.exhaust(f"YouTube API quota exceeded. {e}")
+                    raise QuotaBudgetExceededError(f"YouTube API quota exceeded. {e}")
+                if reason is None or attempt >= client.max_retries:
+                    client.account_time(self.method, time.perf_counter() - start)
+                    raise
+                if reason == 'rateLimit':
+                    client.rate_limiter.throttle()
+                client.account_retry(self.method)
+                # Exponential backoff with full jitter
+                delay = random.uniform(0, min(client.backoff_max, client.backoff_base * 2 ** attempt))
+                logging.warning(f"{self.method} failed with {reason}, retry {attempt + 1}/{client.max_retries} in {delay:.1f}s. {e}")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            client.rate_limiter.recover()
+            client.account_time(self.method, time.perf_counter() - start)
+            return response
+
+
+class _ThrottledResource():
+    def __init__(self, client: 'ThrottledYoutube', resource: Any, name: str) -> None:
+        self._client = client
+        self._resource = resource
+        self._name = name
+
+    def list_next(self, previous_request: _ThrottledRequest, previous_response: Dict) -> Optional[_ThrottledRequest]:
+        request = self._resource.list_next(previous_request._request, previous_response)
+        if request is None:
+            return None
+        return _ThrottledRequest(self._client, request, previous_request.method)
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self._resource, name)
+        return lambda *args, **kwargs: _ThrottledRequest(self._client, method(*args, **kwargs), f"{self._name}.{name}")
+
+
+class ThrottledYoutube():
+    """Wraps a youtube resource so every execute() goes through a shared RateLimiter.
+
+    Retryable errors (429, rate limit 403s, 5xx and timeouts) are retried up to max_retries
+    times with jittered exponential backoff. A 403 quotaExceeded is raised as
+    QuotaBudgetExceededError. Quota units and calls are accounted per channel and method,
+    for_channel() returns a view of the same client which books its calls to that channel.
+    A call made for several channels, like a batched videos().list, is split between them
+    by the shares passed to the account methods.
+
+    The discovery built resource can be shared between threads, but its httplib2 transport
+    can not, so when http_factory is given every thread executes with its own http object.
+    """
+    def __init__(self,
+                 youtube: Any,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 http_factory: Optional[Any] = None,
+                 max_retries: Optional[int] = 5,
+                 backoff_base: Optional[float] = 1.0,
+                 backoff_max: Optional[float] = 60.0,
+                 channel: Optional[str] = None,
+                 _shared: Optional[Dict] = None) -> None:
+        self._youtube = youtube
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self._http_factory = http_factory
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.channel = channel
+        self._shared = _shared or {'lock': threading.Lock(), 'local': threading.local(),
+                                   'quota': {}, 'calls': {}, 'retries': {}, 'seconds': {}}
+
+    def for_channel(self, channel: str) -> 'ThrottledYoutube':
+        return ThrottledYoutube(self._youtube, self.rate_limiter, self._http_factory, self.max_retries,
+                                self.backoff_base, self.backoff_max, channel, self._shared)
+
+    def thread_http(self) -> Any:
+        if self._http_factory is None:
+            return None
+        local = self._shared['local']
+        if not hasattr(local, 'http'):
+            local.http = self._http_factory()
+        return local.http
+
+    def _book(self, counter: str, method: str, amount: float, shares: Optional[Dict[str, float]]) -> None:
+        # shares is {channel: fraction of the call}, the view's own channel by default
+        for channel, share in (shares or {self.channel: 1}).items():
+            booked = self._shared[counter].setdefault(channel, {})
+            booked[method] = booked.get(method, 0) + amount * share
+
+    def account(self, method: str, quota_units: int, shares: Optional[Dict[str, float]] = None) -> None:
+        with self._shared['lock']:
+            self._book('quota', method, quota_units, shares)
+            self._book('calls', method, 1, shares)
+
+    def account_retry(self, method: str, shares: Optional[Dict[str, float]] = None) -> None:
+        with self._shared['lock']:
+            self._book('retries', method, 1, shares)
+
+    def account_time(self, method: str, seconds: float, shares: Optional[Dict[str, float]] = None) -> None:
+        # Wall time of execute() including the retries and their backoff
+        with self._shared['lock']:
+            self._book('seconds', method, seconds, shares)
+
+    def metrics(self) -> Dict[str, Dict]:
+        """Returns {channel: {'quota_units', 'calls', 'retries', 'quota_by_method', 'calls_by_method',
+        'retries_by_method', 'seconds_by_method'}}. The shares of split calls make the counts
+        fractional, they are rounded to 3 decimals."""
+        def rounded(counts: Dict[str, float]) -> Dict[str, float]:
+            return {method: round(count, 3) for method, count in counts.items()}
+
+        with self._shared['lock']:
+            return {channel: {
+                'quota_units': round(sum(quota.values()), 3),
+                'calls': round(sum(self._shared['calls'][channel].values()), 3),
+                'retries': round(sum(self._shared['retries'].get(channel, {}).values()), 3),
+                'quota_by_method': rounded(quota),
+                'calls_by_method': rounded(self._shared['calls'][channel]),
+                'retries_by_method': rounded(self._shared['retries'].get(channel, {})),
+                'seconds_by_method': dict(self._shared['seconds'].get(channel, {})),
+            } for channel, quota in self._shared['quota'].items()}
+
+    def execute_batch(self, requests: List[_ThrottledRequest],
+                      shares: Optional[List[Dict[str, float]]] = None) -> List[Tuple[Any, Optional[Exception]]]:
+        """Sends requests in one HTTP batch request (new_batch_http_request), returns (response, error) per request.
+
+        Every call of the batch takes its quota units from the RateLimiter and is accounted
+        like a single call, split between channels by its entry of shares when given. The wall
+        time of the batch is split evenly between its calls. Calls failing with a retryable
+        error, or all of them when the batch request itself fails, are sent again in a new
+        batch after the backoff.
+        """
+        shares = shares or [None] * len(requests)
+        results = [None] * len(requests)
+        pending = list(range(len(requests)))
+        attempt = 0
+        start = time.perf_counter()
+        while pending:
+            responses = {}
+            batch = self._youtube.new_batch_http_request(
+                callback=lambda request_id, response, exception: responses.__setitem__(int(request_id), (response, exception)))
+            sent = []
+            for i in pending:
+                quota_units = YOUTUBE_QUOTA_COST.get(requests[i].method, 1)
+                try:
+                    self.rate_limiter.acquire(quota_units)
+                except QuotaBudgetExceededError as e:
+                    results[i] = (None, e)
+                    continue
+                self.account(requests[i].method, quota_units, shares[i])
+                batch.add(requests[i]._request, request_id=str(i))
+                sent.append(i)
+            if not sent:
+                break
+
+            http = self.thread_http()
+            try:
+                batch.execute(**({'http': http} if http is not None else {}))
+            except Exception as e:
+                responses = {i: (None, e) for i in sent}
+
+            retry = []
+            for i in sent:
+                response, error = responses.get(i, (None, YoutubeDataError(f"No response in the batch for {requests[i].method}")))
+                reason = None if error is None else _retry_reason(error)
+                if error is None:
+                    results[i] = (response, None)
+                elif reason == 'quotaExceeded':
+                    self.rate_limiter.exhaust(f"YouTube API quota exceeded. {error}")
+                    results[i] = (None, QuotaBudgetExceededError(f"YouTube API quota exceeded. {error}"))
+                elif reason is None or attempt >= self.max_retries:
+                    results[i] = (None, error)
+                else:
+                    if reason == 'rateLimit':
+                        self.rate_limiter.throttle()
+                    self.account_retry(requests[i].method, shares[i])
+                    retry.append(i)
+            if retry:
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                logging.warning(f"{len(retry)} of {len(sent)} batched calls failed, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+            else:
+                self.rate_limiter.recover()
+            pending = retry
+
+        seconds = time.perf_counter() - start
+        for request, request_shares in zip(requests, shares):
+            self.account_time(request.method, seconds / len(requests), request_shares)
+        return results
+
+    def __getattr__(self, name: str) -> Any:
+        resource = getattr(self._youtube, name)
+        return lambda *args, **kwargs: _ThrottledResource(self, resource(*args, **kwargs), name)
+
+
+class VideoBatch():
+    """Video records of a channel held column wise instead of as a dict per video.
+
+    Ids and titles are kept in lists, counts and publish times (epoch seconds) in int64
+    arrays, and url is only derived by columns() and the row views. Iterating yields
+    each row as the dict get_video_statistics used to return.
+    """
+    __slots__ = ('ids', 'titles', 'published', 'views', 'likes', 'dislikes', 'comments', 'md_changed')
+    COUNTS = ('views', 'likes', 'dislikes', 'comments')
+    URL_PREFIX = 'https://www.youtube.com/watch?v='
+
+    def __init__(self) -> None:
+        self.ids = []
+        self.titles = []
+        self.published = array('q')
+        for col in self.COUNTS:
+            setattr(self, col, array('q'))
+        # Metadata new or changed since the last fetch, set by VideoStateStore.record_batch
+        self.md_changed = bytearray()
+
+    @classmethod
+    def from_items(cls, items: List[Dict]) -> 'VideoBatch':
+        """Batch of the items of a videos().list response."""
+        videos = cls()
+        for item in items:
+            # Without the snippet part title and publishedAt are None
+            snippet = item.get('snippet', {})
+            statistics = item.get('statistics', {})
+            published_at = snippet.get('publishedAt')
+            videos.ids.append(item['id'])
+            videos.titles.append(snippet.get('title'))
+            videos.published.append(_NO_TIME if published_at is None else int(_epoch(published_at)))
+            videos.views.append(int(statistics.get('viewCount', 0)))
+            videos.likes.append(int(statistics.get('likeCount', 0)))
+            videos.dislikes.append(int(statistics.get('dislikeCount', 0)))
+            videos.comments.append(int(statistics.get('commentCount', 0)))
+            videos.md_changed.append(1)
+        return videos
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def extend(self, other: 'VideoBatch') -> None:
+        for name in self.__slots__:
+            getattr(self, name).extend(getattr(other, name))
+
+    def row(self, i: int) -> Dict:
+        return {
+            'id': self.ids[i],
+            'title': self.titles[i],
+            'url': self.URL_PREFIX + self.ids[i],
+            'views': self.views[i],
+            'likes': self.likes[i],
+            'dislikes': self.dislikes[i],
+            'comments': self.comments[i],
+            'publishedAt': _iso_time(self.published[i]),
+            'md_changed': bool(self.md_changed[i]),
+        }
+
+    def __iter__(self):
+        return (self.row(i) for i in range(len(self)))
+
+    def changed(self) -> 'VideoBatch':
+        """The rows whose metadata is new or changed."""
+        if all(self.md_changed):
+            return self
+        videos = VideoBatch()
+        for name in self.__slots__:
+            column = getattr(self, name)
+            getattr(videos, name).extend(itertools.compress(column, self.md_changed))
+        return videos
+
+    def columns(self) -> Dict[str, Sequence]:
+        """Columns named like the S3 datasets, publishedAt as epoch seconds, for ColumnarBuilder.extend_columns."""
+        return {
+            'id': self.ids,
+            'title': self.titles,
+            'url': [self.URL_PREFIX + video_id for video_id in self.ids],
+            'views': self.views,
+            'likes': self.likes,
+            'dislikes': self.dislikes,
+            'comments': self.comments,
+            'publishedAt': [None if epoch == _NO_TIME else epoch for epoch in self.published],
+        }
+
+    def to_json(self) -> Dict[str, list]:
+        return {name: list(getattr(self, name)) for name in self.__slots__}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, list]) -> 'VideoBatch':
+        videos = cls()
+        for name in cls.__slots__:
+            getattr(videos, name).extend(data[name])
+        return videos
+
+
+class _BatchedFuture(Future):
+    # Tells the batcher while a thread is blocked on the result
+    def __init__(self, batcher: 'VideoIdBatcher') -> None:
+        super().__init__()
+        self._batcher = batcher
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        if self.done():
+            return super().result(timeout)
+        self._batcher._wait(1)
+        try:
+            return super().result(timeout)
+        finally:
+            self._batcher._wait(-1)
+
+
+class VideoIdBatcher():
+    """Packs the videos().list calls of all channels into full requests sent in HTTP batch requests.
+
+    submit() queues a channel's video ids and returns a Future of their VideoBatch. Queued ids
+    of the same part are packed into requests of ids_per_request ids whatever channel they
+    come from, and up to requests_per_batch requests share one HTTP batch request through
+    ThrottledYoutube.execute_batch. A batch is sent as soon as it is full, or with what is
+    queued once the oldest id waited max_wait seconds or every channel inside producer()
+    waits on its Futures, so nothing more is coming. Batches are sent on executor when given.
+    Responses are routed back by video id, a failed request fails the Future of every channel
+    with ids in it. The quota, calls and time of a request are accounted to the channels of
+    its ids, in proportion to their number of ids.
+    """
+    # The channel of the ids submitted without one, in ThrottledYoutube.metrics
+    CHANNEL = '(batched)'
+
+    def __init__(self,
+                 youtube: ThrottledYoutube,
+                 ids_per_request: Optional[int] = 50,
+                 requests_per_batch: Optional[int] = 10,
+                 max_wait: Optional[float] = 0.1,
+                 executor: Optional[Executor] = None) -> None:
+        self._youtube = youtube
+        self.ids_per_request = ids_per_request
+        self.requests_per_batch = requests_per_batch
+        self.max_wait = max_wait
+        self._executor = executor
+        # part -> [(ticket, video_id)] in the order they were queued
+        self._queued = {}
+        # Channels queueing ids and the threads blocked on a Future
+        self._producers = 0
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        # videos().list requests and HTTP batch requests sent
+        self.requests = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._run, name='video-id-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, video_ids: list, part: Optional[str] = 'snippet,statistics', channel: Optional[str] = None) -> Future:
+        """Queues video_ids of channel, whose calls are accounted to it, and returns a Future of their VideoBatch."""
+        ticket = {'ids': list(video_ids), 'items': {}, 'error': None, 'remaining': len(video_ids),
+                  'channel': channel or self.CHANNEL, 'queued_at': time.monotonic(), 'future': _BatchedFuture(self)}
+        if not video_ids:
+            ticket['future'].set_result(VideoBatch())
+            return ticket['future']
+        with self._cond:
+            if self._closed:
+                raise YoutubeDataError("The VideoIdBatcher is closed")
+            self._queued.setdefault(part, []).extend((ticket, video_id) for video_id in ticket['ids'])
+            self._cond.notify()
+        return ticket['future']
+
+    @contextmanager
+    def producer(self):
+        """Marks the block as a channel queueing ids, see the class docstring."""
+        with self._cond:
+            self._producers += 1
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self._producers -= 1
+                self._cond.notify()
+
+    def _wait(self, delta: int) -> None:
+        with self._cond:
+            self._waiting += delta
+            self._cond.notify()
+
+    def close(self) -> None:
+        """Sends what is still queued and stops the dispatching thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _take(self, full_only: bool) -> List[Tuple[str, list]]:
+        # Full requests first, the partly filled ones only once their ids waited long enough
+        requests = []
+        for part, entries in self._queued.items():
+            while len(entries) >= self.ids_per_request and len(requests) < self.requests_per_batch:
+                requests.append((part, entries[:self.ids_per_request]))
+                del entries[:self.ids_per_request]
+        if not full_only:
+            for part, entries in self._queued.items():
+                if entries and len(requests) < self.requests_per_batch:
+                    requests.append((part, entries[:]))
+                    entries.clear()
+        self._queued = {part: entries for part, entries in self._queued.items() if entries}
+        return requests
+
+    def _next_batch(self) -> Optional[List[Tuple[str, list]]]:
+        with self._cond:
+            while True:
+                if sum(len(entries) // self.ids_per_request for entries in self._queued.values()) >= self.requests_per_batch:
+                    return self._take(full_only=True)
+                if not self._queued:
+                    if self._closed:
+                        return None
+                    self._cond.wait()
+                    continue
+                oldest = min(entries[0][0]['queued_at'] for entries in self._queued.values())
+                wait = oldest + self.max_wait - time.monotonic()
+                if wait <= 0 or self._closed or (self._waiting and self._waiting >= self._producers):
+                    return self._take(full_only=False)
+                self._cond.wait(wait)
+
+    def _run(self) -> None:
+        while True:
+            requests = self._next_batch()
+            if requests is None:
+                return
+            self.batches += 1
+            self.requests += len(requests)
+            if self._executor is not None:
+                self._executor.submit(self._send, requests)
+            else:
+                self._send(requests)
+
+    def _send(self, requests: List[Tuple[str, list]]) -> None:
         try:
-            youtube = build('youtube', 'v3', credentials=credentials)
+            calls = [self._youtube.videos().list(part=part, id=','.join(video_id for _, video_id in entries))
+                     for part, entries in requests]
+            shares = [{channel: count / len(entries) for channel, count in Counter(ticket['channel'] for ticket, _ in entries).items()}
+                      for _, entries in requests]
+            results = self._youtube.execute_batch(calls, shares)
         except Exception as e:
-            raise YoutubeDataError(e)
+            results = [(None, e)] * len(requests)
+        for (part, entries), (response, error) in zip(requests, results):
+            items = {} if error is not None else {item['id']: item for item in response.get('items', [])}
+            for ticket, video_id in entries:
+                self._answer(ticket, video_id, items, error)
+
+    def _answer(self, ticket: Dict, video_id: str, items: Dict, error: Optional[Exception]) -> None:
+        # The ids of a ticket can be spread over several requests, answered from different threads
+        with self._lock:
+            if error is not None:
+                ticket['error'] = ticket['error'] or error
+            elif video_id in items:
+                ticket['items'][video_id] = items[video_id]
+            ticket['remaining'] -= 1
+            if ticket['remaining']:
+                return
+        if ticket['error'] is not None:
+            ticket['future'].set_exception(ticket['error'])
+        else:
+            ticket['future'].set_result(VideoBatch.from_items(
+                [ticket['items'][video_id] for video_id in ticket['ids'] if video_id in ticket['items']]))
+
+
+class YoutubeChannel():
+    ATTRIBUTES = ['channel_name', 'channel_id', 'title', 'description', 'customUrl', 'publishedAt', 'country',
+                  'viewCount', 'subscriberCount', 'videoCount', 'uploadsPlaylistId']
+    __slots__ = ATTRIBUTES + ['_credentials', '_youtube', 'complete']
+
+    def __init__(self,
+                 service_account_info: json,
+                 scopes: Optional[list] = ['https://www.googleapis.com/auth/youtube.readonly'],
+                 channel_name: Optional[str] = None,
+                channel_id: Optional[str] = None,
+                youtube: Optional[Any] = None,
+                channel_id_cache: Optional[ChannelIdCache] = None) -> None:
+        # An already built youtube object can be shared between channels
+        credentials = None
+        if youtube is None:
+            credentials, youtube = get_youtube_service(service_account_info, scopes)
             
         # Fetching Channel id by name
         if channel_name is None and channel_id is None:
             raise InsufficientInputError("Either channel_name or channel_id needs to be provided")
-        
+
+        cached = False
+        if channel_id is None and channel_id_cache is not None:
+            channel_id = channel_id_cache.get(channel_name)
+            cached = channel_id is not None
+
         if channel_id is None:
-            # Fetch channel ID by name
-            response = youtube.search().list(q=channel_name, type='channel', part='id', maxResults=1).execute()
-            if not response.get('items'):
-                raise ChannelNotFoundError(f"No channel found for username: {channel_name}")
-            channel_id = response['items'][0]['id']['channelId']
-        else:
-            # Verify the channel id passed is correct
-            if not youtube.channels().list(id=channel_id,part='id').execute().get('items'):
-                raise ChannelNotFoundError(f"No channel found for channel_id: {channel_id}")
-        
-        # Get channel attributes
+            channel_id = self._resolve_channel_id(youtube, channel_name)
+            if channel_id_cache is not None:
+                channel_id_cache.set(channel_name, channel_id)
+
+        # Get channel attributes, this also verifies the channel id
         response = youtube.channels().list(
             id=channel_id,
-            part='snippet,statistics'
+            part='snippet,statistics,contentDetails'
         ).execute()
+
+        if not response.get('items') and cached:
+            # The cached id is stale, resolving the name again
+            logging.warning(f"Cached channel_id {channel_id} for {channel_name} not found. Resolving again.")
+            channel_id_cache.invalidate(channel_name)
+            channel_id = self._resolve_channel_id(youtube, channel_name)
+            channel_id_cache.set(channel_name, channel_id)
+            response = youtube.channels().list(
+                id=channel_id,
+                part='snippet,statistics,contentDetails'
+            ).execute()
+
+        if not response.get('items'):
+            raise ChannelNotFoundError(f"No channel found for channel_id: {channel_id}")
         
         # Set Channel attribute for the object
         self._credentials = credentials
@@ -80,45 +1160,157 @@ class YoutubeChannel():
         self.viewCount = response.get('items')[0].get('statistics').get('viewCount')
         self.subscriberCount = response.get('items')[0].get('statistics').get('subscriberCount')
         self.videoCount = response.get('items')[0].get('statistics').get('videoCount')
-    
+        self.uploadsPlaylistId = response.get('items')[0].get('contentDetails', {}).get('relatedPlaylists', {}).get('uploads')
+        self.complete = True
+
+    def attributes(self) -> Dict:
+        return {attr: getattr(self, attr) for attr in self.ATTRIBUTES}
+
+    @classmethod
+    def from_attributes(cls, attributes: Dict, youtube: Any) -> 'YoutubeChannel':
+        """Rebuilds a channel from attributes() without any API call, e.g. from a checkpoint."""
+        channelObj = cls.__new__(cls)
+        channelObj._credentials = None
+        channelObj._youtube = youtube
+        for attr in cls.ATTRIBUTES:
+            setattr(channelObj, attr, attributes.get(attr))
+        return channelObj
+
     @staticmethod
-    def get_video_statistics(youtube: Any, video_ids: list) -> list:
-        video_stats = []
+    def _resolve_channel_id(youtube: Any, channel_name: str) -> str:
+        # Fetch channel ID by name
+        response = youtube.search().list(q=channel_name, type='channel', part='id', maxResults=1).execute()
+        if not response.get('items'):
+            raise ChannelNotFoundError(f"No channel found for username: {channel_name}")
+        return response['items'][0]['id']['channelId']
 
+    @staticmethod
+    def get_video_statistics(youtube: Any, video_ids: list, part: Optional[str] = 'snippet,statistics') -> VideoBatch:
         # Fetch statistics for the videos
         video_response = youtube.videos().list(
-            part='snippet,statistics',
+            part=part,
             id=','.join(video_ids)
         ).execute()
 
-        for item in video_response['items']:
-            video_stats.append({
-                'id': item['id'],
-                'title': item['snippet']['title'],
-                'url': f"https://www.youtube.com/watch?v={item['id']}",
-                'views': item['statistics'].get('viewCount',0),
-                'likes': item['statistics'].get('likeCount',0),
-                'dislikes': item['statistics'].get('dislikeCount',0),
-                'comments': item['statistics'].get('commentCount', 0),
-                'publishedAt': item['snippet']['publishedAt']
-            })
-    
-        return video_stats
+        return VideoBatch.from_items(video_response['items'])
 
     
-    def get_video_data(self, chunk_size: Optional[int] = 50, days_count: Optional[int] = 365):
-        video_data = []
-        
+    def get_video_data(self,
+                       chunk_size: Optional[int] = 50,
+                       days_count: Optional[int] = 365,
+                       fetch_mode: Optional[str] = 'search',
+                       executor: Optional[Executor] = None,
+                       state_store: Optional[VideoStateStore] = None,
+                       checkpoint: Optional[ChannelCheckpoint] = None,
+                       batcher: Optional[VideoIdBatcher] = None):
         # Calculating published_after based on days_count
         t_ago = datetime.datetime.now() - datetime.timedelta(days=days_count)
         published_after = t_ago.isoformat("T") + "Z"
 
+        if fetch_mode.lower() not in ('search', 'playlist'):
+            raise InsufficientInputError(f"Invalid fetch_mode: {fetch_mode}. Allowed values are 'search' and 'playlist'")
+
+        # Paging is sequential, the video statistics batches are fanned out when executor is given.
+        # When the quota budget runs out the pages fetched so far are kept and complete is False.
+        # With a checkpoint the batches saved by an earlier attempt are reused, its pending
+        # batches are fetched and paging resumes from the saved page token. With a batcher
+        # the video ids are queued there and packed with the other channels' ids instead of
+        # one request per page.
+        self.complete = True
+        futures = []
+        if checkpoint is not None and checkpoint.batches:
+            futures.append(self._done_future(checkpoint.load_videos()))
+        try:
+            if checkpoint is not None and checkpoint.pending:
+                self._fetch_statistics(checkpoint.pending, executor, futures, checkpoint, batcher)
+            if checkpoint is not None and checkpoint.paging_done:
+                pass
+            elif fetch_mode.lower() == 'search':
+                self._get_video_data_search(chunk_size, published_after, executor, state_store, futures, checkpoint, batcher)
+            else:
+                self._get_video_data_playlist(chunk_size, published_after, executor, state_store, futures, checkpoint, batcher)
+        except QuotaBudgetExceededError as e:
+            logging.warning(f"Stopping Channel: {self.channel_name or self.channel_id} early. {e}")
+            self.complete = False
+
+        video_data = VideoBatch()
+        for future in futures:
+            try:
+                video_data.extend(future.result())
+            except QuotaBudgetExceededError:
+                self.complete = False
+
+        # Incremental mode: only due videos were fetched, md_changed tells which rows
+        # belong in the video metadata dataset
+        if state_store is not None:
+            state_store.record_batch(video_data, channel=self.channel_name or self.channel_id)
+        return video_data
+
+    @staticmethod
+    def _video_statistics_batches(video_ids: list, state_store: Optional[VideoStateStore]) -> List[Tuple[list, str]]:
+        # (video ids, part) of the videos().list requests of a page
+        if state_store is None:
+            batches = [(video_ids, 'snippet,statistics')]
+        else:
+            full_ids, stats_ids = state_store.plan(video_ids)
+            batches = [(full_ids, 'snippet,statistics'), (stats_ids, 'statistics')]
+        return [(ids, part) for ids, part in batches if ids]
+
+    def _video_statistics_future(self, video_ids: list, part: str, executor: Optional[Executor],
+                                 batcher: Optional[VideoIdBatcher]) -> Future:
+        if batcher is not None:
+            return batcher.submit(video_ids, part, channel=getattr(self._youtube, 'channel', None))
+        if executor is not None:
+            return executor.submit(self.get_video_statistics, self._youtube, video_ids, part)
+        return self._done_future(self.get_video_statistics(self._youtube, video_ids, part))
+
+    @staticmethod
+    def _done_future(result: Any) -> Future:
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def _page_fetched(self, video_ids: list, next_page_token: Optional[str], executor: Optional[Executor],
+                      state_store: Optional[VideoStateStore], futures: List[Future],
+                      checkpoint: Optional[ChannelCheckpoint], batcher: Optional[VideoIdBatcher]) -> None:
+        batches = self._video_statistics_batches(video_ids, state_store) if video_ids else []
+        if checkpoint is not None:
+            # Saved before the statistics are requested, a retry fetches the pending batches only
+            checkpoint.save_listing(batches, next_page_token)
+        self._fetch_statistics(batches, executor, futures, checkpoint, batcher)
+
+    def _fetch_statistics(self, batches: List[Tuple[list, str]], executor: Optional[Executor], futures: List[Future],
+                          checkpoint: Optional[ChannelCheckpoint], batcher: Optional[VideoIdBatcher]) -> None:
+        batch_futures = [(ids, part, self._video_statistics_future(ids, part, executor, batcher)) for ids, part in batches]
+        if checkpoint is None:
+            futures.extend(future for _, _, future in batch_futures)
+            return
+        # Every batch is checkpointed as soon as it is in, also when another one of the page failed
+        error = None
+        for ids, part, future in batch_futures:
+            try:
+                videos = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            checkpoint.save_batch(videos, ids, part)
+            futures.append(self._done_future(videos))
+        if error is not None:
+            raise error
+
+    def _get_video_data_search(self, chunk_size: int, published_after: str, executor: Optional[Executor],
+                               state_store: Optional[VideoStateStore], futures: List[Future],
+                               checkpoint: Optional[ChannelCheckpoint] = None,
+                               batcher: Optional[VideoIdBatcher] = None) -> None:
+        # search().list costs 100 quota units per page. Statistics futures are appended to futures.
+        page_token = {'pageToken': checkpoint.next_page_token} if checkpoint is not None and checkpoint.next_page_token else {}
         request = self._youtube.search().list(
                     part='id',
                     channelId=self.channel_id,
                     publishedAfter=published_after,
                     maxResults=chunk_size,
-                    type='video'
+                    type='video',
+                    **page_token
                 )
 
         while request:
@@ -126,16 +1318,664 @@ class YoutubeChannel():
             video_ids = [item['id']['videoId'] for item in response['items']]
             
             # Getting video statistics
-            video_data = video_data + self.get_video_statistics(self._youtube, video_ids)
+            self._page_fetched(video_ids, response.get('nextPageToken'), executor, state_store, futures, checkpoint, batcher)
             
             # Creating request for the next chunk fetch
             request = self._youtube.search().list_next(request, response)        
-                
-        return video_data
+
+    def _get_video_data_playlist(self, chunk_size: int, published_after: str, executor: Optional[Executor],
+                                 state_store: Optional[VideoStateStore], futures: List[Future],
+                                 checkpoint: Optional[ChannelCheckpoint] = None,
+                                 batcher: Optional[VideoIdBatcher] = None) -> None:
+        # playlistItems().list costs 1 quota unit per page. The uploads playlist is
+        # ordered newest first, so paging stops at the first video older than the cutoff.
+
+        # The uploads playlist id is the channel id with the 'UC' prefix replaced by 'UU'
+        playlist_id = self.uploadsPlaylistId or 'UU' + self.channel_id[2:]
+
+        page_token = {'pageToken': checkpoint.next_page_token} if checkpoint is not None and checkpoint.next_page_token else {}
+        request = self._youtube.playlistItems().list(
+                    part='contentDetails',
+                    playlistId=playlist_id,
+                    maxResults=chunk_size,
+                    **page_token
+                )
+
+        while request:
+            response = request.execute()
+            video_ids = []
+            reached_cutoff = False
+            for item in response['items']:
+                # Normalising to the same format as published_after before comparing
+                published_at = item['contentDetails'].get('videoPublishedAt')
+                if published_at is None:
+                    # Private or deleted videos carry no publish date
+                    continue
+                if published_at.replace('Z', '') < published_after.replace('Z', ''):
+                    reached_cutoff = True
+                    break
+                video_ids.append(item['contentDetails']['videoId'])
+
+            # Getting video statistics
+            self._page_fetched(video_ids, None if reached_cutoff else response.get('nextPageToken'),
+                               executor, state_store, futures, checkpoint, batcher)
+
+            # Creating request for the next chunk fetch
+            if reached_cutoff:
+                break
+            request = self._youtube.playlistItems().list_next(request, response)
         
 
 
 
+class YoutubeExtractor():
+    """Extracts a list of channels concurrently with a bounded number of worker threads.
+
+    Credentials and the discovery built client come from get_youtube_service and are shared
+    by all the channels.
+    Every API call goes through one RateLimiter, so max_requests_per_sec and quota_budget
+    hold for the whole run. A failing channel is recorded in the errors and does not stop
+    the other channels. When the budget runs out the channels in flight keep the pages
+    fetched so far (channelObj.complete is False) and the remaining ones are skipped.
+    With requests_per_batch the videos().list calls of all the channels go through one
+    VideoIdBatcher, packed into full requests and sent that many per HTTP batch request.
+    """
+    def __init__(self,
+                 service_account_info: json,
+                 scopes: Optional[list] = ['https://www.googleapis.com/auth/youtube.readonly'],
+                 max_workers: Optional[int] = 8,
+                 max_requests_per_sec: Optional[float] = None,
+                 quota_budget: Optional[int] = None,
+                 youtube: Optional[Any] = None,
+                 channel_id_cache: Optional[ChannelIdCache] = None,
+                 max_retries: Optional[int] = 5,
+                 metrics: Optional[RunMetrics] = None,
+                 requests_per_batch: Optional[int] = None,
+                 batch_max_wait: Optional[float] = 0.05) -> None:
+        # metrics gets the youtube.channel_info/videos stages per channel and youtube.api.<method>
+        http_factory = None
+        if youtube is None:
+            credentials, youtube = get_youtube_service(service_account_info, scopes)
+
+            # httplib2 is not thread safe, every worker thread gets its own authorized http
+            import google_auth_httplib2
+            import httplib2
+            http_factory = lambda: google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+
+        self.max_workers = max_workers
+        self.channel_id_cache = channel_id_cache
+        self.metrics = metrics
+        self.requests_per_batch = requests_per_batch
+        self.batch_max_wait = batch_max_wait
+        self.rate_limiter = RateLimiter(max_requests_per_sec=max_requests_per_sec, quota_budget=quota_budget)
+        self._youtube = ThrottledYoutube(youtube, self.rate_limiter, http_factory, max_retries=max_retries)
+
+    def _extract_channel(self, channel_name: str, executor: Executor,
+                         checkpoint: Optional[ExtractionCheckpoint], **kwargs) -> Tuple[YoutubeChannel, list]:
+        youtube = self._youtube.for_channel(channel_name)
+        channel_checkpoint = checkpoint.channel(channel_name) if checkpoint is not None else None
+        if channel_checkpoint is not None and channel_checkpoint.attributes is not None:
+            logging.info(f"Resuming Channel: {channel_name} after {channel_checkpoint.batches} checkpointed batches, "
+                         f"{len(channel_checkpoint.pending)} pending")
+            channelObj = YoutubeChannel.from_attributes(channel_checkpoint.attributes, youtube)
+        else:
+            logging.info(f"Fetching data for Channel: {channel_name}")
+            with _timed(self.metrics, 'youtube.channel_info'):
+                channelObj = YoutubeChannel(service_account_info=None, channel_name=channel_name, youtube=youtube,
+                                            channel_id_cache=self.channel_id_cache)
+            if channel_checkpoint is not None:
+                channel_checkpoint.save_attributes(channelObj.attributes())
+        batcher = kwargs.get('batcher')
+        with _timed(self.metrics, 'youtube.videos') as record, batcher.producer() if batcher is not None else nullcontext():
+            video_data = channelObj.get_video_data(executor=executor, checkpoint=channel_checkpoint, **kwargs)
+            record['rows'] = len(video_data)
+        return channelObj, video_data
+
+    def extract(self, channel_list: List[str], checkpoint: Optional[ExtractionCheckpoint] = None,
+                **kwargs) -> Tuple[Dict[str, Tuple[YoutubeChannel, list]], Dict[str, Exception]]:
+        """Returns (results, errors) keyed by channel name. kwargs are passed to get_video_data.
+
+        With a checkpoint every channel's pages are persisted as they arrive and an extraction
+        of the same run resumes from them.
+        """
+        results = {}
+        errors = {}
+
+        # Channels and their statistics batches use separate pools, so a channel
+        # worker waiting on its batches can never starve the pool it waits on.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as stats_executor, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as channel_executor:
+            batcher = None
+            if self.requests_per_batch:
+                # The batches are sent on the statistics pool, which the channels never wait on
+                batcher = VideoIdBatcher(self._youtube.for_channel(VideoIdBatcher.CHANNEL), requests_per_batch=self.requests_per_batch,
+                                         max_wait=self.batch_max_wait, executor=stats_executor)
+                kwargs = {**kwargs, 'batcher': batcher}
+            futures = {channel_name: channel_executor.submit(self._extract_channel, channel_name, stats_executor, checkpoint, **kwargs)
+                       for channel_name in channel_list}
+            try:
+                for channel_name, future in futures.items():
+                    try:
+                        results[channel_name] = future.result()
+                    except QuotaBudgetExceededError as e:
+                        logging.warning(f"Skipped Channel: {channel_name}. {e}")
+                        errors[channel_name] = e
+                    except Exception as e:
+                        logging.error(f"Extraction failed for Channel: {channel_name}. {type(e).__name__}: {e}")
+                        errors[channel_name] = e
+            finally:
+                if batcher is not None:
+                    batcher.close()
+
+        logging.info(f"Extracted {len(results)} of {len(channel_list)} channels, {self.rate_limiter.quota_used} quota units used.")
+        for channel_name, channel_metrics in self.channel_metrics().items():
+            logging.info(f"Channel: {channel_name} used {channel_metrics['quota_units']} quota units in "
+                         f"{channel_metrics['calls']} calls with {channel_metrics['retries']} retries. {channel_metrics['quota_by_method']}")
+            if self.metrics is not None:
+                for method, calls in channel_metrics['calls_by_method'].items():
+                    self.metrics.record(f"youtube.api.{method}", channel_metrics['seconds_by_method'].get(method, 0.0), count=calls,
+                                        quota_units=channel_metrics['quota_by_method'][method],
+                                        retries=channel_metrics['retries_by_method'].get(method, 0))
+        if self.metrics is not None:
+            self.metrics.record('youtube.channels', 0.0, count=len(channel_list), rows=len(results), errors=len(errors))
+            if batcher is not None:
+                self.metrics.record('youtube.batches', 0.0, count=batcher.batches, requests=batcher.requests)
+        return results, errors
+
+    def channel_metrics(self) -> Dict[str, Dict]:
+        """Per channel quota units, calls, retries and API seconds of the extraction."""
+        return self._youtube.metrics()
+
+
+def plan_shards(channel_list: List[str], shard_count: int,
+                weights: Optional[Dict[str, float]] = None,
+                previous: Optional[Dict[str, int]] = None,
+                max_imbalance: Optional[float] = 1.25) -> List[List[str]]:
+    """Splits channel_list into at most shard_count non empty shards of balanced total weight.
+
+    previous is the last plan, {channel: shard}. Its channels keep their shard, so they keep
+    the shard's incremental state, and the other channels are placed heaviest first on the
+    lightest shard (longest processing time first, which keeps the heaviest shard within 4/3
+    of the optimum). While the heaviest shard weighs over max_imbalance times the mean,
+    channels move from it to the lightest shard. Channels missing from weights weigh the
+    median of the known weights, or 1 without any. The plan only depends on its input, so the
+    same channels, weights and previous plan always give the same shards. Without any
+    channel it returns shard_count empty shards.
+    """
+    channels = list(dict.fromkeys(channel_list))
+    if not channels:
+        return [[] for _ in range(max(1, shard_count))]
+    shard_count = max(1, min(shard_count, len(channels)))
+    weights = weights or {}
+    known = sorted(weights[c] for c in channels if c in weights)
+    default_weight = known[len(known) // 2] if known else 1
+    previous = {c: shard for c, shard in (previous or {}).items() if 0 <= shard < shard_count}
+    shards = [[] for _ in range(shard_count)]
+    loads = [0] * shard_count
+
+    def weight(channel: str) -> float:
+        return weights.get(channel, default_weight)
+
+    def place(channel: str, i: int) -> None:
+        shards[i].append(channel)
+        loads[i] += weight(channel)
+
+    for channel in channels:
+        if channel in previous:
+            place(channel, previous[channel])
+    for channel in sorted((c for c in channels if c not in previous), key=lambda c: (-weight(c), c)):
+        place(channel, min(range(shard_count), key=lambda i: (loads[i], i)))
+
+    mean = sum(loads) / shard_count
+    while True:
+        empty = [i for i in range(shard_count) if not shards[i]]
+        if empty:
+            # Every shard gets a channel, the lightest of the heaviest shard holding several
+            lightest = empty[0]
+            heaviest = max((i for i in range(shard_count) if len(shards[i]) > 1), key=lambda i: (loads[i], -i))
+            channel = min(shards[heaviest], key=lambda c: (weight(c), c))
+        else:
+            heaviest = max(range(shard_count), key=lambda i: (loads[i], -i))
+            lightest = min(range(shard_count), key=lambda i: (loads[i], i))
+            gap = loads[heaviest] - loads[lightest]
+            # Only moves lowering the heavier of the two shards, so the loop ends
+            movable = [c for c in shards[heaviest] if weight(c) < gap]
+            if loads[heaviest] <= max_imbalance * mean or not movable:
+                break
+            channel = min(movable, key=lambda c: (abs(2 * weight(c) - gap), c))
+        shards[heaviest].remove(channel)
+        loads[heaviest] -= weight(channel)
+        place(channel, lightest)
+    return shards
+
+
+class ColumnarBuilder():
+    """Accumulates rows into one list per column and builds a pyarrow.Table at the end.
+
+    Every batch_size rows the column lists are converted to Arrow arrays and emptied, so
+    at most one batch of rows is held as Python objects. When key_columns is given, rows
+    whose key was already seen are dropped on append, keeping the first one like
+    DataFrame.drop_duplicates does.
+    """
+    def __init__(self, columns: List[str], key_columns: Optional[List[str]] = None, batch_size: int = 65536) -> None:
+        self.columns = columns
+        self.key_columns = key_columns
+        self.batch_size = batch_size
+        self._data = {col: [] for col in columns}
+        # Arrow arrays of the flushed batches, one list per column
+        self._chunks = {col: [] for col in columns}
+        self._flushed = 0
+        self._seen = set()
+
+    def __len__(self) -> int:
+        return self._flushed + len(self._data[self.columns[0]])
+
+    def _is_new(self, key: tuple) -> bool:
+        # A single key column is stored as its value, a 1-tuple would double the size of the set
+        if len(key) == 1:
+            key = key[0]
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        return True
+
+    def _flush(self, minimum: int) -> None:
+        pending = len(self._data[self.columns[0]])
+        if pending == 0 or pending < minimum:
+            return
+        for col in self.columns:
+            self._chunks[col].append(pa.array(self._data[col]))
+            self._data[col] = []
+        self._flushed += pending
+
+    def append(self, row: Dict, **extra) -> bool:
+        """Appends row, with extra as constant column values. Returns False for a duplicate key."""
+        if self.key_columns is not None:
+            if not self._is_new(tuple(extra[col] if col in extra else row.get(col) for col in self.key_columns)):
+                return False
+        for col in self.columns:
+            self._data[col].append(extra[col] if col in extra else row.get(col))
+        self._flush(self.batch_size)
+        return True
+
+    def extend(self, rows: Iterable[Dict], **extra) -> int:
+        """Appends all the rows, returns the number of rows kept."""
+        return sum(self.append(row, **extra) for row in rows)
+
+    def extend_columns(self, columns: Dict[str, Sequence], **extra) -> int:
+        """Appends equally long columns (lists or arrays) at once, e.g. VideoBatch.columns(). Returns the number of rows kept."""
+        length = len(next(iter(columns.values()))) if columns else 0
+        keep = None
+        if self.key_columns is not None:
+            keys = zip(*[itertools.repeat(extra[col], length) if col in extra else columns[col] for col in self.key_columns])
+            keep = [i for i, key in enumerate(keys) if self._is_new(key)]
+            if len(keep) == length:
+                keep = None
+        kept = length if keep is None else len(keep)
+        for col in self.columns:
+            if col in extra:
+                self._data[col].extend(itertools.repeat(extra[col], kept))
+            elif col not in columns:
+                self._data[col].extend(itertools.repeat(None, kept))
+            elif keep is None:
+                self._data[col].extend(columns[col])
+            else:
+                self._data[col].extend(columns[col][i] for i in keep)
+        self._flush(self.batch_size)
+        return kept
+
+    def to_table(self) -> pa.Table:
+        self._flush(1)
+        arrays = []
+        for col in self.columns:
+            chunks = self._chunks[col] or [pa.array([])]
+            # A batch of only None values is typed null, it takes the type of the other batches
+            types = {chunk.type for chunk in chunks if chunk.type != pa.null()}
+            if len(types) == 1:
+                chunk_type = types.pop()
+                chunks = [chunk.cast(chunk_type) if chunk.type == pa.null() else chunk for chunk in chunks]
+            arrays.append(pa.chunked_array(chunks))
+        return pa.Table.from_arrays(arrays, names=self.columns)
+
+
+# Arrow schemas of the S3 datasets, typed like the stage tables in database/ddl /object_definition.ddl.
+# Field names are the S3 column names, the s3_col_map of each table spec maps them to the table columns.
+# The *_hourly datasets are the compact stats snapshots of the hourly snapshot granularity.
+DATASET_SCHEMAS = {
+    'channel_md': pa.schema([
+        ('channel_name', pa.string()),
+        ('channel_id', pa.string()),
+        ('title', pa.string()),
+        ('customUrl', pa.string()),
+        ('publishedAt', pa.timestamp('s')),
+        ('country', pa.string()),
+        ('etl_ts', pa.timestamp('s')),
+    ]),
+    'channel': pa.schema([
+        ('channel_id', pa.string()),
+        ('rptg_dt', pa.date32()),
+        ('viewCount', pa.int64()),
+        ('subscriberCount', pa.int64()),
+        ('videoCount', pa.int64()),
+        ('etl_ts', pa.timestamp('s')),
+    ]),
+    'video_md': pa.schema([
+        ('id', pa.string()),
+        ('channel_id', pa.string()),
+        ('title', pa.string()),
+        ('url', pa.string()),
+        ('publishedAt', pa.timestamp('s')),
+        ('etl_ts', pa.timestamp('s')),
+    ]),
+    'video': pa.schema([
+        ('id', pa.string()),
+        ('channel_id', pa.string()),
+        ('rptg_dt', pa.date32()),
+        ('views', pa.int64()),
+        ('likes', pa.int64()),
+        ('dislikes', pa.int64()),
+        ('comments', pa.int64()),
+        ('etl_ts', pa.timestamp('s')),
+    ]),
+    'channel_hourly': pa.schema([
+        ('channel_id', pa.string()),
+        ('rptg_ts', pa.timestamp('s')),
+        ('viewCount', pa.int64()),
+        ('subscriberCount', pa.int64()),
+        ('videoCount', pa.int64()),
+    ]),
+    'video_hourly': pa.schema([
+        ('id', pa.string()),
+        ('rptg_ts', pa.timestamp('s')),
+        ('views', pa.int64()),
+        ('likes', pa.int64()),
+        ('comments', pa.int64()),
+    ]),
+}
+
+# Snowflake type used in the COPY projection for each Arrow type
+SNOWFLAKE_TYPES = {
+    pa.string(): 'VARCHAR',
+    pa.int64(): 'NUMBER',
+    pa.date32(): 'DATE',
+    pa.timestamp('s'): 'TIMESTAMP_NTZ',
+}
+
+
+def coerce_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Returns the schema's columns of table cast to the schema's types, one compute kernel per column.
+
+    String timestamps may be ISO 8601 as returned by the API ('2024-01-01T00:00:00.5Z', fractions
+    are dropped) or 'YYYY-MM-DD HH:MM:SS'.
+    """
+    columns = []
+    for field in schema:
+        column = table[field.name]
+        if pa.types.is_timestamp(field.type) and pa.types.is_string(column.type):
+            column = pc.utf8_slice_codeunits(pc.replace_substring(column, 'T', ' ', max_replacements=1), 0, 19)
+        columns.append(column if column.type == field.type else pc.cast(column, field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+class S3MultipartStream():
+    """Write-only file object that uploads to S3 in parts of part_size bytes.
+
+    At most one part is buffered in memory. Objects smaller than one part are sent
+    with a single put_object, larger ones with a multipart upload which is aborted
+    when anything fails.
+    """
+    def __init__(self, s3_client: Any, bucket: str, key: str, part_size: Optional[int] = 8 * 1024 * 1024) -> None:
+        # S3 rejects parts below 5MB except for the last one
+        if part_size < 5 * 1024 * 1024:
+            raise ValueError("part_size must be at least 5MB")
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.bytes_written = 0
+        self.closed = False
+        # Wall time and number of the S3 requests, the rest of an upload is serialization
+        self.s3_seconds = 0.0
+        self.s3_requests = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.bytes_written
+
+    def flush(self) -> None:
+        pass
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            with memoryview(self._buffer) as view:
+                part = bytes(view[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._upload_part(part)
+        return len(data)
+
+    def _request(self, method: str, **kwargs) -> Any:
+        start = time.perf_counter()
+        try:
+            return getattr(self.s3_client, method)(Bucket=self.bucket, Key=self.key, **kwargs)
+        finally:
+            self.s3_seconds += time.perf_counter() - start
+            self.s3_requests += 1
+
+    def _upload_part(self, body: bytes) -> None:
+        if self._upload_id is None:
+            self._upload_id = self._request('create_multipart_upload')['UploadId']
+        part_number = len(self._parts) + 1
+        response = self._request('upload_part', UploadId=self._upload_id, PartNumber=part_number, Body=body)
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if self._upload_id is None:
+            self._request('put_object', Body=bytes(self._buffer))
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self._request('complete_multipart_upload', UploadId=self._upload_id, MultipartUpload={'Parts': self._parts})
+        self._buffer = bytearray()
+        self.closed = True
+
+    def abort(self) -> None:
+        if self._upload_id is not None:
+            self._request('abort_multipart_upload', UploadId=self._upload_id)
+        self._buffer = bytearray()
+        self.closed = True
+
+
+def upload_parquet(s3_client: Any,
+                   bucket: str,
+                   key: str,
+                   table: pa.Table,
+                   compression: Optional[str] = 'snappy',
+                   row_group_size: Optional[int] = 100000,
+                   part_size: Optional[int] = 8 * 1024 * 1024,
+                   metrics: Optional[RunMetrics] = None,
+                   stage: Optional[str] = 's3.upload') -> int:
+    """Streams table to s3://bucket/key as Parquet row group by row group. Returns the bytes written.
+
+    With metrics the upload is recorded as stage and its S3 requests as stage + '.requests'.
+    """
+    stream = S3MultipartStream(s3_client, bucket, key, part_size=part_size)
+    with _timed(metrics, stage, rows=table.num_rows) as record:
+        try:
+            with pq.ParquetWriter(stream, table.schema, compression=compression) as writer:
+                for batch in table.to_batches(max_chunksize=row_group_size):
+                    writer.write_batch(batch, row_group_size=row_group_size)
+            stream.close()
+        except Exception:
+            stream.abort()
+            raise
+        finally:
+            record['bytes'] = stream.bytes_written
+            if metrics is not None:
+                metrics.record(f"{stage}.requests", stream.s3_seconds, count=stream.s3_requests)
+    return stream.bytes_written
+
+
+def upload_parquet_datasets(s3_client: Any,
+                            bucket: str,
+                            datasets: Dict[str, Tuple[str, pa.Table]],
+                            max_workers: Optional[int] = 4,
+                            metrics: Optional[RunMetrics] = None,
+                            **kwargs) -> Dict[str, int]:
+    """Uploads {name: (key, table)} concurrently with upload_parquet. Returns the bytes written per name.
+
+    kwargs are passed to upload_parquet. All the uploads are awaited before the first
+    failure is raised, so no upload is left running in the background.
+    """
+    bytes_written = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(upload_parquet, s3_client, bucket, key, table,
+                                         metrics=metrics, stage=f"s3.upload.{name}", **kwargs)
+                   for name, (key, table) in datasets.items()}
+        for name, future in futures.items():
+            try:
+                bytes_written[name] = future.result()
+                logging.info(f"File {datasets[name][0]} has been uploaded to s3://{bucket} ({bytes_written[name]} bytes)")
+            except Exception as e:
+                errors[name] = e
+    if errors:
+        raise Exception(f"S3 Upload failed for {', '.join(errors)}. {errors}")
+    return bytes_written
+
+
+def internal_stage(schema: str, stage_table_name: str) -> str:
+    """Name of the internal stage every Snowflake table has, the target of the direct load backend."""
+    return f"{schema.upper()}.%{stage_table_name.upper()}"
+
+
+def put_parquet(conn: Any,
+                stage: str,
+                path: str,
+                table: pa.Table,
+                compression: Optional[str] = 'snappy',
+                row_group_size: Optional[int] = 100000,
+                metrics: Optional[RunMetrics] = None,
+                stage_name: Optional[str] = 'snowflake.put') -> int:
+    """Writes table as Parquet to path inside the internal stage with PUT. Returns the bytes written.
+
+    The file is built in memory and handed to the connector as file_stream, so nothing is
+    written to the local disk. With metrics the PUT is recorded as stage_name.
+    """
+    buffer = io.BytesIO()
+    with _timed(metrics, stage_name, rows=table.num_rows) as record:
+        pq.write_table(table, buffer, compression=compression, row_group_size=row_group_size)
+        record['bytes'] = buffer.tell()
+        buffer.seek(0)
+        directory, file_name = posixpath.split(path)
+        curs = conn.cursor()
+        try:
+            # The staged file keeps the source name, AUTO_COMPRESS would add .gz to it
+            curs.execute(f"PUT 'file://{file_name}' '@{stage}/{directory}' AUTO_COMPRESS = FALSE OVERWRITE = TRUE",
+                         file_stream=buffer)
+            record['query_id'] = getattr(curs, 'sfqid', None)
+        finally:
+            curs.close()
+    return record['bytes']
+
+
+def put_parquet_datasets(pool: 'SnowflakeConnectionPool',
+                         datasets: Dict[str, Tuple[str, str, pa.Table]],
+                         metrics: Optional[RunMetrics] = None,
+                         **kwargs) -> Dict[str, int]:
+    """PUTs {name: (stage, path, table)} concurrently over the pool with put_parquet. Returns the bytes written per name.
+
+    kwargs are passed to put_parquet. All the PUTs are awaited before the first failure is raised.
+    """
+    def put(name: str, stage: str, path: str, table: pa.Table) -> int:
+        with pool.connection() as conn:
+            return put_parquet(conn, stage, path, table, metrics=metrics, stage_name=f"snowflake.put.{name}", **kwargs)
+
+    bytes_written = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        futures = {name: executor.submit(put, name, *args) for name, args in datasets.items()}
+        for name, future in futures.items():
+            try:
+                bytes_written[name] = future.result()
+                logging.info(f"File {datasets[name][1]} has been put to @{datasets[name][0]} ({bytes_written[name]} bytes)")
+            except Exception as e:
+                errors[name] = e
+    if errors:
+        raise Exception(f"Snowflake PUT failed for {', '.join(errors)}. {errors}")
+    return bytes_written
+
+
+def remove_staged_files(conn: Any, stage: str, files: List[str]) -> int:
+    """Removes loaded files from an internal stage with one REMOVE of their common folder. Returns the files removed."""
+    prefix = posixpath.commonpath(files) + '/' if len(files) > 1 else files[0]
+    curs = conn.cursor()
+    try:
+        curs.execute(f"REMOVE '@{stage}/{prefix}';")
+        return len(curs.fetchall())
+    finally:
+        curs.close()
+
+
+class _InstrumentedCursor():
+    """Cursor proxy recording every execute() as stage.<STATEMENT KIND> with its query id."""
+    def __init__(self, curs: Any, metrics: RunMetrics, stage: str) -> None:
+        self._curs = curs
+        self._metrics = metrics
+        self._stage = stage
+
+    def execute(self, sql: str, *args, **kwargs) -> Any:
+        kind = sql.split(None, 1)[0].upper() if sql.strip() else 'EMPTY'
+        start = time.perf_counter()
+        try:
+            return self._curs.execute(sql, *args, **kwargs)
+        finally:
+            self._metrics.record(f"{self._stage}.{kind}", time.perf_counter() - start,
+                                 query_id=getattr(self._curs, 'sfqid', None))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._curs, name)
+
+
+def _open_cursor(conn: Any, metrics: Optional[RunMetrics], stage: str) -> Any:
+    # A cursor recording its statements under stage when there is a RunMetrics
+    curs = conn.cursor()
+    if metrics is None:
+        return curs
+    return _InstrumentedCursor(curs, metrics, stage)
+
+
+@contextmanager
+def _transaction(curs: Any):
+    # BEGIN ... COMMIT, rolled back when the block or the COMMIT fails
+    curs.execute('BEGIN')
+    try:
+        yield curs
+        curs.execute('COMMIT')
+    except Exception:
+        curs.execute('ROLLBACK')
+        raise
+
+
+def _execute_in_transaction(curs: Any, statements: List[str]) -> List[tuple]:
+    """Runs the statements in one transaction, returns the first result row of each (() for none)."""
+    results = []
+    with _transaction(curs):
+        for sql in statements:
+            logging.info(sql)
+            curs.execute(sql)
+            results.append(curs.fetchone() or ())
+    return results
+
+
 class SnowflakeLoader():
     def __init__(self,
                  conn: Any,
@@ -145,28 +1985,53 @@ class SnowflakeLoader():
                  core_table_name: str,
                  s3_col_map: Dict,
                  load_type: Optional[str] = 'FULL',
-                 merge_on_col: Optional[List[str]] = []
+                 merge_on_col: Optional[List[str]] = [],
+                 table_columns: Optional[Dict[str, List[str]]] = None,
+                 detect_changes: Optional[bool] = True,
+                 change_ignore_cols: Optional[List[str]] = ['etl_ts'],
+                 s3_schema: Optional[pa.Schema] = None,
+                 prune_on_col: Optional[str] = None,
+                 load_backend: Optional[str] = 's3',
+                 metrics: Optional[RunMetrics] = None
                 ):
+        # table_columns is the output of fetch_table_columns. When given, the column
+        # metadata is taken from it instead of querying INFORMATION_SCHEMA per table.
+        # s3_schema is the Arrow schema of the staged files (DATASET_SCHEMAS), the COPY then
+        # casts each column to its type instead of going through VARIANT.
+        # prune_on_col is a merge_on_col column the core table is clustered on (rptg_dt). The
+        # MERGE then only reads the core rows within the stage's range of that column.
+        # load_backend 'direct' copies the files from the stage table's internal stage, where
+        # the extraction PUT them, instead of from the s3_stage_name external stage.
+        # With metrics every statement is recorded as snowflake.<core table>.<statement kind>
+        # and every s3_to_stg/stg_to_core call as snowflake.<core table>.<method>.
+        self.metrics = metrics
+        self.core_table_name = core_table_name.upper()
         try:
-            curs = conn.cursor()
+            curs = self._cursor(conn)
         except Exception as e:
             raise Exception(f"Error while opening the cursor. {e}")
         
         # Check when load type is Merge, the merge_on_col need to be supplied
         if load_type.upper() == 'MERGE' and len(merge_on_col) == 0:
             raise Exception(f"merge_on_col arg is mandatory for Loader type: {load_type}")
+        if load_backend.lower() not in ('s3', 'direct'):
+            raise Exception(f"Unknown load_backend {load_backend}, expected 's3' or 'direct'")
         
-        # Fecthing stage table columns
-        curs.execute(f"""
-        SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = '{stage_table_name.upper()}' AND TABLE_SCHEMA = '{schema.upper()}';
-        """)
-        self.stg_cols = [row[0] for row in curs.fetchall()]
-        
-        # Fecthing main table columns
-        curs.execute(f"""
-        SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = '{core_table_name.upper()}' AND TABLE_SCHEMA = '{schema.upper()}';
-        """)
-        self.main_cols = [row[0] for row in curs.fetchall()]
+        if table_columns is not None:
+            self.stg_cols = table_columns.get(stage_table_name.upper(), [])
+            self.main_cols = table_columns.get(core_table_name.upper(), [])
+        else:
+            # Fecthing stage table columns
+            curs.execute(f"""
+            SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = '{stage_table_name.upper()}' AND TABLE_SCHEMA = '{schema.upper()}';
+            """)
+            self.stg_cols = [row[0] for row in curs.fetchall()]
+            
+            # Fecthing main table columns
+            curs.execute(f"""
+            SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = '{core_table_name.upper()}' AND TABLE_SCHEMA = '{schema.upper()}';
+            """)
+            self.main_cols = [row[0] for row in curs.fetchall()]
         
         # Checking if stage and main table columns are in sync
         if not set(self.main_cols) == set(self.stg_cols):
@@ -182,41 +2047,84 @@ class SnowflakeLoader():
         if load_type.upper() == 'MERGE':
             if len([col for col in self.merge_on_col if col in self.main_cols and col in self.stg_cols]) != len(self.merge_on_col):
                 raise Exception('All columns in merge_on_col must be present in both stage and core table.')
+            if prune_on_col is not None and prune_on_col.upper() not in self.merge_on_col:
+                raise Exception(f"prune_on_col {prune_on_col} must be one of the merge_on_col columns.")
         
             
         self.schema = schema.upper()
         self.stage_table_name = stage_table_name.upper()
-        self.core_table_name = core_table_name.upper()
         self.load_type = load_type.upper()
+        self.s3_schema = s3_schema
+        self.prune_on_col = prune_on_col.upper() if prune_on_col else None
+        # With detect_changes a matched row is only updated when a column outside
+        # change_ignore_cols differs, so unchanged rows are not rewritten
+        self.detect_changes = detect_changes
+        self.change_ignore_cols = [col.upper() for col in change_ignore_cols]
         self.conn = conn
         self.s3_col_map = s3_col_map
         self.s3_stage_name = s3_stage_name
+        self.load_backend = load_backend.lower()
+        self.source_stage = s3_stage_name if self.load_backend == 's3' else internal_stage(schema, stage_table_name)
         
         curs.close()
     
+    def _cursor(self, conn: Any) -> Any:
+        return _open_cursor(conn, self.metrics, f"snowflake.{self.core_table_name}")
+
     def curs_handler(func):
         def wrapper(self, *args, **kwargs):
-            try:
-                curs = self.conn.cursor()
-            except Exception as e:
-                raise Exception(f"from db_conn_check: Error while opening the cursor. {e}")
-            func(self, curs, *args, **kwargs)
-            curs.close()
+            with _timed(self.metrics, f"snowflake.{self.core_table_name}.{func.__name__}") as record:
+                try:
+                    curs = self._cursor(self.conn)
+                except Exception as e:
+                    raise Exception(f"from db_conn_check: Error while opening the cursor. {e}")
+                try:
+                    result = func(self, curs, *args, **kwargs)
+                finally:
+                    curs.close()
+                # Rows loaded by s3_to_stg, rows inserted and updated by stg_to_core
+                if isinstance(result, int):
+                    record['rows'] = result
+                elif isinstance(result, dict):
+                    record['rows'] = result.get('rows_inserted', 0) + result.get('rows_updated', 0)
+                return result
         return wrapper
 
-    
-    @curs_handler
-    def stg_to_core(self, curs, *args, **kwargs) -> None:
-            
+    def core_load_sql(self, prune_range: Optional[tuple] = None) -> List[str]:
+        """Returns the statements stg_to_core runs for the load type.
+
+        prune_range is the (min, max) of prune_on_col in the stage table. The MERGE condition
+        then bounds the core table to it with literals, which Snowflake prunes micro-partitions on.
+        """
         if self.load_type == 'MERGE':
-            sql_text = [f"""
+            update_cols = [col for col in self.main_cols if col not in self.merge_on_col]
+            compare_cols = [col for col in update_cols if col not in self.change_ignore_cols]
+            # Latest stage row per key wins when the stage has duplicates
+            order_col = 'ETL_TS' if 'ETL_TS' in self.stg_cols else self.merge_on_col[0]
+
+            when_matched = ''
+            if update_cols:
+                change_filter = ''
+                if self.detect_changes and compare_cols:
+                    change_filter = f"AND ({' OR '.join(f't.{col} IS DISTINCT FROM d.{col}' for col in compare_cols)})"
+                when_matched = f"""WHEN MATCHED {change_filter} THEN
+                UPDATE SET
+                {', '.join(f"{col} = d.{col} " for col in update_cols)}"""
+
+            prune_filter = ''
+            if self.prune_on_col and prune_range:
+                prune_filter = f"AND t.{self.prune_on_col} BETWEEN '{prune_range[0]}' AND '{prune_range[1]}' "
+
+            return [f"""
                 MERGE INTO {self.schema}.{self.core_table_name} as t
-                USING {self.schema}.{self.stage_table_name} as d
+                USING (
+                    SELECT {','.join(self.main_cols)} FROM {self.schema}.{self.stage_table_name}
+                    QUALIFY ROW_NUMBER() OVER (PARTITION BY {','.join(self.merge_on_col)} ORDER BY {order_col} DESC) = 1
+                ) as d
                 ON 
                 {'AND '.join(f"d.{col} = t.{col} " for col in self.merge_on_col)}
-                WHEN MATCHED THEN
-                UPDATE SET
-                {', '.join(f"{col} = d.{col} " for col in [col for col in self.main_cols if col not in self.merge_on_col])}
+                {prune_filter}
+                {when_matched}
                 WHEN NOT MATCHED THEN
                 INSERT
                 ({','.join([col for col in self.main_cols])})
@@ -225,21 +2133,49 @@ class SnowflakeLoader():
                 ;
                 """]
         else:
-            sql_text = [f"delete from {self.schema}.{self.core_table_name};",
-            f"""insert into {self.schema}.{self.core_table_name}
+            # A single INSERT OVERWRITE replaces the table atomically
+            return [f"""insert overwrite into {self.schema}.{self.core_table_name}
             ({','.join([col for col in self.main_cols])})
             select
             {','.join([col for col in self.main_cols])}
             from
             {self.schema}.{self.stage_table_name};
             """]
-        
-        for sql in sql_text:
+    
+    @curs_handler
+    def stg_to_core(self, curs, *args, **kwargs) -> Dict[str, int]:
+        """Loads the stage table into the core table, returns the rows inserted and updated."""
+        rows = {'rows_inserted': 0, 'rows_updated': 0}
+        prune_range = None
+        if self.load_type == 'MERGE' and self.prune_on_col:
+            # Answered from the stage's metadata, no scan
+            curs.execute(f"SELECT MIN({self.prune_on_col}), MAX({self.prune_on_col}) FROM {self.schema}.{self.stage_table_name};")
+            result = curs.fetchone()
+            if result and result[0] is not None:
+                prune_range = (result[0], result[1])
+        for sql in self.core_load_sql(prune_range):
             curs.execute(sql)
             logging.info(sql)
+            # MERGE returns (inserted, updated), INSERT returns (inserted)
+            result = curs.fetchone()
+            if result:
+                rows['rows_inserted'] += result[0] or 0
+                if len(result) > 1:
+                    rows['rows_updated'] += result[1] or 0
+
+        logging.info(f"{self.schema}.{self.core_table_name}: {rows['rows_inserted']} rows inserted, {rows['rows_updated']} rows updated.")
+        return rows
+
+    def _s3_col_type(self, s3_col: str) -> str:
+        if self.s3_schema is None or s3_col not in self.s3_schema.names:
+            return 'VARIANT'
+        return SNOWFLAKE_TYPES[self.s3_schema.field(s3_col).type]
 
     @curs_handler  
-    def s3_to_stg(self, curs, *args, **kwargs) -> None:
+    def s3_to_stg(self, curs, files: Optional[List[str]] = None, *args, **kwargs) -> int:
+        # files are paths relative to the stage URL. When given, exactly those files are
+        # copied, with FORCE so a retried task reloads them after the stage cleanup.
+        # Without files the whole stage is copied and Snowflake's load metadata decides.
         
         # Validate S3_col_map dictionary if available
         for item in self.s3_col_map.items():
@@ -250,16 +2186,574 @@ class SnowflakeLoader():
         # Cleanup stage table first
         curs.execute(f"""delete from {self.schema}.{self.stage_table_name};""")
         
+        # Snowflake string literals: quotes are doubled and backslash is the escape character
+        quoted_files = ', '.join("'" + f.replace('\\', '\\\\').replace("'", "''") + "'" for f in files or [])
+
         # Prepare the COPY INTO statement for S3 load
         sql_text = f"""
         COPY INTO {self.schema}.{self.stage_table_name} ({','.join([col for col in [item[1] for item in self.s3_col_map.items()]])})
         FROM (
             SELECT
-            {','.join([f"$1:{item[0]}::VARIANT AS {item[1]}" for item in self.s3_col_map.items()])}
-            FROM @{self.s3_stage_name}
+            {','.join([f"$1:{item[0]}::{self._s3_col_type(item[0])} AS {item[1]}" for item in self.s3_col_map.items()])}
+            FROM @{self.source_stage}
         )
-        FILE_FORMAT = (TYPE = 'PARQUET');
+        {f"FILES = ({quoted_files})" if files else ''}
+        FILE_FORMAT = (TYPE = 'PARQUET')
+        {'FORCE = TRUE' if files else ''};
         """
         
         logging.info(sql_text)
         curs.execute(sql_text)
+        # One result row per file: file, status, rows_parsed, rows_loaded, ...
+        rows_loaded = sum(row[3] for row in curs.fetchall() if len(row) > 3 and isinstance(row[3], int))
+        logging.info(f"{self.schema}.{self.stage_table_name}: {rows_loaded} rows loaded.")
+        return rows_loaded
+
+
+
+def fetch_table_columns(conn: Any, schema: str, table_names: List[str]) -> Dict[str, List[str]]:
+    """Fetches the columns of all table_names with one INFORMATION_SCHEMA query. Keys are upper case."""
+    curs = conn.cursor()
+    try:
+        curs.execute(f"""
+        SELECT TABLE_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = '{schema.upper()}' AND TABLE_NAME IN ({','.join(f"'{t.upper()}'" for t in table_names)})
+        ORDER BY TABLE_NAME, ORDINAL_POSITION;
+        """)
+        table_columns = {}
+        for table_name, column_name in curs.fetchall():
+            table_columns.setdefault(table_name, []).append(column_name)
+    finally:
+        curs.close()
+    return table_columns
+
+
+def fetch_channel_weights(conn: Any, schema: str, days_count: Optional[int] = 365,
+                          page_size: Optional[int] = 50) -> Dict[str, int]:
+    """Estimated YouTube API calls of extracting each loaded channel, keyed by channel name.
+
+    A channel costs its channel lookup plus a playlist page and a statistics batch per
+    page_size videos published in the last days_count days, counted from the CORE tables.
+    """
+    since = (datetime.datetime.now() - datetime.timedelta(days=days_count)).strftime("%Y-%m-%d %H:%M:%S")
+    curs = conn.cursor()
+    try:
+        curs.execute(f"""
+        SELECT md.CHANNEL_NAME, COUNT(DISTINCT v.ID)
+        FROM (SELECT DISTINCT CHANNEL_NAME, CHANNEL_ID FROM {schema}.TBL_YT_CHANNEL_MD) md
+        LEFT JOIN {schema}.TBL_YT_VIDEO_MD v
+          ON v.CHANNEL_ID = md.CHANNEL_ID AND v.PUBLISHED_AT >= '{since}'
+        GROUP BY md.CHANNEL_NAME;
+        """)
+        rows = curs.fetchall()
+    finally:
+        curs.close()
+    return {channel_name: 1 + 2 * -(-video_count // page_size) for channel_name, video_count in rows}
+
+
+class SnowflakeConnectionPool():
+    """Fixed size pool of connections created lazily with connect()."""
+    def __init__(self, connect: Any, size: Optional[int] = 4) -> None:
+        self._connect = connect
+        self.size = size
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> Any:
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: Any) -> None:
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self) -> None:
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._created -= len(self._idle)
+            self._idle = []
+
+
+class SnowflakeLoadRunner():
+    """Runs s3_to_stg + stg_to_core for a list of table specs concurrently over a connection pool.
+
+    A table spec is a dict with a 'dataset' name, the SnowflakeLoader arguments (except conn,
+    schema and table_columns) and an optional 'depends_on' list of datasets which must be
+    loaded first. The column metadata of all the tables is fetched with a single query.
+    Files of the 'direct' load_backend are removed from the internal stages after the load.
+    """
+    def __init__(self,
+                 pool: SnowflakeConnectionPool,
+                 schema: str,
+                 table_specs: List[Dict],
+                 max_workers: Optional[int] = None,
+                 metrics: Optional[RunMetrics] = None) -> None:
+        datasets = [spec['dataset'] for spec in table_specs]
+        for spec in table_specs:
+            for dep in spec.get('depends_on', []):
+                if dep not in datasets:
+                    raise Exception(f"Table spec {spec['dataset']} depends on unknown dataset {dep}")
+        self.pool = pool
+        self.schema = schema
+        self.table_specs = self._ordered(table_specs)
+        self.max_workers = max_workers or pool.size
+        self.metrics = metrics
+
+    @staticmethod
+    def _ordered(table_specs: List[Dict]) -> List[Dict]:
+        # Dependencies first, so a spec waiting on them never blocks their own start
+        ordered = []
+        done = set()
+        pending = list(table_specs)
+        while pending:
+            ready = [spec for spec in pending if set(spec.get('depends_on', [])) <= done]
+            if not ready:
+                raise Exception(f"Circular depends_on between {[spec['dataset'] for spec in pending]}")
+            for spec in ready:
+                ordered.append(spec)
+                done.add(spec['dataset'])
+                pending.remove(spec)
+        return ordered
+
+    def _load_table(self, spec: Dict, table_columns: Dict, files: Optional[List[str]], deps: List[Future]) -> Dict[str, float]:
+        # Returns the step timings and the rows inserted/updated by stg_to_core
+        for dep in deps:
+            dep.result()
+        loader_args = {k: v for k, v in spec.items() if k not in ('dataset', 'depends_on')}
+        timings = {}
+        start = time.perf_counter()
+        with self.pool.connection() as conn:
+            loader = SnowflakeLoader(conn=conn, schema=self.schema, table_columns=table_columns, metrics=self.metrics, **loader_args)
+            loader.s3_to_stg(files=files)
+            timings['s3_to_stg'] = time.perf_counter() - start
+            timings.update(loader.stg_to_core())
+        timings['total'] = time.perf_counter() - start
+        timings['stg_to_core'] = timings['total'] - timings['s3_to_stg']
+        logging.info(f"Loaded {spec['dataset']}: s3_to_stg {timings['s3_to_stg']:.2f}s, stg_to_core {timings['stg_to_core']:.2f}s, "
+                     f"{timings['rows_inserted']} rows inserted, {timings['rows_updated']} rows updated")
+        return timings
+
+    def run(self, files_by_dataset: Optional[Dict[str, List[str]]] = None) -> Dict[str, Dict[str, float]]:
+        """Loads all the tables, returns the per table timings and row counts. Raises after all tables finished if any failed."""
+        files_by_dataset = files_by_dataset or {}
+        table_names = [spec[key] for spec in self.table_specs for key in ('stage_table_name', 'core_table_name')]
+        with self.pool.connection() as conn, _timed(self.metrics, 'snowflake.fetch_table_columns'):
+            table_columns = fetch_table_columns(conn, self.schema, table_names)
+
+        timings = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            for spec in self.table_specs:
+                deps = [futures[dep] for dep in spec.get('depends_on', [])]
+                futures[spec['dataset']] = executor.submit(self._load_table, spec, table_columns,
+                                                           files_by_dataset.get(spec['dataset']), deps)
+            for dataset, future in futures.items():
+                try:
+                    timings[dataset] = future.result()
+                except Exception as e:
+                    logging.error(f"Load failed for {dataset}. {e}")
+                    errors[dataset] = e
+        if errors:
+            raise Exception(f"Snowflake load failed for {', '.join(errors)}. {errors}")
+        self._remove_direct_files(files_by_dataset)
+        return timings
+
+    def _remove_direct_files(self, files_by_dataset: Dict[str, List[str]]) -> None:
+        # Only once every table loaded, so a retry of a failed load still finds all its files.
+        # The S3 archive keeps a copy, a failed REMOVE leaves the files for the next cleanup.
+        def remove(spec: Dict, files: List[str]) -> None:
+            stage = internal_stage(self.schema, spec['stage_table_name'])
+            try:
+                with self.pool.connection() as conn, _timed(self.metrics, f"snowflake.remove.{spec['dataset']}") as record:
+                    record['files'] = remove_staged_files(conn, stage, files)
+            except Exception as e:
+                logging.warning(f"Removing the loaded files from @{stage} failed. {e}")
+
+        direct = [(spec, files_by_dataset[spec['dataset']]) for spec in self.table_specs
+                  if spec.get('load_backend', 's3').lower() == 'direct' and files_by_dataset.get(spec['dataset'])]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for spec, files in direct:
+                executor.submit(remove, spec, files)
+
+
+class SemanticAggregator():
+    """Maintains the SEMANTIC aggregates the dashboards read, recomputing only what the last load touched.
+
+    Runs after the loads, while the stage tables still hold the last load's rows: their
+    rptg_dt values are the dates recomputed and the publish months of their video_md
+    rows are the upload months recomputed. Per date tables are replaced date by date
+    (DELETE + INSERT in one transaction), so re-running a load gives the same result.
+    The engagement and top video tables aggregate the TBL_YT_VIDEO_STATS rows of each date.
+
+    run(dates=[...]) backfills: it recomputes the given dates from the CORE tables, whatever
+    the stage holds, and by default every upload month found in TBL_YT_VIDEO_MD.
+    """
+    def __init__(self,
+                 conn: Any,
+                 core_schema: Optional[str] = 'CORE',
+                 semantic_schema: Optional[str] = 'SEMANTIC',
+                 top_n: Optional[int] = 3,
+                 lookback_days: Optional[int] = 7,
+                 metrics: Optional[RunMetrics] = None) -> None:
+        # lookback_days bounds how far back the previous channel snapshot is looked for
+        self.conn = conn
+        self.core = core_schema.upper()
+        self.sem = semantic_schema.upper()
+        self.top_n = top_n
+        self.lookback_days = lookback_days
+        self.metrics = metrics
+
+    def changed_dates(self, curs) -> List[str]:
+        curs.execute(f"""
+        SELECT DISTINCT RPTG_DT FROM {self.core}.TBL_STG_YT_CHANNEL_STATS
+        UNION
+        SELECT DISTINCT RPTG_DT FROM {self.core}.TBL_STG_YT_VIDEO_STATS;
+        """)
+        return sorted(str(row[0]) for row in curs.fetchall() if row[0] is not None)
+
+    def changed_months(self, curs, table: Optional[str] = 'TBL_STG_YT_VIDEO_MD') -> List[str]:
+        curs.execute(f"""
+        SELECT DISTINCT DATE_TRUNC('month', PUBLISHED_AT)::DATE FROM {self.core}.{table} WHERE PUBLISHED_AT IS NOT NULL;
+        """)
+        return sorted(str(row[0]) for row in curs.fetchall())
+
+    def _in_dates(self, dates: List[str]) -> str:
+        return ', '.join(f"DATE '{dt}'" for dt in dates)
+
+    def video_latest_sql(self, dates: Optional[List[str]] = None) -> List[str]:
+        """MERGE of the stage's video stats, or of the CORE ones of dates, into TBL_YT_VIDEO_LATEST."""
+        cols = ['ID', 'CHANNEL_ID', 'RPTG_DT', 'VIEW_COUNT', 'LIKE_COUNT', 'DISLIKE_COUNT', 'COMMENT_COUNT', 'ETL_TS']
+        source = f"{self.core}.TBL_STG_YT_VIDEO_STATS"
+        if dates:
+            source = f"{self.core}.TBL_YT_VIDEO_STATS WHERE RPTG_DT IN ({self._in_dates(dates)})"
+        return [f"""
+            MERGE INTO {self.sem}.TBL_YT_VIDEO_LATEST as t
+            USING (
+                SELECT {','.join(cols)} FROM {source}
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY ID ORDER BY RPTG_DT DESC, ETL_TS DESC) = 1
+            ) as d
+            ON d.ID = t.ID
+            WHEN MATCHED AND d.RPTG_DT >= t.RPTG_DT THEN
+            UPDATE SET
+            {', '.join(f"{col} = d.{col}" for col in cols if col != 'ID')}
+            WHEN NOT MATCHED THEN
+            INSERT ({','.join(cols)})
+            VALUES ({','.join(f"d.{col}" for col in cols)});
+            """]
+
+    def channel_daily_sql(self, dates: List[str], etl_ts: str) -> List[str]:
+        # LAG over a lookback window instead of a self join on the previous day
+        in_dates = self._in_dates(dates)
+        start_dt = (datetime.date.fromisoformat(dates[0]) - datetime.timedelta(days=self.lookback_days)).isoformat()
+        return [f"DELETE FROM {self.sem}.TBL_YT_CHANNEL_DAILY WHERE RPTG_DT IN ({in_dates});",
+                f"""
+            INSERT INTO {self.sem}.TBL_YT_CHANNEL_DAILY
+            (CHANNEL_ID, RPTG_DT, SUBSCRIBER_COUNT, VIEW_COUNT, VIDEO_COUNT, NEW_SUBSCRIBERS, NEW_VIEWS, NEW_VIDEOS, ETL_TS)
+            SELECT CHANNEL_ID, RPTG_DT, SUBSCRIBER_COUNT, VIEW_COUNT, VIDEO_COUNT, NEW_SUBSCRIBERS, NEW_VIEWS, NEW_VIDEOS, TIMESTAMP '{etl_ts}'
+            FROM (
+                SELECT CHANNEL_ID, RPTG_DT, SUBSCRIBER_COUNT, VIEW_COUNT, VIDEO_COUNT,
+                SUBSCRIBER_COUNT - LAG(SUBSCRIBER_COUNT) OVER (PARTITION BY CHANNEL_ID ORDER BY RPTG_DT) AS NEW_SUBSCRIBERS,
+                VIEW_COUNT - LAG(VIEW_COUNT) OVER (PARTITION BY CHANNEL_ID ORDER BY RPTG_DT) AS NEW_VIEWS,
+                VIDEO_COUNT - LAG(VIDEO_COUNT) OVER (PARTITION BY CHANNEL_ID ORDER BY RPTG_DT) AS NEW_VIDEOS
+                FROM {self.core}.TBL_YT_CHANNEL_STATS
+                WHERE RPTG_DT BETWEEN DATE '{start_dt}' AND DATE '{dates[-1]}'
+            ) src
+            WHERE RPTG_DT IN ({in_dates});
+            """]
+
+    def _video_stats(self, dates: List[str]) -> str:
+        # The video snapshots of the dates, one per video and date
+        return f"""SELECT ID, CHANNEL_ID, RPTG_DT, VIEW_COUNT, LIKE_COUNT, DISLIKE_COUNT, COMMENT_COUNT
+                FROM {self.core}.TBL_YT_VIDEO_STATS
+                WHERE RPTG_DT IN ({self._in_dates(dates)})
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY ID, RPTG_DT ORDER BY ETL_TS DESC) = 1"""
+
+    def channel_engagement_sql(self, dates: List[str], etl_ts: str) -> List[str]:
+        in_dates = self._in_dates(dates)
+        return [f"DELETE FROM {self.sem}.TBL_YT_CHANNEL_ENGAGEMENT WHERE RPTG_DT IN ({in_dates});",
+                f"""
+            INSERT INTO {self.sem}.TBL_YT_CHANNEL_ENGAGEMENT
+            (CHANNEL_ID, RPTG_DT, VIDEO_COUNT, TOTAL_VIEWS, TOTAL_LIKES, TOTAL_DISLIKES, TOTAL_COMMENTS, ENGAGEMENT_PERC, ETL_TS)
+            SELECT v.CHANNEL_ID, v.RPTG_DT, COUNT(*), SUM(v.VIEW_COUNT), SUM(v.LIKE_COUNT), SUM(v.DISLIKE_COUNT), SUM(v.COMMENT_COUNT),
+            CASE WHEN SUM(v.VIEW_COUNT) > 0
+                THEN (SUM(v.LIKE_COUNT) - SUM(v.DISLIKE_COUNT) + SUM(v.COMMENT_COUNT)) / SUM(v.VIEW_COUNT) * 100 END,
+            TIMESTAMP '{etl_ts}'
+            FROM ({self._video_stats(dates)}) v
+            GROUP BY v.CHANNEL_ID, v.RPTG_DT;
+            """]
+
+    def video_top_sql(self, dates: List[str], etl_ts: str) -> List[str]:
+        in_dates = self._in_dates(dates)
+        scored = f"""SELECT ID, CHANNEL_ID, RPTG_DT, VIEW_COUNT, LIKE_COUNT, DISLIKE_COUNT, COMMENT_COUNT,
+                CASE WHEN COALESCE(VIEW_COUNT, 0) > 0
+                    THEN (LIKE_COUNT - DISLIKE_COUNT + COMMENT_COUNT) / VIEW_COUNT * 100 ELSE 0 END AS ENGAGEMENT_PERC
+                FROM ({self._video_stats(dates)}) v"""
+        ranked = ' UNION ALL '.join(f"""
+                SELECT '{metric}' AS METRIC, ROW_NUMBER() OVER (PARTITION BY CHANNEL_ID, RPTG_DT ORDER BY {order_col} DESC NULLS LAST, ID) AS VIDEO_RANK, s.*
+                FROM ({scored}) s""" for metric, order_col in [('views', 'VIEW_COUNT'), ('engagement', 'ENGAGEMENT_PERC')])
+        return [f"DELETE FROM {self.sem}.TBL_YT_VIDEO_TOP WHERE RPTG_DT IN ({in_dates});",
+                f"""
+            INSERT INTO {self.sem}.TBL_YT_VIDEO_TOP
+            (CHANNEL_ID, RPTG_DT, METRIC, VIDEO_RANK, ID, VIEW_COUNT, LIKE_COUNT, DISLIKE_COUNT, COMMENT_COUNT, ENGAGEMENT_PERC, ETL_TS)
+            SELECT r.CHANNEL_ID, r.RPTG_DT, r.METRIC, r.VIDEO_RANK, r.ID, r.VIEW_COUNT, r.LIKE_COUNT, r.DISLIKE_COUNT, r.COMMENT_COUNT,
+            r.ENGAGEMENT_PERC, TIMESTAMP '{etl_ts}'
+            FROM ({ranked}) r
+            WHERE r.VIDEO_RANK <= {int(self.top_n)};
+            """]
+
+    def monthly_uploads_sql(self, months: List[str], etl_ts: str) -> List[str]:
+        in_months = ', '.join(f"DATE '{month}'" for month in months)
+        last = datetime.date.fromisoformat(months[-1])
+        end_dt = datetime.date(last.year + last.month // 12, last.month % 12 + 1, 1).isoformat()
+        return [f"DELETE FROM {self.sem}.TBL_YT_CHANNEL_MONTHLY_UPLOADS WHERE UPLOAD_MONTH IN ({in_months});",
+                f"""
+            INSERT INTO {self.sem}.TBL_YT_CHANNEL_MONTHLY_UPLOADS (CHANNEL_ID, UPLOAD_MONTH, VIDEO_COUNT, ETL_TS)
+            SELECT CHANNEL_ID, DATE_TRUNC('month', PUBLISHED_AT)::DATE AS UPLOAD_MONTH, COUNT(DISTINCT ID), TIMESTAMP '{etl_ts}'
+            FROM {self.core}.TBL_YT_VIDEO_MD
+            WHERE PUBLISHED_AT >= DATE '{months[0]}' AND PUBLISHED_AT < DATE '{end_dt}'
+            AND DATE_TRUNC('month', PUBLISHED_AT)::DATE IN ({in_months})
+            GROUP BY 1, 2;
+            """]
+
+    def _replace(self, curs, table: str, statements: List[str]) -> int:
+        # One transaction per table, the dashboards never see a deleted but not yet inserted date
+        with _timed(self.metrics, f"semantic.{table}") as record:
+            results = _execute_in_transaction(curs, statements)
+            # DELETE results are not counted
+            rows = sum(value or 0 for sql, result in zip(statements, results)
+                       if not sql.lstrip().upper().startswith('DELETE') for value in result)
+            record['rows'] = rows
+        return rows
+
+    def run(self,
+            etl_ts: Optional[str] = None,
+            dates: Optional[List[str]] = None,
+            months: Optional[List[str]] = None) -> Dict[str, int]:
+        """Refreshes the aggregates, returns the rows written per SEMANTIC table.
+
+        dates (YYYY-MM-DD) backfills those dates from CORE instead of the ones of the last load,
+        with months (first days of the upload months) defaulting to every month in CORE.
+        """
+        etl_ts = etl_ts or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        curs = _open_cursor(self.conn, self.metrics, f"snowflake.{self.sem}")
+        try:
+            if dates is None:
+                dates = self.changed_dates(curs)
+                months = self.changed_months(curs) if months is None else sorted(months)
+                latest_sql = self.video_latest_sql()
+            else:
+                dates = sorted(str(dt) for dt in dates)
+                months = self.changed_months(curs, 'TBL_YT_VIDEO_MD') if months is None else sorted(months)
+                latest_sql = self.video_latest_sql(dates)
+            logging.info(f"Refreshing {self.sem} for dates {dates} and upload months {months}")
+            rows = {'TBL_YT_VIDEO_LATEST': self._replace(curs, 'TBL_YT_VIDEO_LATEST', latest_sql)}
+            if dates:
+                rows['TBL_YT_CHANNEL_DAILY'] = self._replace(curs, 'TBL_YT_CHANNEL_DAILY', self.channel_daily_sql(dates, etl_ts))
+                rows['TBL_YT_CHANNEL_ENGAGEMENT'] = self._replace(curs, 'TBL_YT_CHANNEL_ENGAGEMENT', self.channel_engagement_sql(dates, etl_ts))
+                rows['TBL_YT_VIDEO_TOP'] = self._replace(curs, 'TBL_YT_VIDEO_TOP', self.video_top_sql(dates, etl_ts))
+            if months:
+                rows['TBL_YT_CHANNEL_MONTHLY_UPLOADS'] = self._replace(curs, 'TBL_YT_CHANNEL_MONTHLY_UPLOADS', self.monthly_uploads_sql(months, etl_ts))
+        finally:
+            curs.close()
+        logging.info(f"{self.sem} refreshed: {rows}")
+        return rows
+
+
+# Snapshot tables compacted by StatsRetention: key and counter columns, and the rollup table
+STATS_ROLLUPS = {
+    'TBL_YT_VIDEO_STATS': {
+        'rollup_table': 'TBL_YT_VIDEO_STATS_ROLLUP',
+        'key_cols': ['ID', 'CHANNEL_ID'],
+        'value_cols': ['VIEW_COUNT', 'LIKE_COUNT', 'DISLIKE_COUNT', 'COMMENT_COUNT'],
+    },
+    'TBL_YT_CHANNEL_STATS': {
+        'rollup_table': 'TBL_YT_CHANNEL_STATS_ROLLUP',
+        'key_cols': ['CHANNEL_ID'],
+        'value_cols': ['VIEW_COUNT', 'SUBSCRIBER_COUNT', 'VIDEO_COUNT'],
+    },
+}
+
+
+class StatsRetention():
+    """Rolls old daily snapshots of the stats tables up into weekly and monthly rows.
+
+    Snapshots older than daily_days move to the rollup table as one row per key and week,
+    older than weekly_days as one row per key and month (weekly rows are merged into the
+    month of their last snapshot as they age). The counters are cumulative, so a rollup row keeps the last
+    snapshot of its period (LAST_RPTG_DT) and the number of snapshots it replaced.
+    Each table is compacted in one transaction, re-running it changes nothing.
+    """
+    def __init__(self,
+                 conn: Any,
+                 schema: Optional[str] = 'CORE',
+                 daily_days: Optional[int] = 90,
+                 weekly_days: Optional[int] = 365,
+                 rollups: Optional[Dict[str, Dict]] = None,
+                 metrics: Optional[RunMetrics] = None) -> None:
+        # weekly_days None keeps the weekly rows forever
+        if daily_days < 1 or (weekly_days is not None and weekly_days <= daily_days):
+            raise Exception(f"Invalid retention: daily_days={daily_days}, weekly_days={weekly_days}")
+        self.conn = conn
+        self.schema = schema.upper()
+        self.daily_days = daily_days
+        self.weekly_days = weekly_days
+        self.rollups = rollups or STATS_ROLLUPS
+        self.metrics = metrics
+
+    def rollup_sql(self, table: str, grain: str, source: str, date_col: str, where: str, etl_ts: str) -> List[str]:
+        """MERGE of the source rows matching where into grain rollup rows, then their DELETE."""
+        spec = self.rollups[table]
+        rollup_table = f"{self.schema}.{spec['rollup_table']}"
+        key_cols, value_cols = spec['key_cols'], spec['value_cols']
+        period = f"DATE_TRUNC('{grain}', {date_col})::DATE"
+        partition = f"PARTITION BY {', '.join(key_cols)}, {period}"
+        # Daily rows count as one snapshot, rollup rows carry their own count
+        snapshots = 'COUNT(*)' if source == table else 'SUM(SNAPSHOT_COUNT)'
+        cols = key_cols + ['GRAIN', 'PERIOD_START', 'LAST_RPTG_DT'] + value_cols + ['SNAPSHOT_COUNT', 'ETL_TS']
+        return [f"""
+            MERGE INTO {rollup_table} as t
+            USING (
+                SELECT {', '.join(key_cols)}, '{grain}' AS GRAIN, {period} AS PERIOD_START, {date_col} AS LAST_RPTG_DT,
+                {', '.join(value_cols)}, {snapshots} OVER ({partition}) AS SNAPSHOT_COUNT, TIMESTAMP '{etl_ts}' AS ETL_TS
+                FROM {self.schema}.{source}
+                WHERE {where}
+                QUALIFY ROW_NUMBER() OVER ({partition} ORDER BY {date_col} DESC) = 1
+            ) as d
+            ON t.GRAIN = d.GRAIN AND t.PERIOD_START = d.PERIOD_START
+            AND {' AND '.join(f"t.{col} = d.{col}" for col in key_cols)}
+            WHEN MATCHED THEN
+            UPDATE SET
+            {', '.join(f"{col} = CASE WHEN d.LAST_RPTG_DT >= t.LAST_RPTG_DT THEN d.{col} ELSE t.{col} END" for col in value_cols)},
+            LAST_RPTG_DT = GREATEST(t.LAST_RPTG_DT, d.LAST_RPTG_DT),
+            SNAPSHOT_COUNT = t.SNAPSHOT_COUNT + d.SNAPSHOT_COUNT,
+            ETL_TS = d.ETL_TS
+            WHEN NOT MATCHED THEN
+            INSERT ({','.join(cols)})
+            VALUES ({','.join(f"d.{col}" for col in cols)});
+            """,
+            f"DELETE FROM {self.schema}.{source} WHERE {where};"]
+
+    def compact_sql(self, table: str, as_of: datetime.date, etl_ts: str) -> List[str]:
+        """Statements compacting table as of the as_of date."""
+        rollup_table = self.rollups[table]['rollup_table']
+        daily_cutoff = (as_of - datetime.timedelta(days=self.daily_days)).isoformat()
+        if self.weekly_days is None:
+            return self.rollup_sql(table, 'week', table, 'RPTG_DT', f"RPTG_DT < DATE '{daily_cutoff}'", etl_ts)
+        weekly_cutoff = (as_of - datetime.timedelta(days=self.weekly_days)).isoformat()
+        return (self.rollup_sql(table, 'month', table, 'RPTG_DT', f"RPTG_DT < DATE '{weekly_cutoff}'", etl_ts)
+                + self.rollup_sql(table, 'week', table, 'RPTG_DT', f"RPTG_DT < DATE '{daily_cutoff}'", etl_ts)
+                + self.rollup_sql(table, 'month', rollup_table, 'LAST_RPTG_DT',
+                                  f"GRAIN = 'week' AND LAST_RPTG_DT < DATE '{weekly_cutoff}'", etl_ts))
+
+    def run(self, as_of: Optional[datetime.date] = None, etl_ts: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """Compacts every table, returns the rollup rows written and the rows deleted per table."""
+        as_of = as_of or datetime.date.today()
+        etl_ts = etl_ts or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        curs = _open_cursor(self.conn, self.metrics, f"snowflake.{self.schema}.retention")
+        results = {}
+        try:
+            for table in self.rollups:
+                with _timed(self.metrics, f"retention.{table}") as record:
+                    rows = {'rolled_up': 0, 'deleted': 0}
+                    statements = self.compact_sql(table, as_of, etl_ts)
+                    for sql, result in zip(statements, _execute_in_transaction(curs, statements)):
+                        # MERGE returns (inserted, updated), DELETE returns (deleted)
+                        key = 'deleted' if sql.lstrip().upper().startswith('DELETE') else 'rolled_up'
+                        rows[key] += sum(value or 0 for value in result)
+                    record.update(rows)
+                results[table] = rows
+                logging.info(f"{self.schema}.{table} compacted: {rows}")
+        finally:
+            curs.close()
+        return results
+
+
+# Hourly snapshot tables downsampled by HourlyStatsRetention, with their key columns
+HOURLY_STATS_TABLES = {
+    'TBL_YT_VIDEO_STATS_HOURLY': ['ID'],
+    'TBL_YT_CHANNEL_STATS_HOURLY': ['CHANNEL_ID'],
+}
+
+
+class HourlyStatsRetention():
+    """Bounds the hourly stats snapshot tables.
+
+    Snapshots newer than full_days are all kept. Older ones keep only the last snapshot of
+    each key per downsample_hours window of the day, and snapshots older than
+    retention_days are deleted, the daily stats tables keep their last snapshot per day.
+    Each table is downsampled in one transaction, re-running it changes nothing.
+    """
+    def __init__(self,
+                 conn: Any,
+                 schema: Optional[str] = 'CORE',
+                 full_days: Optional[int] = 7,
+                 downsample_hours: Optional[int] = 6,
+                 retention_days: Optional[int] = 90,
+                 tables: Optional[Dict[str, List[str]]] = None,
+                 metrics: Optional[RunMetrics] = None) -> None:
+        if full_days < 1 or retention_days <= full_days or not 1 <= downsample_hours <= 24:
+            raise Exception(f"Invalid retention: full_days={full_days}, downsample_hours={downsample_hours}, retention_days={retention_days}")
+        self.conn = conn
+        self.schema = schema.upper()
+        self.full_days = full_days
+        self.downsample_hours = downsample_hours
+        self.retention_days = retention_days
+        self.tables = tables or HOURLY_STATS_TABLES
+        self.metrics = metrics
+
+    def downsample_sql(self, table: str, as_of: datetime.datetime) -> List[str]:
+        """The DELETE of the superseded snapshots in the downsampled window, then of the expired ones."""
+        key_cols = self.tables[table]
+        full_cutoff = (as_of - datetime.timedelta(days=self.full_days)).strftime("%Y-%m-%d %H:%M:%S")
+        expire_cutoff = (as_of - datetime.timedelta(days=self.retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+        window = f"DATE_TRUNC('day', RPTG_TS), FLOOR(HOUR(RPTG_TS) / {int(self.downsample_hours)})"
+        return [f"""
+            DELETE FROM {self.schema}.{table}
+            USING (
+                SELECT {', '.join(key_cols)}, RPTG_TS FROM {self.schema}.{table}
+                WHERE RPTG_TS >= TIMESTAMP '{expire_cutoff}' AND RPTG_TS < TIMESTAMP '{full_cutoff}'
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY {', '.join(key_cols)}, {window} ORDER BY RPTG_TS DESC) > 1
+            ) d
+            WHERE {' AND '.join(f"{table}.{col} = d.{col}" for col in key_cols + ['RPTG_TS'])};
+            """,
+            f"DELETE FROM {self.schema}.{table} WHERE RPTG_TS < TIMESTAMP '{expire_cutoff}';"]
+
+    def run(self, as_of: Optional[datetime.datetime] = None) -> Dict[str, Dict[str, int]]:
+        """Downsamples every table, returns the rows deleted per table and step."""
+        as_of = as_of or datetime.datetime.now()
+        curs = _open_cursor(self.conn, self.metrics, f"snowflake.{self.schema}.retention")
+        results = {}
+        try:
+            for table in self.tables:
+                with _timed(self.metrics, f"retention.{table}") as record:
+                    deleted = _execute_in_transaction(curs, self.downsample_sql(table, as_of))
+                    rows = {key: (result[0] or 0) if result else 0 for key, result in zip(['downsampled', 'expired'], deleted)}
+                    record.update(rows)
+                results[table] = rows
+                logging.info(f"{self.schema}.{table} downsampled: {rows}")
+        finally:
+            curs.close()
+        return results
@@ -4,7 +4,6 @@
 # +65-98302027
 # Date: 2024-08-08
 
-import logging
 from airflow import DAG
 from airflow.operators.python_operator import PythonOperator
 from airflow.models import Variable
@@ -12,68 +11,346 @@ from airflow.hooks.base import BaseHook
 import os
 import json
 import logging
-import pandas as pd
 import datetime
-from .utils import YoutubeChannel, SnowflakeLoader
-import pyarrow as pa
-import pyarrow.parquet as pq
-import boto3
-import io
 import time
-import snowflake.connector
-
 
-# Fetch Snowflake connection details
-connection = BaseHook.get_connection('yt-analytics-sf')
+# The scheduler parses this file every few seconds. Keep module level work to config:
+# connections, secrets and the heavy imports (pyarrow, boto3, snowflake, googleapiclient)
+# happen inside the task callables and are cached per worker process.
 
 # Configurations
-service_account_info = json.load(open('Secrets/youtube-app-secret.json'))
+sf_conn_id = 'yt-analytics-sf'
+yt_secret_path = 'Secrets/youtube-app-secret.json'
 channel_list = ['straitstimesonline', 'BeritaHarianSG1957', 'Tamil_Murasu', 'TheBusinessTimes', 'zaobaodotsg']
+yt_channel_list_variable = 'yt_channel_list'  # Airflow Variable with a JSON list of channels, overrides channel_list when set
+yt_channel_list_path = None  # File with one channel per line (or a .json list), read when the Variable is not set
+yt_shard_count = 1  # Channels are split into this many extraction shards, each a mapped task instance
+yt_shard_assignment_variable = 'yt_shard_assignment'  # Airflow Variable keeping each channel's shard, so its videos stay in that shard's yt_video_state file. None replans from scratch every run
+yt_fetch_mode = 'playlist'  # 'playlist' costs 1 quota unit per page, 'search' costs 100
+yt_max_workers = 8
+yt_requests_per_batch = None  # videos().list requests sent per HTTP batch request, packed across channels. None for one request per page
+yt_max_requests_per_sec = 20  # For the whole run, every shard gets an equal share
+yt_quota_budget = None  # Max quota units one run may spend, None for no limit. Split equally between the shards
+yt_channel_id_cache_path = 'cache/yt_channel_ids.json'
+yt_channel_id_cache_ttl = 30 * 24 * 3600
+yt_incremental = True  # Fetch only new and due videos, tracked in yt_video_state_path
+yt_video_state_path = None  # One file per shard. None for s3://<s3_bucket_name>/state/yt_video_state.json, a local file only works when every run is on the same worker
+yt_checkpoint_dir = None  # Fetched pages per run, a retried task resumes from them. None for s3://<s3_bucket_name>/checkpoint, a local directory only works when retries run on the same worker
+# 'hourly' also keeps every run's stats in the *_stats_hourly tables. With yt_incremental a run
+# only fetches the due videos (VideoStateStore refresh schedule), so tbl_yt_video_stats_hourly gets a
+# row for those only: videos over 2 days old have one every 6 or 20 hours, not every hour.
+# Set yt_incremental = False for an hourly row of every video, at the full quota cost.
+yt_snapshot_granularity = 'daily'
 s3_bucket_name = 'youtube-stats-001'
 s3_path = "dump/parquet"
-sf_username = connection.login
-sf_password = connection.password
-sf_account = connection.host
+s3_parquet_compression = 'snappy'
+s3_row_group_size = 100000
+s3_part_size = 8 * 1024 * 1024
+metrics_dir = 'metrics'  # Per run JSON summaries in runs/<run_id>/ and Prometheus textfiles
+metrics_statsd_host = None  # Also send the metrics to this StatsD host when set
+metrics_statsd_port = 8125
 sf_warehouse = 'COMPUTE_WH'
 sf_database = 'TESTDB'
 sf_schema = 'CORE'
-
-# Initialize SF and S3 connections
-dbcon = snowflake.connector.connect(
-    user=sf_username,
-    password=sf_password,
-    account=sf_account,
-    warehouse=sf_warehouse,
-    database=sf_database,
-    schema=sf_schema
-)
-
-s3 = boto3.resource('s3')
+sf_pool_size = 4
+sf_load_backend = 's3'  # Default of the specs without a load_backend. 'direct' PUTs the files to the stage tables' internal stages
+sem_schema = 'SEMANTIC'
+sem_top_n = 3  # Videos kept per channel, date and metric in SEMANTIC.tbl_yt_video_top
+sem_lookback_days = 7  # Max age of the previous snapshot the daily channel deltas are taken against
+stats_daily_retention_days = 90  # Older daily stats snapshots are rolled up into weekly rows
+stats_weekly_retention_days = 365  # Older weekly rows are rolled up into monthly rows, None to keep them
+stats_compaction_hour = 2  # Hour of the day whose run compacts the stats tables, None for every run
+stats_hourly_full_days = 7  # Hourly snapshots kept in full, older ones are downsampled
+stats_hourly_downsample_hours = 6  # Downsampled hourly snapshots keep the last one per this many hours
+stats_hourly_retention_days = 90  # Older hourly snapshots are deleted, the daily tables keep the last one per day
+
+# Snowflake tables loaded from the S3 datasets, one spec per dataset. A spec's 'load_backend'
+# ('s3' or 'direct') overrides sf_load_backend for its table.
+sf_table_specs = [
+    {
+        'dataset': 'channel_md',
+        's3_stage_name': 'stg_yt_channel_md',
+        'stage_table_name': 'tbl_stg_yt_channel_md',
+        'core_table_name': 'tbl_yt_channel_md',
+        's3_col_map': {
+                        'channel_name': 'channel_name',
+                        'channel_id': 'channel_id',
+                        'title': 'title',
+                        'customUrl': 'custom_url',
+                        'publishedAt': 'published_at',
+                        'country': 'country',
+                        'etl_ts': 'etl_ts'
+                    }
+    },
+    {
+        'dataset': 'channel',
+        's3_stage_name': 'stg_yt_channel_stats',
+        'stage_table_name': 'tbl_stg_yt_channel_stats',
+        'core_table_name': 'tbl_yt_channel_stats',
+        's3_col_map': {
+                        'channel_id': 'channel_id',
+                        'rptg_dt': 'rptg_dt',
+                        'viewCount': 'view_count',
+                        'subscriberCount': 'subscriber_count',
+                        'videoCount': 'video_count',
+                        'etl_ts': 'etl_ts'
+                    },
+        'load_type': 'MERGE',
+        'merge_on_col': ['channel_id','rptg_dt'],
+        'prune_on_col': 'rptg_dt'
+    },
+    {
+        'dataset': 'video_md',
+        's3_stage_name': 'stg_yt_video_md',
+        'stage_table_name': 'tbl_stg_yt_video_md',
+        'core_table_name': 'tbl_yt_video_md',
+        's3_col_map': {
+                        'id': 'id',
+                        'channel_id': 'channel_id',
+                        'title': 'title',
+                        'url': 'url',
+                        'publishedAt': 'published_at',
+                        'etl_ts': 'etl_ts'
+                    },
+        'load_type': 'MERGE',
+        'merge_on_col': ['id']
+    },
+    {
+        'dataset': 'video',
+        's3_stage_name': 'stg_yt_video_stats',
+        'stage_table_name': 'tbl_stg_yt_video_stats',
+        'core_table_name': 'tbl_yt_video_stats',
+        's3_col_map': {
+                        'id': 'id',
+                        'channel_id': 'channel_id',
+                        'rptg_dt': 'rptg_dt',
+                        'views': 'view_count',
+                        'likes': 'like_count',
+                        'dislikes': 'dislike_count',
+                        'comments': 'comment_count',
+                        'etl_ts': 'etl_ts'
+                    },
+        'load_type': 'MERGE',
+        'merge_on_col': ['id','rptg_dt'],
+        'prune_on_col': 'rptg_dt'
+    },
+]
+
+# Loaded as well with the hourly snapshot granularity. Each run adds one rptg_ts hour
+# bucket, a retried run rewrites its own bucket. With yt_incremental the video bucket
+# only holds the videos the run refreshed.
+sf_hourly_table_specs = [
+    {
+        'dataset': 'channel_hourly',
+        's3_stage_name': 'stg_yt_channel_stats_hourly',
+        'stage_table_name': 'tbl_stg_yt_channel_stats_hourly',
+        'core_table_name': 'tbl_yt_channel_stats_hourly',
+        's3_col_map': {
+                        'channel_id': 'channel_id',
+                        'rptg_ts': 'rptg_ts',
+                        'viewCount': 'view_count',
+                        'subscriberCount': 'subscriber_count',
+                        'videoCount': 'video_count'
+                    },
+        'load_type': 'MERGE',
+        'merge_on_col': ['channel_id','rptg_ts'],
+        'prune_on_col': 'rptg_ts'
+    },
+    {
+        'dataset': 'video_hourly',
+        's3_stage_name': 'stg_yt_video_stats_hourly',
+        'stage_table_name': 'tbl_stg_yt_video_stats_hourly',
+        'core_table_name': 'tbl_yt_video_stats_hourly',
+        's3_col_map': {
+                        'id': 'id',
+                        'rptg_ts': 'rptg_ts',
+                        'views': 'view_count',
+                        'likes': 'like_count',
+                        'comments': 'comment_count'
+                    },
+        'load_type': 'MERGE',
+        'merge_on_col': ['id','rptg_ts'],
+        'prune_on_col': 'rptg_ts'
+    },
+]
+
+
+def get_service_account_info() -> dict:
+    from .utils import get_worker_resource
+    def load() -> dict:
+        with open(yt_secret_path) as f:
+            return json.load(f)
+    return get_worker_resource('yt_service_account_info', load)
+
+
+def get_sf_pool():
+    """Snowflake connection pool of this worker, connections are opened on first use."""
+    from .utils import SnowflakeConnectionPool, get_worker_resource
+    def create():
+        import snowflake.connector
+        connection = BaseHook.get_connection(sf_conn_id)
+        return SnowflakeConnectionPool(lambda: snowflake.connector.connect(
+            user=connection.login,
+            password=connection.password,
+            account=connection.host,
+            warehouse=sf_warehouse,
+            database=sf_database,
+            schema=sf_schema
+        ), size=sf_pool_size)
+    return get_worker_resource('sf_pool', create)
+
+
+def get_s3_client():
+    from .utils import get_worker_resource
+    def create():
+        import boto3
+        return boto3.client('s3')
+    return get_worker_resource('s3_client', create)
 
 
 dag = DAG('youtube-data-analytics-loader-v1',
           description='Extracts Youtube stats data and lods to Snowflake',
           schedule_interval='0 * * * *',
-          start_date=datetime(2024, 8, 8),
+          start_date=datetime.datetime(2024, 8, 8),
           catchup=False,
-          maxmax_active_runs=1)
-
+          max_active_runs=1)
 
-def fn_extract_load_s3(**context):
-    # Define the dataframes
-    df_channel = pd.DataFrame(columns=['channel_name','channel_id','title','customUrl','publishedAt','country','viewCount','subscriberCount','videoCount','rptg_dt','etl_ts'])
-    df_video = pd.DataFrame(columns=['id','title','url','views','likes','dislikes','comments','publishedAt','channel_name','channel_id','rptg_dt','etl_ts'])
 
-    _now_ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    _today_dt = datetime.datetime.now().strftime("%Y-%m-%d")
+def publish_metrics(metrics, context: dict) -> None:
+    """Pushes the run's metrics to XCom and writes them to the JSON summary, the Prometheus textfile and StatsD."""
+    from .utils import _safe_name
+    summary = metrics.summary()
+    if context.get('ti') is not None:
+        context['ti'].xcom_push(key='metrics', value=summary)
+    try:
+        metrics.write_json(os.path.join(metrics_dir, 'runs', _safe_name(context['run_id']), f"{metrics.task_id}.json"))
+        metrics.write_prometheus(os.path.join(metrics_dir, f"yt_loader_{metrics.task_id}.prom"))
+        if metrics_statsd_host:
+            metrics.send_statsd(metrics_statsd_host, metrics_statsd_port)
+    except Exception as e:
+        # Metrics never fail the task
+        logging.warning(f"Publishing the metrics failed. {e}")
+    logging.info(f"Run metrics: {json.dumps(summary['stages'], default=str)}")
+
+
+def get_channel_list() -> list:
+    """Channels to extract: the yt_channel_list_variable Variable, else yt_channel_list_path, else channel_list."""
+    channels = None
+    if yt_channel_list_variable:
+        channels = Variable.get(yt_channel_list_variable, default_var=None, deserialize_json=True)
+    if channels is None and yt_channel_list_path:
+        with open(yt_channel_list_path) as f:
+            if yt_channel_list_path.endswith('.json'):
+                channels = json.load(f)
+            else:
+                channels = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    channels = list(dict.fromkeys(channels if channels is not None else channel_list))
+    if not channels:
+        raise Exception("The channel list is empty")
+    return channels
+
+
+def fn_plan_shards(**context):
+    """Splits the channel list into yt_shard_count shards, returns the op_kwargs of the mapped extraction tasks."""
+    from .utils import plan_shards, fetch_channel_weights
+
+    channels = get_channel_list()
+    weights = None
+    if yt_shard_count > 1:
+        # Shards are balanced by the API calls each channel took so far, new channels weigh the median
+        try:
+            with get_sf_pool().connection() as conn:
+                weights = fetch_channel_weights(conn, sf_schema)
+        except Exception as e:
+            logging.warning(f"No channel weights, the shards are balanced by channel count. {e}")
+    # Channels stay on the shard of their last run unless the shards get too unbalanced
+    previous = None
+    if yt_shard_assignment_variable:
+        previous = Variable.get(yt_shard_assignment_variable, default_var=None, deserialize_json=True)
+    shards = plan_shards(channels, yt_shard_count, weights, previous=previous)
+    if yt_shard_assignment_variable:
+        assignment = {channel: shard for shard, shard_channels in enumerate(shards) for channel in shard_channels}
+        moved = sum(1 for channel, shard in assignment.items() if channel in (previous or {}) and previous[channel] != shard)
+        logging.info(f"{moved} channels moved to another shard")
+        Variable.set(yt_shard_assignment_variable, assignment, serialize_json=True)
+    # Every shard writes under the same run prefix with the same timestamps
+    run_meta = {
+        'now_ts': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'today_dt': datetime.datetime.now().strftime("%Y-%m-%d"),
+        'run_ts': str(int(round(time.time()))),
+    }
+    for shard, shard_channels in enumerate(shards):
+        weight = sum(weights.get(channel, 0) for channel in shard_channels) if weights else None
+        logging.info(f"Shard {shard}: {len(shard_channels)} channels, {weight} estimated API calls")
+    return [{'shard': shard, 'shard_count': len(shards), 'channels': shard_channels, 'run_meta': run_meta}
+            for shard, shard_channels in enumerate(shards)]
+
+
+def fn_extract_load_s3(shard=0, shard_count=1, channels=None, run_meta=None, **context):
+    from .utils import RunMetrics
+    task_id = 'task_load_from_yt_to_s3' + (f'.shard-{shard}' if shard_count > 1 else '')
+    metrics = RunMetrics(run_id=context['run_id'], task_id=task_id)
+    try:
+        return extract_load_s3(metrics, shard, shard_count, channels or get_channel_list(), run_meta, **context)
+    finally:
+        publish_metrics(metrics, context)
+
+
+def extract_load_s3(metrics, shard, shard_count, channels, run_meta, **context):
+    from .utils import YoutubeExtractor, ExtractionCheckpoint, ChannelIdCache, VideoStateStore, ColumnarBuilder, DATASET_SCHEMAS, coerce_table, upload_parquet_datasets, put_parquet_datasets, internal_stage
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Shards keep their own checkpoint, incremental state and files. With one shard the
+    # names are the unsharded ones.
+    shard_suffix = f".shard-{shard}" if shard_count > 1 else ''
+
+    # Define the column builders. rptg_dt is the same for the whole run, so the
+    # (channel_id, rptg_dt) and (id, rptg_dt) keys reduce to channel_id and id.
+    channel_builder = ColumnarBuilder(['channel_name','channel_id','title','customUrl','publishedAt','country','viewCount','subscriberCount','videoCount','rptg_dt','rptg_ts','etl_ts'], key_columns=['channel_id'])
+    video_builder = ColumnarBuilder(['id','channel_id','rptg_dt','rptg_ts','views','likes','dislikes','comments','etl_ts'], key_columns=['id'])
+    # In incremental mode only new or changed video metadata is emitted
+    video_md_builder = ColumnarBuilder(['id','channel_id','title','url','publishedAt','etl_ts'], key_columns=['id'])
+
+    # A retry of the same run resumes from the checkpoint and reuses the first attempt's timestamps
+    checkpoint = ExtractionCheckpoint(yt_checkpoint_dir or f"s3://{s3_bucket_name}/checkpoint", context['run_id'] + shard_suffix,
+                                      s3_client=get_s3_client())
+    run_meta = checkpoint.run_meta(run_meta or {
+        'now_ts': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'today_dt': datetime.datetime.now().strftime("%Y-%m-%d"),
+        'run_ts': str(int(round(time.time()))),
+    })
+    _now_ts = run_meta['now_ts']
+    _today_dt = run_meta['today_dt']
+    # Hour bucket of the hourly snapshots
+    _rptg_ts = _now_ts[:13] + ':00:00'
     logging.info(f"_now_ts: {_now_ts}")
     logging.info(f"_today_dt: {_today_dt}")
 
-    # Fetch all the channles configured for collecting data
-    for channel_name in channel_list:
-        logging.info(f"Fetching data for Channel: {channel_name}")
-        channelObj = YoutubeChannel(service_account_info=service_account_info, channel_name=channel_name)    
-        df_channel = pd.concat([df_channel, pd.DataFrame([{
+    # Fetch all the channles of this shard
+    extractor = YoutubeExtractor(service_account_info=get_service_account_info(),
+                                 max_workers=yt_max_workers,
+                                 max_requests_per_sec=yt_max_requests_per_sec / shard_count if yt_max_requests_per_sec else None,
+                                 quota_budget=yt_quota_budget // shard_count if yt_quota_budget else None,
+                                 channel_id_cache=ChannelIdCache(yt_channel_id_cache_path, ttl_seconds=yt_channel_id_cache_ttl),
+                                 metrics=metrics,
+                                 requests_per_batch=yt_requests_per_batch)
+    # Channels keep their shard (yt_shard_assignment_variable), one moved to another shard is fetched in full once
+    state_root, state_ext = os.path.splitext(yt_video_state_path or f"s3://{s3_bucket_name}/state/yt_video_state.json")
+    state_store = VideoStateStore(f"{state_root}{shard_suffix}{state_ext}", s3_client=get_s3_client()) if yt_incremental else None
+    with metrics.timer('extract'):
+        results, errors = extractor.extract(channels, checkpoint=checkpoint, fetch_mode=yt_fetch_mode, state_store=state_store)
+    if not results:
+        raise Exception(f"Data fetching failed for all the channels. {errors}")
+
+    transform_start = time.perf_counter()
+    for channel_name in channels:
+        if channel_name not in results:
+            logging.warning(f"Skipping Channel: {channel_name}. {errors[channel_name]}")
+            continue
+        channelObj, video_data = results[channel_name]
+        if not channelObj.complete:
+            logging.warning(f"Channel: {channel_name} is incomplete, quota budget ran out. Loading the {len(video_data)} videos fetched.")
+        channel_builder.append({
             'channel_name': channelObj.channel_name,
             'channel_id': channelObj.channel_id,
             'title': channelObj.title,
@@ -84,228 +361,206 @@ def fn_extract_load_s3(**context):
             'subscriberCount': channelObj.subscriberCount,
             'videoCount': channelObj.videoCount,
             'rptg_dt': _today_dt,
+            'rptg_ts': _rptg_ts,
             'etl_ts': _now_ts
-        }])], ignore_index=True)
-        df_video_temp = pd.DataFrame(channelObj.get_video_data())
-        df_video_temp['channel_name'] = channelObj.channel_name
-        df_video_temp['channel_id'] = channelObj.channel_id
-        df_video_temp['rptg_dt'] = _today_dt
-        df_video_temp['etl_ts'] = _now_ts
-        df_video = pd.concat([df_video, df_video_temp], ignore_index=True)
+        })
+        # video_data is a VideoBatch, its columns are appended without a dict per video
+        video_builder.extend_columns(video_data.columns(),
+                                     channel_id=channelObj.channel_id,
+                                     rptg_dt=_today_dt,
+                                     rptg_ts=_rptg_ts,
+                                     etl_ts=_now_ts)
+        video_md_builder.extend_columns(video_data.changed().columns(),
+                                        channel_id=channelObj.channel_id,
+                                        etl_ts=_now_ts)
     logging.info("Data fetching from Youtube finished.")
 
     logging.info("Splitting data and preparing for S3 load.")
-    df_video_md = df_video[['id','channel_id','title','url','publishedAt','etl_ts']]
-    df_video = df_video[['id','channel_id','rptg_dt','views','likes','dislikes','comments','etl_ts']]
-    df_channel_md = df_channel[['channel_name','channel_id','title','customUrl','publishedAt','country','etl_ts']]
-    df_channel = df_channel[['channel_id','rptg_dt','viewCount','subscriberCount','videoCount','etl_ts']]
-
-    # Dropping duplicates based on respective Key columns
-    df_channel = df_channel.drop_duplicates(subset=['channel_id','rptg_dt'])
-    df_channel_md = df_channel_md.drop_duplicates(subset=['channel_id'])
-    df_video_md = df_video_md.drop_duplicates(subset=['id'])
-    df_video = df_video.drop_duplicates(subset=['id','rptg_dt'])
+    # Duplicates were already dropped by the builders. The API strings are cast to the
+    # stage table types here, once per column, so the COPY does not parse them.
+    raw_channel = channel_builder.to_table()
+    raw_video = video_builder.to_table()
+    tables = {
+        'channel_md': coerce_table(raw_channel, DATASET_SCHEMAS['channel_md']),
+        'channel': coerce_table(raw_channel, DATASET_SCHEMAS['channel']),
+        'video_md': coerce_table(video_md_builder.to_table(), DATASET_SCHEMAS['video_md']),
+        'video': coerce_table(raw_video, DATASET_SCHEMAS['video']),
+    }
+    if yt_snapshot_granularity == 'hourly':
+        tables['channel_hourly'] = coerce_table(raw_channel, DATASET_SCHEMAS['channel_hourly'])
+        tables['video_hourly'] = coerce_table(raw_video, DATASET_SCHEMAS['video_hourly'])
+    metrics.record('transform', time.perf_counter() - transform_start,
+                   rows=sum(table.num_rows for table in tables.values()))
 
     logging.info("Data prepared. Starting S3 load.")
 
-    # Upload the Channel MD Parquet file to S3
+    # Upload the Parquet files to S3 concurrently, one per dataset in its s3_path/<dataset> folder
+    # Files are partitioned by date and run, so the stages only ever list one run's prefix
+    _run_ts = run_meta['run_ts']
+    _run_prefix = f"dt={_today_dt}/run={_run_ts}"
+    file_names = {dataset: f"{_run_prefix}/{dataset}_data_{_run_ts}{shard_suffix}.parquet" for dataset in tables}
+    specs = {spec['dataset']: spec for spec in get_table_specs()}
+    direct = [dataset for dataset in tables if specs[dataset]['load_backend'] == 'direct']
+    s3_files = {dataset: (f"{s3_path}/{dataset}/{file_names[dataset]}", table) for dataset, table in tables.items()}
+    upload_args = {'compression': s3_parquet_compression, 'row_group_size': s3_row_group_size, 'metrics': metrics}
+    with ThreadPoolExecutor(max_workers=1) as archive_executor:
+        # The direct datasets are PUT to their stage table's internal stage. Their S3 copy is
+        # only an archive, uploaded at the same time, and a failed archive does not fail the run.
+        archive = None
+        if direct:
+            archive = archive_executor.submit(upload_parquet_datasets, get_s3_client(), s3_bucket_name,
+                                              {dataset: s3_files[dataset] for dataset in direct},
+                                              part_size=s3_part_size, **upload_args)
+        uploads = {dataset: s3_files[dataset] for dataset in s3_files if dataset not in direct}
+        if uploads:
+            with metrics.timer('s3.upload'):
+                upload_parquet_datasets(get_s3_client(), s3_bucket_name, uploads, part_size=s3_part_size, **upload_args)
+        if direct:
+            with metrics.timer('snowflake.put'):
+                put_parquet_datasets(get_sf_pool(), {
+                    dataset: (internal_stage(sf_schema, specs[dataset]['stage_table_name']), file_names[dataset], tables[dataset])
+                    for dataset in direct
+                }, **upload_args)
+            try:
+                with metrics.timer('s3.archive'):
+                    archive.result()
+            except Exception as e:
+                logging.warning(f"Archiving {', '.join(direct)} to S3 failed, they load from the internal stages. {e}")
+
+    logging.info("All the files uploaded.")
+
+    # The fetched rows have landed, the incremental state can move forward. The videos of
+    # channels moved to another shard are dropped, so a later move back fetches them in full.
+    if state_store is not None:
+        with metrics.timer('state.save', rows=len(state_store)):
+            state_store.save(channels=channels)
+    checkpoint.clear()
+
+    # The manifest goes to XCom, the load task copies only these files
+    return {dataset: [file_name] for dataset, file_name in file_names.items()}
+
+
+def fn_merge_manifests(**context):
+    """Fan-in of the extraction shards, merges their manifests into the one the load task copies."""
+    manifests = context['ti'].xcom_pull(task_ids='task_load_from_yt_to_s3')
+    # Pulling a mapped task returns every shard's value
+    if isinstance(manifests, dict):
+        manifests = [manifests]
+    manifest = {}
+    for shard_manifest in manifests or []:
+        for dataset, files in (shard_manifest or {}).items():
+            manifest.setdefault(dataset, []).extend(files)
+    if not manifest:
+        raise Exception("No file manifest found from task_load_from_yt_to_s3")
+    logging.info(f"Merged the manifests of {len(manifests)} shards: {sum(len(files) for files in manifest.values())} files")
+    return manifest
+
+
+def get_run_manifest(context: dict) -> dict:
+    """Returns {dataset: [stage relative files]} written by this run's extraction shards."""
+    manifest = context['ti'].xcom_pull(task_ids='task_merge_manifests')
+    if not manifest:
+        raise Exception("No file manifest found from task_merge_manifests")
+    return manifest
+
+
+def get_table_specs() -> list:
+    """Table specs this run loads, with the Arrow schema of their files and their load backend."""
+    from .utils import DATASET_SCHEMAS
+    specs = sf_table_specs + (sf_hourly_table_specs if yt_snapshot_granularity == 'hourly' else [])
+    return [{'load_backend': sf_load_backend, **spec, 's3_schema': DATASET_SCHEMAS[spec['dataset']]} for spec in specs]
+
+
+def fn_load_s3_to_sf(**context):
+    from .utils import SnowflakeLoadRunner, RunMetrics
+
+    logging.info("Start: Loading S3 files to Snowflake.")
+    metrics = RunMetrics(run_id=context['run_id'], task_id='task_load_s3_to_sf')
     try:
-        parquet_buffer = io.BytesIO()
-        df_channel_md.to_parquet(parquet_buffer, index=False)
-        chnl_md_file_name = f"channel_md_data_{str(int(round(time.time())))}.parquet"
-        s3.Object(s3_bucket_name, f"{s3_path}/channel_md/{chnl_md_file_name}").put(Body=parquet_buffer.getvalue())
-        logging.info(f"File {chnl_md_file_name} has been uploaded to s3://{s3_bucket_name}/{s3_path}/channel_md")
-    except Exception as e:
-        raise Exception(f"Channel MD S3 Upload failed. {e}")
-    
-    logging.info("Channel MD file uploaded to S3.")
+        runner = SnowflakeLoadRunner(pool=get_sf_pool(), schema=sf_schema, table_specs=get_table_specs(), metrics=metrics)
+        with metrics.timer('load'):
+            timings = runner.run(files_by_dataset=get_run_manifest(context))
+    finally:
+        publish_metrics(metrics, context)
+    logging.info(f"Complete: Loading S3 files to Snowflake. Timings: {timings}")
+    return timings
 
-        
-    # Upload the Channel Parquet file to S3
-    try:
-        parquet_buffer = io.BytesIO()
-        df_channel.to_parquet(parquet_buffer, index=False)
-        chnl_file_name = f"channel_data_{str(int(round(time.time())))}.parquet"
-        s3.Object(s3_bucket_name, f"{s3_path}/channel/{chnl_file_name}").put(Body=parquet_buffer.getvalue())
-        logging.info(f"File {chnl_file_name} has been uploaded to s3://{s3_bucket_name}/{s3_path}/channel")
-    except Exception as e:
-        raise Exception(f"Channel Stats S3 Upload failed. {e}")
-    
-    logging.info("Channel stats file uploaded to S3.")
 
-    # Upload the Video MD Parquet file to S3
-    try:
-        parquet_buffer = io.BytesIO()
-        df_video_md.to_parquet(parquet_buffer, index=False)
-        video_md_file_name = f"video_md_data_{str(int(round(time.time())))}.parquet"
-        s3.Object(s3_bucket_name, f"{s3_path}/video_md/{video_md_file_name}").put(Body=parquet_buffer.getvalue())
-        logging.info(f"File {video_md_file_name} has been uploaded to s3://{s3_bucket_name}/{s3_path}/video_md")
-    except Exception as e:
-        raise Exception(f"Video MD S3 Upload failed. {e}")
-    
-    logging.info("Video MD file uploaded to S3.")
+def fn_build_semantic(**context):
+    from .utils import SemanticAggregator, RunMetrics
 
-    # Upload the Video Parquet file to S3
+    metrics = RunMetrics(run_id=context['run_id'], task_id='task_build_semantic')
     try:
-        parquet_buffer = io.BytesIO()
-        df_video.to_parquet(parquet_buffer, index=False)
-        video_file_name = f"video_data_{str(int(round(time.time())))}.parquet"
-        s3.Object(s3_bucket_name, f"{s3_path}/video/{video_file_name}").put(Body=parquet_buffer.getvalue())
-        logging.info(f"File {video_file_name} has been uploaded to s3://{s3_bucket_name}/{s3_path}/video")
-    except Exception as e:
-        raise Exception(f"Video Stats S3 Upload failed. {e}")
-    
-    logging.info("Video stats file uploaded to S3.")
-
-
-def fn_load_channel_md_to_sf(**context):
-    logging.info("Start: Loading Channel MD.")
-    # Load Channel MD
-    sf_ldr = SnowflakeLoader(
-        conn = dbcon,
-        schema = sf_schema,
-        s3_stage_name = 'stg_yt_channel_md',
-        stage_table_name = 'tbl_stg_yt_channel_md',
-        core_table_name = 'tbl_yt_channel_md',
-        s3_col_map = {
-                        'channel_name': 'channel_name',
-                        'channel_id': 'channel_id',
-                        'title': 'title',
-                        'customUrl': 'custom_url',
-                        'publishedAt': 'published_at',
-                        'country': 'country',
-                        'etl_ts': 'etl_ts'
-                    })
-
-    # Run the S3 loader and core loader
-    sf_ldr.s3_to_stg()
-    sf_ldr.stg_to_core()
-    logging.info("Complete: Loading Channel MD.")
-
-
-def fn_load_channel_stats_to_sf(**context):
-    logging.info("Start: Loading Channel Stats.")
-    # Load Channel Stats
-    sf_ldr = SnowflakeLoader(
-        conn = dbcon,
-        schema = sf_schema,
-        s3_stage_name = 'stg_yt_channel_stats',
-        stage_table_name = 'tbl_stg_yt_channel_stats',
-        core_table_name = 'tbl_yt_channel_stats',
-        s3_col_map = {
-                        'channel_id': 'channel_id',
-                        'rptg_dt': 'rptg_dt',
-                        'viewCount': 'view_count',
-                        'subscriberCount': 'subscriber_count',
-                        'videoCount': 'video_count',
-                        'etl_ts': 'etl_ts'
-                    },
-        load_type = 'MERGE',
-        merge_on_col = ['channel_id','rptg_dt']
-            )
-
-    # Run the S3 loader and core loader
-    sf_ldr.s3_to_stg()
-    sf_ldr.stg_to_core()
-    logging.info("Complete: Loading Channel Stats.")
-
-
-def fn_load_video_md_to_sf(**context):
-    logging.info("Start: Loading Video MD.")
-    # Load Video MD
-    sf_ldr = SnowflakeLoader(
-        conn = dbcon,
-        schema = sf_schema,
-        s3_stage_name = 'stg_yt_video_md',
-        stage_table_name = 'tbl_stg_yt_video_md',
-        core_table_name = 'tbl_yt_video_md',
-        s3_col_map = {
-                        'id': 'id',
-                        'channel_id': 'channel_id',
-                        'title': 'title',
-                        'url': 'url',
-                        'publishedAt': 'published_at',
-                        'etl_ts': 'etl_ts'
-                    },
-        load_type = 'MERGE',
-        merge_on_col = ['id']
-            )
-
-    # Run the S3 loader and core loader
-    sf_ldr.s3_to_stg()
-    sf_ldr.stg_to_core()
-    logging.info("Complete: Loading Video MD.")
-
-
-def fn_load_video_stats_to_sf(**context):
-    logging.info("Start: Loading Video Stats.")
-    # Load Video stats
-    sf_ldr = SnowflakeLoader(
-        conn = dbcon,
-        schema = sf_schema,
-        s3_stage_name = 'stg_yt_video_stats',
-        stage_table_name = 'tbl_stg_yt_video_stats',
-        core_table_name = 'tbl_yt_video_stats',
-        s3_col_map = {
-                        'id': 'id',
-                        'channel_id': 'channel_id',
-                        'rptg_dt': 'rptg_dt',
-                        'views': 'view_count',
-                        'likes': 'like_count',
-                        'dislikes': 'dislike_count',
-                        'comments': 'comment_count',
-                        'etl_ts': 'etl_ts'
-                    },
-        load_type = 'MERGE',
-        merge_on_col = ['id','rptg_dt']
-    )
-
-    # Run the S3 loader and core loader
-    sf_ldr.s3_to_stg()
-    sf_ldr.stg_to_core()
-    logging.info("Complete: Loading Video Stats.")
+        with get_sf_pool().connection() as conn, metrics.timer('semantic'):
+            rows = SemanticAggregator(conn, core_schema=sf_schema, semantic_schema=sem_schema, top_n=sem_top_n,
+                                      lookback_days=sem_lookback_days, metrics=metrics).run()
+    finally:
+        publish_metrics(metrics, context)
+    return rows
+
+
+def fn_compact_stats(**context):
+    from .utils import StatsRetention, HourlyStatsRetention, RunMetrics
+
+    logical_date = context.get('logical_date') or context.get('execution_date')
+    if stats_compaction_hour is not None and logical_date.hour != stats_compaction_hour:
+        logging.info(f"Skipping the stats compaction, it runs at hour {stats_compaction_hour}.")
+        return None
+    metrics = RunMetrics(run_id=context['run_id'], task_id='task_compact_stats')
+    try:
+        with get_sf_pool().connection() as conn, metrics.timer('compact'):
+            rows = StatsRetention(conn, schema=sf_schema, daily_days=stats_daily_retention_days,
+                                  weekly_days=stats_weekly_retention_days, metrics=metrics).run()
+            if yt_snapshot_granularity == 'hourly':
+                rows.update(HourlyStatsRetention(conn, schema=sf_schema, full_days=stats_hourly_full_days,
+                                                 downsample_hours=stats_hourly_downsample_hours,
+                                                 retention_days=stats_hourly_retention_days, metrics=metrics).run())
+    finally:
+        publish_metrics(metrics, context)
+    return rows
 
 
 # Define tasks
-task_load_from_yt_to_s3 = PythonOperator(
+task_plan_shards = PythonOperator(
+    task_id='task_plan_shards',
+    python_callable=fn_plan_shards,
+    dag=dag,
+)
+
+# One mapped task instance per shard, they run on as many worker slots as are free
+task_load_from_yt_to_s3 = PythonOperator.partial(
     task_id='task_load_from_yt_to_s3',
     python_callable=fn_extract_load_s3,
-    provide_context=True,
     dag=dag,
-)
+).expand(op_kwargs=task_plan_shards.output)
 
-task_load_channel_md_to_sf = PythonOperator(
-    task_id='task_load_channel_md_to_sf',
-    python_callable=fn_load_channel_md_to_sf,
-    provide_context=True,
+task_merge_manifests = PythonOperator(
+    task_id='task_merge_manifests',
+    python_callable=fn_merge_manifests,
     dag=dag,
 )
 
-task_load_channel_stats_to_sf = PythonOperator(
-    task_id='task_load_channel_stats_to_sf',
-    python_callable=fn_load_channel_stats_to_sf,
-    provide_context=True,
+task_load_s3_to_sf = PythonOperator(
+    task_id='task_load_s3_to_sf',
+    python_callable=fn_load_s3_to_sf,
     dag=dag,
 )
 
-task_load_video_md_to_sf = PythonOperator(
-    task_id='task_load_video_md_to_sf',
-    python_callable=fn_load_video_md_to_sf,
-    provide_context=True,
+
+
+task_build_semantic = PythonOperator(
+    task_id='task_build_semantic',
+    python_callable=fn_build_semantic,
     dag=dag,
 )
 
-task_load_video_stats_to_sf = PythonOperator(
-    task_id='task_load_video_stats_to_sf',
-    python_callable=fn_load_video_stats_to_sf,
-    provide_context=True,
+
+task_compact_stats = PythonOperator(
+    task_id='task_compact_stats',
+    python_callable=fn_compact_stats,
     dag=dag,
 )
 
 
-
 # Define task dependency
-task_load_from_yt_to_s3 >> [task_load_channel_md_to_sf,
-                            task_load_channel_stats_to_sf,
-                            task_load_video_md_to_sf,
-                            task_load_video_stats_to_sf]
\ No newline at end of file
+task_plan_shards >> task_load_from_yt_to_s3 >> task_merge_manifests >> task_load_s3_to_sf >> task_build_semantic >> task_compact_stats
@@ -0,0 +1,201 @@
+# Data access for the insights notebook. Query results are fetched as Arrow and cached
+# on disk as Parquet, keyed by the SQL text and the watermark of the tables it reads,
+# so a re-run of the notebook reads the cache until new data lands.
+
+from typing import Any, Optional, Dict, List
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Schema qualified table names in the notebook's queries, e.g. CORE.tbl_yt_channel_md
+_TABLE_REF = re.compile(r"\b((?:CORE|SEMANTIC)\.\w+)", re.I)
+
+
+def referenced_tables(sql: str) -> List[str]:
+    """Upper case schema.table names read by sql, in order of first use."""
+    return list(dict.fromkeys(name.upper() for name in _TABLE_REF.findall(sql)))
+
+
+class InsightsData():
+    """Runs the notebook's queries through a Snowflake connection with a Parquet result cache.
+
+    A table's watermark is its latest etl_ts and its row count, so both new loads and the
+    stats compaction deleting rows invalidate the results reading it. Snowflake answers
+    MAX and COUNT(*) of a whole table from metadata, so checking them does not resume the
+    warehouse. A check queries the tables missing or older than watermark_ttl seconds, along
+    with every other known table which expired, so a re-run of the notebook checks all of
+    them at once. The tables the cached results read are known from the start. When the
+    check fails, each table is checked on its own and a table failing it (e.g. dropped)
+    has no watermark: the queries reading it are run without the cache.
+
+    A query without a cached result is sent in one request with the watermark of its tables
+    (a multi statement execute), the watermark first, so a cold run costs one round trip per
+    query. Results are fetched as one Arrow table with fetch_arrow_all instead of row by row.
+
+    With conn None every query is served from the cache, whatever its watermark.
+    """
+    def __init__(self,
+                 conn: Optional[Any] = None,
+                 cache_dir: Optional[str] = 'cache/insights',
+                 watermark_ttl: Optional[float] = 300,
+                 watermark_col: Optional[str] = 'ETL_TS',
+                 clock: Any = time.time) -> None:
+        self.conn = conn
+        self.cache_dir = cache_dir
+        self.watermark_ttl = watermark_ttl
+        self.watermark_col = watermark_col.upper()
+        self.clock = clock
+        # table -> (checked at, [latest etl_ts, row count])
+        self._watermarks = {}
+        # Warehouse queries run, watermark checks included, and results served from the cache
+        self.queries = 0
+        self.cache_hits = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._known = set()
+        for name in os.listdir(cache_dir):
+            if name.endswith('.parquet'):
+                metadata = pq.read_schema(os.path.join(cache_dir, name)).metadata or {}
+                self._known.update(json.loads(metadata.get(b'insights.watermark', b'{}')))
+
+    def _watermark_sql(self, tables: List[str]) -> str:
+        return ' UNION ALL '.join(f"SELECT '{table}', MAX({self.watermark_col}), COUNT(*) FROM {table}" for table in tables)
+
+    def _record_watermarks(self, rows: List[tuple], now: float) -> None:
+        for table, latest, row_count in rows:
+            self._watermarks[table] = (now, [str(latest), row_count])
+
+    def watermarks(self, tables: List[str]) -> Dict[str, Optional[list]]:
+        """Returns {table: [latest etl_ts, row count] or None when it cannot be checked}, querying only the missing and expired ones."""
+        now = self.clock()
+        expired = lambda table: table not in self._watermarks or now - self._watermarks[table][0] > self.watermark_ttl
+        if any(expired(table) for table in tables):
+            self._known.update(tables)
+            stale = sorted(table for table in self._known if expired(table))
+            try:
+                self._record_watermarks(self._rows(self._watermark_sql(stale)), now)
+            except Exception as e:
+                logging.warning(f"Checking the watermarks of {len(stale)} tables failed, checking them one by one. {e}")
+                for table in stale:
+                    try:
+                        self._record_watermarks(self._rows(self._watermark_sql([table])), now)
+                    except Exception as e:
+                        # Left out of the other tables' checks, the queries reading it skip the cache
+                        logging.warning(f"No watermark for {table}, its queries are not cached. {e}")
+                        self._known.discard(table)
+                        self._watermarks[table] = (now, None)
+        return {table: self._watermarks[table][1] for table in tables}
+
+    def _without_watermark(self, table: str) -> bool:
+        # Its check failed within watermark_ttl, it is checked again once that expires
+        checked_at, watermark = self._watermarks.get(table, (None, []))
+        return watermark is None and self.clock() - checked_at <= self.watermark_ttl
+
+    def invalidate(self) -> None:
+        """Forgets the checked watermarks, the next query checks them again."""
+        self._watermarks = {}
+
+    def cache_path(self, sql: str) -> str:
+        key = hashlib.sha256(' '.join(sql.split()).encode()).hexdigest()[:20]
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def query(self, sql: str, tables: Optional[List[str]] = None) -> pd.DataFrame:
+        """Returns the result of sql as a DataFrame, from the cache when the tables it reads did not change.
+
+        tables overrides the tables found in the SQL. A query reading no known table is not cached.
+        """
+        tables = tables if tables is not None else referenced_tables(sql)
+        path = self.cache_path(sql)
+        if self.conn is None:
+            if not os.path.exists(path):
+                raise Exception(f"No cached result and no connection for the query. {' '.join(sql.split())[:200]}")
+            return self._read(path)
+        if not tables or any(self._without_watermark(table) for table in tables):
+            return self._fetch(sql).to_pandas()
+        if not os.path.exists(path):
+            return self._fetch_with_watermark(sql, path, tables).to_pandas()
+
+        watermarks = self.watermarks(tables)
+        if any(watermark is None for watermark in watermarks.values()):
+            return self._fetch(sql).to_pandas()
+        watermark = json.dumps(watermarks, sort_keys=True)
+        metadata = pq.read_schema(path).metadata or {}
+        if metadata.get(b'insights.watermark') == watermark.encode():
+            return self._read(path)
+        return self._fetch(sql, path, {'insights.watermark': watermark, 'insights.sql': sql}).to_pandas()
+
+    def _fetch_with_watermark(self, sql: str, path: str, tables: List[str]) -> pa.Table:
+        # The watermark runs first, a load landing in between makes the cached result look older, never newer
+        now = self.clock()
+        try:
+            curs = self._execute(f"{self._watermark_sql(tables)};\n{sql.strip().rstrip(';')}", num_statements=2)
+        except Exception as e:
+            # Either the query or the watermark of one of its tables fails, watermarks() finds which
+            logging.warning(f"Fetching the watermark with the query failed, running it without the cache. {e}")
+            self.watermarks(tables)
+            return self._fetch(sql)
+        try:
+            self._record_watermarks(curs.fetchall(), now)
+            self._known.update(tables)
+            curs.nextset()
+            table = self._arrow(curs)
+        finally:
+            curs.close()
+        watermark = json.dumps({table_name: self._watermarks[table_name][1] for table_name in tables}, sort_keys=True)
+        self._write(table, path, {'insights.watermark': watermark, 'insights.sql': sql})
+        return table
+
+    def _rows(self, sql: str) -> List[tuple]:
+        curs = self._execute(sql)
+        try:
+            return curs.fetchall()
+        finally:
+            curs.close()
+
+    def _read(self, path: str) -> pd.DataFrame:
+        self.cache_hits += 1
+        return pq.read_table(path).to_pandas()
+
+    def _execute(self, sql: str, **kwargs) -> Any:
+        # One round trip, whatever the number of statements
+        self.queries += 1
+        curs = self.conn.cursor()
+        try:
+            curs.execute(sql, **kwargs)
+        except Exception:
+            curs.close()
+            raise
+        return curs
+
+    @staticmethod
+    def _arrow(curs: Any) -> pa.Table:
+        # fetch_arrow_all returns None for an empty result, DB-API cursors without it return rows
+        table = curs.fetch_arrow_all() if hasattr(curs, 'fetch_arrow_all') else None
+        if table is None:
+            rows = [] if hasattr(curs, 'fetch_arrow_all') else curs.fetchall()
+            table = pa.Table.from_pandas(pd.DataFrame(rows, columns=[col[0] for col in curs.description]), preserve_index=False)
+        return table
+
+    def _fetch(self, sql: str, path: Optional[str] = None, metadata: Optional[Dict[str, str]] = None) -> pa.Table:
+        curs = self._execute(sql)
+        try:
+            table = self._arrow(curs)
+        finally:
+            curs.close()
+        if path is not None:
+            self._write(table, path, metadata)
+        return table
+
+    def _write(self, table: pa.Table, path: str, metadata: Dict[str, str]) -> None:
+        # Written next to the cache file and renamed, so a reader never sees half a file
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        logging.info(f"Cached {table.num_rows} rows in {path}")
@@ -0,0 +1,99 @@
+# Kills an extraction part way through and retries it against the same checkpoint,
+# checking that no listing page or statistics batch is fetched twice and that the resumed
+# result matches an uninterrupted run. Run from the repository root:
+#   python -m pytest -q tests
+
+import logging
+
+import pytest
+
+from dags.utils import ExtractionCheckpoint, VideoBatch, VideoStateStore, YoutubeExtractor
+from benchmarks.fake_s3 import LocalS3Client
+from benchmarks.fake_youtube import FakeYoutube, make_channels
+
+
+CHANNELS = 8
+VIDEOS_PER_CHANNEL = 300
+RUN_ID = 'scheduled__2024-01-01T00:00:00'
+
+
+@pytest.fixture(autouse=True)
+def quiet_logs():
+    logging.disable(logging.ERROR)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def fetch_key(method, params):
+    if method == 'videos.list':
+        return method, params['id'], params['part']
+    return method, params.get('playlistId'), params.get('pageToken')
+
+
+def is_channel_lookup(method, params):
+    # Resolving the channel and its attributes are no pages, they are redone until the
+    # attributes are checkpointed
+    return method == 'channels.list' or (method == 'search.list' and params.get('type') == 'channel')
+
+
+def make_state_store(path, channels):
+    # Every known video gets a statistics batch each run and every unknown one a full
+    # batch, half of the videos are known so each page has both
+    store = VideoStateStore(path, refresh_schedule=[(None, 0)], md_refresh_seconds=10 ** 9, max_age_seconds=None)
+    for channel in channels.values():
+        store.record_batch(VideoBatch.from_items([
+            {'id': video['id'], 'snippet': {'title': video['title'], 'publishedAt': video['publishedAt']}}
+            for video in channel.videos[::2]]))
+    store.save()
+    return path
+
+
+def extract(fake, checkpoint=None, state_path=None):
+    extractor = YoutubeExtractor(service_account_info={}, youtube=fake, max_workers=4)
+    state_store = VideoStateStore(state_path, refresh_schedule=[(None, 0)], md_refresh_seconds=10 ** 9) if state_path else None
+    results, errors = extractor.extract([f"channel{c}" for c in range(CHANNELS)], checkpoint=checkpoint,
+                                        fetch_mode='playlist', days_count=730, state_store=state_store)
+    rows = {name: sorted((row['id'], row['views'], row['title']) for row in video_data)
+            for name, (_, video_data) in results.items()}
+    return rows, errors
+
+
+@pytest.mark.parametrize('storage', ['local', 's3'])
+@pytest.mark.parametrize('incremental', [False, True])
+@pytest.mark.parametrize('kill_at', [0.25, 0.5, 0.75])
+def test_resume_fetches_no_page_twice(tmp_path, storage, incremental, kill_at):
+    channels = make_channels(CHANNELS, VIDEOS_PER_CHANNEL)
+    state_path = make_state_store(str(tmp_path / 'state.json'), channels) if incremental else None
+    baseline = FakeYoutube(channels)
+    expected, _ = extract(baseline, state_path=state_path)
+
+    if storage == 's3':
+        s3_client = LocalS3Client(str(tmp_path / 's3'))
+        checkpoint = lambda: ExtractionCheckpoint('s3://bucket/checkpoint', RUN_ID, s3_client=s3_client)
+    else:
+        checkpoint = lambda: ExtractionCheckpoint(str(tmp_path / 'checkpoint'), RUN_ID)
+
+    attempt1 = FakeYoutube(channels, fail_after_calls=int(baseline.total_calls * kill_at))
+    _, errors1 = extract(attempt1, checkpoint(), state_path)
+    assert errors1, 'the first attempt should have been killed'
+    attempt2 = FakeYoutube(channels)
+    resumed, errors2 = extract(attempt2, checkpoint(), state_path)
+
+    assert not errors2
+    assert resumed == expected
+    served1 = {fetch_key(m, p) for m, p in attempt1.served if not is_channel_lookup(m, p)}
+    served2 = [fetch_key(m, p) for m, p in attempt2.served if not is_channel_lookup(m, p)]
+    assert [key for key in served2 if key in served1] == []
+    # Together the attempts fetched each page and batch once
+    assert len(served1) + len(served2) == len([1 for m, p in baseline.served if not is_channel_lookup(m, p)])
+
+
+def test_clear_removes_the_s3_checkpoint(tmp_path):
+    s3_client = LocalS3Client(str(tmp_path / 's3'))
+    checkpoint = ExtractionCheckpoint('s3://bucket/checkpoint', RUN_ID, s3_client=s3_client)
+    assert checkpoint.run_meta({'run_ts': '1'}) == {'run_ts': '1'}
+    assert ExtractionCheckpoint('s3://bucket/checkpoint', RUN_ID, s3_client=s3_client).run_meta({'run_ts': '2'}) == {'run_ts': '1'}
+    checkpoint.channel('channel0').save_attributes({'channel_id': 'UC0'})
+    checkpoint.clear()
+    assert s3_client.list_objects_v2(Bucket='bucket', Prefix='checkpoint/')['Contents'] == []
+    assert checkpoint.channel('channel0').attributes is None
@@ -0,0 +1,77 @@
+# Tests of the columnar accumulation of extracted rows (ColumnarBuilder) and of the cast to
+# the dataset schemas (coerce_table). Run from the repository root:
+#   python -m pytest -q tests
+
+import datetime
+
+import pyarrow as pa
+import pytest
+
+from dags.utils import DATASET_SCHEMAS, ColumnarBuilder, coerce_table
+
+
+VIDEO_COLUMNS = ['id', 'channel_id', 'rptg_dt', 'views', 'likes', 'dislikes', 'comments', 'etl_ts']
+
+
+def video_row(i, **values):
+    return {'id': f"v{i}", 'views': str(100 + i), 'likes': str(i), 'dislikes': 0, 'comments': str(i), **values}
+
+
+def test_rows_and_columns_build_one_table_keeping_the_first_of_each_key():
+    builder = ColumnarBuilder(VIDEO_COLUMNS, key_columns=['id'], batch_size=3)
+    assert builder.extend([video_row(i) for i in range(5)], channel_id='UC1', rptg_dt='2024-08-10') == 5
+    # v3 and v4 are in a flushed batch, only v5 and v6 are new
+    kept = builder.extend_columns({'id': ['v3', 'v5', 'v4', 'v6'], 'views': ['1', '2', '3', '4']},
+                                  channel_id='UC2', rptg_dt='2024-08-10')
+    assert kept == 2 and len(builder) == 7
+    assert not builder.append(video_row(0), channel_id='UC3')
+
+    table = builder.to_table()
+    assert table.column_names == VIDEO_COLUMNS
+    assert table['id'].to_pylist() == [f"v{i}" for i in range(7)]
+    assert table['channel_id'].to_pylist() == ['UC1'] * 5 + ['UC2'] * 2
+    # Columns missing from the rows or the columns are null
+    assert table['etl_ts'].null_count == 7
+    assert table['likes'].to_pylist()[5:] == [None, None]
+
+
+def test_a_batch_of_only_nulls_takes_the_type_of_the_others():
+    builder = ColumnarBuilder(['id', 'title'], batch_size=2)
+    builder.extend([{'id': 'v1'}, {'id': 'v2'}, {'id': 'v3', 'title': 'Three'}])
+
+    table = builder.to_table()
+    assert table.schema.field('title').type == pa.string()
+    assert table['title'].to_pylist() == [None, None, 'Three']
+
+
+def test_an_empty_builder_gives_an_empty_table():
+    table = ColumnarBuilder(['id', 'title'], key_columns=['id']).to_table()
+    assert (table.num_rows, table.column_names) == (0, ['id', 'title'])
+
+
+def test_coerce_table_casts_to_the_schema_and_keeps_nulls():
+    builder = ColumnarBuilder(VIDEO_COLUMNS + ['title'])
+    builder.append(video_row(1, title='One'), channel_id='UC1', rptg_dt='2024-08-10', etl_ts='2024-08-10 10:00:00')
+    builder.append({'id': 'v2', 'views': None, 'likes': '7', 'dislikes': None, 'comments': None},
+                   channel_id='UC1', rptg_dt='2024-08-10', etl_ts='2024-08-10T10:00:00.5Z')
+
+    table = coerce_table(builder.to_table(), DATASET_SCHEMAS['video'])
+    # Only the schema's columns, in the schema's order and types
+    assert table.schema == DATASET_SCHEMAS['video']
+    assert table.to_pylist() == [
+        {'id': 'v1', 'channel_id': 'UC1', 'rptg_dt': datetime.date(2024, 8, 10), 'views': 101, 'likes': 1,
+         'dislikes': 0, 'comments': 1, 'etl_ts': datetime.datetime(2024, 8, 10, 10)},
+        {'id': 'v2', 'channel_id': 'UC1', 'rptg_dt': datetime.date(2024, 8, 10), 'views': None, 'likes': 7,
+         'dislikes': None, 'comments': None, 'etl_ts': datetime.datetime(2024, 8, 10, 10)},
+    ]
+
+
+def test_coerce_table_rejects_a_table_not_matching_the_schema():
+    builder = ColumnarBuilder(['id', 'channel_id', 'views'])
+    builder.append({'id': 'v1', 'channel_id': 'UC1', 'views': 'many'})
+    table = builder.to_table()
+
+    with pytest.raises(KeyError):
+        coerce_table(table.select(['id', 'views']), pa.schema([('id', pa.string()), ('channel_id', pa.string())]))
+    with pytest.raises(pa.ArrowInvalid):
+        coerce_table(table, pa.schema([('id', pa.string()), ('views', pa.int64())]))
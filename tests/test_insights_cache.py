@@ -0,0 +1,96 @@
+# Tests of the insights notebook's result cache (insights/data_access.py InsightsData) on
+# the DuckDB warehouse of the benchmarks (needs duckdb). Run from the repository root:
+#   python -m pytest -q tests
+
+import pytest
+
+from insights.data_access import InsightsData
+
+
+CHANNEL_SQL = "SELECT channel_id, subscriber_count FROM CORE.TBL_YT_CHANNEL_STATS ORDER BY 1"
+VIDEO_SQL = "SELECT id, view_count FROM CORE.TBL_YT_VIDEO_STATS ORDER BY 1"
+TOP_SQL = "SELECT id, video_rank FROM SEMANTIC.TBL_YT_VIDEO_TOP ORDER BY 1"
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    pytest.importorskip('duckdb')
+    from benchmarks.fake_warehouse import DuckDBWarehouse
+    warehouse = DuckDBWarehouse(str(tmp_path / 's3'))
+    warehouse.db.execute("INSERT INTO CORE.TBL_YT_CHANNEL_STATS VALUES ('UC1', DATE '2024-08-10', 10, 100, 1, TIMESTAMP '2024-08-10 10:00:00')")
+    warehouse.db.execute("INSERT INTO CORE.TBL_YT_VIDEO_STATS VALUES ('v1', 'UC1', DATE '2024-08-10', 5, 1, 0, 0, TIMESTAMP '2024-08-10 10:00:00')")
+    warehouse.db.execute("""INSERT INTO SEMANTIC.TBL_YT_VIDEO_TOP
+        VALUES ('UC1', DATE '2024-08-10', 'views', 1, 'v1', 5, 1, 0, 0, 20.0, TIMESTAMP '2024-08-10 10:00:00')""")
+    return warehouse
+
+
+def make_data(warehouse, tmp_path, clock):
+    return InsightsData(warehouse.connect(), cache_dir=str(tmp_path / 'cache'), clock=lambda: clock[0])
+
+
+def test_a_cold_query_fetches_its_watermark_in_the_same_request(warehouse, tmp_path):
+    clock = [0]
+    data = make_data(warehouse, tmp_path, clock)
+    for sql in [CHANNEL_SQL, VIDEO_SQL, TOP_SQL]:
+        data.query(sql)
+
+    assert data.queries == 3
+    # The watermarks came with the results, the re-run does not check them again
+    assert [data.query(sql).iloc[0, 0] for sql in [CHANNEL_SQL, VIDEO_SQL, TOP_SQL]] == ['UC1', 'v1', 'v1']
+    assert (data.queries, data.cache_hits) == (3, 3)
+
+
+def test_a_new_load_refetches_only_the_results_reading_it(warehouse, tmp_path):
+    clock = [0]
+    make_data(warehouse, tmp_path, clock).query(CHANNEL_SQL)
+    make_data(warehouse, tmp_path, clock).query(VIDEO_SQL)
+    warehouse.db.execute("UPDATE CORE.TBL_YT_CHANNEL_STATS SET subscriber_count = 11, etl_ts = TIMESTAMP '2024-08-10 11:00:00'")
+    data = make_data(warehouse, tmp_path, clock)
+
+    assert data.query(CHANNEL_SQL)['SUBSCRIBER_COUNT'].tolist() == [11]
+    data.query(VIDEO_SQL)
+    # One check of both known tables, then the refetch
+    assert (data.queries, data.cache_hits) == (2, 1)
+
+
+def test_a_dropped_table_does_not_fail_the_other_cached_queries(warehouse, tmp_path):
+    clock = [0]
+    data = make_data(warehouse, tmp_path, clock)
+    for sql in [CHANNEL_SQL, VIDEO_SQL, TOP_SQL]:
+        data.query(sql)
+    warehouse.db.execute("DROP TABLE SEMANTIC.TBL_YT_VIDEO_TOP")
+    # A new session knows the three tables from the cached results
+    session = make_data(warehouse, tmp_path, clock)
+
+    assert session.query(CHANNEL_SQL)['CHANNEL_ID'].tolist() == ['UC1']
+    assert session.query(VIDEO_SQL)['ID'].tolist() == ['v1']
+    assert session.cache_hits == 2
+    with pytest.raises(Exception):
+        session.query(TOP_SQL)
+    # The dropped table is not checked again
+    clock[0] += 1000
+    queries = session.queries
+    session.query(CHANNEL_SQL)
+    assert session.queries == queries + 1 and session.cache_hits == 3
+
+
+def test_a_table_without_watermark_is_queried_without_the_cache(warehouse, tmp_path):
+    warehouse.db.execute("CREATE TABLE CORE.TBL_NO_ETL_TS AS SELECT 1 AS n")
+    clock = [0]
+    data = make_data(warehouse, tmp_path, clock)
+    data.query(CHANNEL_SQL)
+    sql = "SELECT n FROM CORE.TBL_NO_ETL_TS"
+
+    assert data.query(sql)['n'].tolist() == [1]
+    queries = data.queries
+    # Known to have no watermark, no new attempt until it expires
+    assert data.query(sql)['n'].tolist() == [1]
+    assert data.queries == queries + 1
+    assert data.query(CHANNEL_SQL)['CHANNEL_ID'].tolist() == ['UC1']
+    assert data.cache_hits == 1
+    # Checked again once expired
+    warehouse.db.execute("ALTER TABLE CORE.TBL_NO_ETL_TS ADD COLUMN etl_ts TIMESTAMP")
+    clock[0] += 1000
+    data.query(sql)
+    data.query(sql)
+    assert data.cache_hits == 2
@@ -0,0 +1,72 @@
+# Tests of the extraction shard plan (plan_shards). Run from the repository root:
+#   python -m pytest -q tests
+
+import random
+
+from dags.utils import plan_shards
+
+
+CHANNELS = [f"channel{c}" for c in range(60)]
+
+
+def pareto_weights(seed=7):
+    rng = random.Random(seed)
+    return {channel: min(int(20 * rng.paretovariate(1.0)), 5000) for channel in CHANNELS}
+
+
+def assignment(shards):
+    return {channel: shard for shard, channels in enumerate(shards) for channel in channels}
+
+
+def loads(shards, weights):
+    return [sum(weights[channel] for channel in channels) for channels in shards]
+
+
+def test_every_channel_is_in_exactly_one_non_empty_shard():
+    shards = plan_shards(CHANNELS + CHANNELS[:5], 8, pareto_weights())
+
+    assert sorted(channel for channels in shards for channel in channels) == sorted(CHANNELS)
+    assert len(shards) == 8 and all(shards)
+
+
+def test_no_channels_give_empty_shards():
+    assert plan_shards([], 4) == [[], [], [], []]
+    assert plan_shards([], 4, {'channel0': 10}, previous={'channel0': 2}) == [[], [], [], []]
+
+
+def test_the_heaviest_shard_is_within_the_lpt_bound():
+    weights = pareto_weights()
+    shard_loads = loads(plan_shards(CHANNELS, 8, weights), weights)
+
+    assert max(shard_loads) <= 4 / 3 * max(sum(shard_loads) / 8, max(weights.values()))
+
+
+def test_replanning_keeps_every_channel_on_its_shard():
+    weights = pareto_weights()
+    first = assignment(plan_shards(CHANNELS, 8, weights))
+    # Small weight changes and new channels leave the placed channels where they are
+    changed = {channel: weight * random.Random(channel).uniform(0.9, 1.1) for channel, weight in weights.items()}
+    second = assignment(plan_shards(CHANNELS + ['new1', 'new2'], 8, changed, previous=first))
+
+    assert assignment(plan_shards(CHANNELS, 8, weights, previous=first)) == first
+    assert {channel: second[channel] for channel in CHANNELS} == first
+    assert {'new1', 'new2'} <= set(second)
+
+
+def test_unbalanced_previous_plan_is_rebalanced():
+    weights = {channel: 10 for channel in CHANNELS}
+    # Every channel was on shard 0
+    shards = plan_shards(CHANNELS, 4, weights, previous={channel: 0 for channel in CHANNELS})
+
+    assert max(loads(shards, weights)) <= 1.25 * sum(weights.values()) / 4
+    assert all(shards)
+
+
+def test_fewer_shards_mostly_keep_the_channels_of_the_remaining_ones():
+    weights = pareto_weights()
+    first = assignment(plan_shards(CHANNELS, 8, weights))
+    shards = plan_shards(CHANNELS, 4, weights, previous=first)
+
+    assert len(shards) == 4 and sorted(assignment(shards)) == sorted(CHANNELS)
+    kept = [channel for channel in CHANNELS if first[channel] < 4]
+    assert sum(1 for channel in kept if assignment(shards)[channel] == first[channel]) >= len(kept) // 2
@@ -0,0 +1,90 @@
+# Tests of the streaming Parquet upload (upload_parquet, S3MultipartStream) against moto's
+# in process S3 (pip install moto). Run from the repository root:
+#   python -m pytest -q tests
+
+import io
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from dags.utils import S3MultipartStream, upload_parquet
+
+
+BUCKET = 'youtube-stats-test'
+PART_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    moto = pytest.importorskip('moto')
+    import boto3
+    for name, value in [('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'), ('AWS_DEFAULT_REGION', 'us-east-1')]:
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+class FailingClient():
+    """S3 client failing the fail_at-th upload_part."""
+    def __init__(self, client, fail_at):
+        self._client = client
+        self._fail_at = fail_at
+        self.parts = 0
+
+    def upload_part(self, **kwargs):
+        self.parts += 1
+        if self.parts == self._fail_at:
+            raise ConnectionError('connection reset')
+        return self._client.upload_part(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def random_table(rows):
+    # Hex of random bytes, uncompressed it takes 32 bytes per row
+    return pa.table({'id': [os.urandom(16).hex() for _ in range(rows)], 'n': list(range(rows))})
+
+
+def read_back(s3_client, key):
+    return pq.read_table(io.BytesIO(s3_client.get_object(Bucket=BUCKET, Key=key)['Body'].read()))
+
+
+def test_a_large_table_is_uploaded_in_several_parts(s3_client):
+    table = random_table(400_000)
+    written = upload_parquet(s3_client, BUCKET, 'video/run=1/video.parquet', table,
+                             compression='none', row_group_size=50_000, part_size=PART_SIZE)
+
+    assert written > 2 * PART_SIZE
+    head = s3_client.head_object(Bucket=BUCKET, Key='video/run=1/video.parquet', PartNumber=1)
+    assert head['PartsCount'] == -(-written // PART_SIZE)
+    assert read_back(s3_client, 'video/run=1/video.parquet').equals(table)
+
+
+def test_a_small_table_is_one_put(s3_client):
+    table = random_table(100)
+    upload_parquet(s3_client, BUCKET, 'channel/channel.parquet', table, part_size=PART_SIZE)
+
+    assert read_back(s3_client, 'channel/channel.parquet').equals(table)
+    assert s3_client.list_multipart_uploads(Bucket=BUCKET).get('Uploads', []) == []
+
+
+def test_a_failure_while_writing_aborts_the_upload(s3_client):
+    client = FailingClient(s3_client, fail_at=2)
+
+    with pytest.raises(ConnectionError):
+        upload_parquet(client, BUCKET, 'video/failed.parquet', random_table(400_000),
+                       compression='none', row_group_size=50_000, part_size=PART_SIZE)
+    # The first part was uploaded, the abort drops it and no object is left
+    assert client.parts == 2
+    assert s3_client.list_multipart_uploads(Bucket=BUCKET).get('Uploads', []) == []
+    assert s3_client.list_objects_v2(Bucket=BUCKET).get('KeyCount') == 0
+
+
+def test_parts_under_5mb_are_rejected(s3_client):
+    with pytest.raises(ValueError):
+        S3MultipartStream(s3_client, BUCKET, 'key', part_size=1024 * 1024)
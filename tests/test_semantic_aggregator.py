@@ -0,0 +1,101 @@
+# Tests of the SEMANTIC aggregates (SemanticAggregator) on the DuckDB warehouse of the
+# benchmarks (needs duckdb). Run from the repository root:
+#   python -m pytest -q tests
+
+import pytest
+
+from dags.utils import SemanticAggregator
+
+
+ETL_TS = '2024-08-10 12:00:00'
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    pytest.importorskip('duckdb')
+    from benchmarks.fake_warehouse import DuckDBWarehouse
+    warehouse = DuckDBWarehouse(str(tmp_path))
+    db = warehouse.db
+    # Two dates of stats: v1 gains views on the 10th, v2 has no snapshot of the 10th
+    db.execute("""
+        INSERT INTO CORE.TBL_YT_VIDEO_STATS VALUES
+        ('v1', 'UC1', DATE '2024-08-09', 100, 10, 0, 5, TIMESTAMP '2024-08-09 10:00:00'),
+        ('v2', 'UC1', DATE '2024-08-09', 400, 4, 0, 0, TIMESTAMP '2024-08-09 10:00:00'),
+        ('v1', 'UC1', DATE '2024-08-10', 1000, 20, 0, 10, TIMESTAMP '2024-08-10 10:00:00')""")
+    db.execute("""
+        INSERT INTO CORE.TBL_YT_CHANNEL_STATS VALUES
+        ('UC1', DATE '2024-08-09', 500, 1000, 2, TIMESTAMP '2024-08-09 10:00:00'),
+        ('UC1', DATE '2024-08-10', 1400, 1100, 2, TIMESTAMP '2024-08-10 10:00:00')""")
+    db.execute("""
+        INSERT INTO CORE.TBL_YT_VIDEO_MD VALUES
+        ('v1', 'UC1', 'One', 'https://www.youtube.com/watch?v=v1', TIMESTAMP '2024-07-01 08:00:00', TIMESTAMP '2024-08-10 10:00:00'),
+        ('v2', 'UC1', 'Two', 'https://www.youtube.com/watch?v=v2', TIMESTAMP '2024-08-02 08:00:00', TIMESTAMP '2024-08-10 10:00:00')""")
+    return warehouse
+
+
+def load_stage(warehouse, rptg_dt):
+    # The stage holds the last load, the stats of rptg_dt
+    warehouse.db.execute(f"INSERT INTO CORE.TBL_STG_YT_VIDEO_STATS SELECT * FROM CORE.TBL_YT_VIDEO_STATS WHERE rptg_dt = DATE '{rptg_dt}'")
+    warehouse.db.execute(f"INSERT INTO CORE.TBL_STG_YT_CHANNEL_STATS SELECT * FROM CORE.TBL_YT_CHANNEL_STATS WHERE rptg_dt = DATE '{rptg_dt}'")
+
+
+def engagement(warehouse):
+    return warehouse.query("""
+        SELECT CAST(rptg_dt AS VARCHAR), video_count, total_views FROM SEMANTIC.TBL_YT_CHANNEL_ENGAGEMENT ORDER BY 1""")
+
+
+def top_by_views(warehouse):
+    return warehouse.query("""
+        SELECT CAST(rptg_dt AS VARCHAR), id, view_count FROM SEMANTIC.TBL_YT_VIDEO_TOP
+        WHERE metric = 'views' AND video_rank = 1 ORDER BY 1""")
+
+
+def test_each_date_aggregates_its_own_stats_rows(warehouse):
+    load_stage(warehouse, '2024-08-09')
+    SemanticAggregator(warehouse.connect()).run(etl_ts=ETL_TS)
+    warehouse.db.execute("DELETE FROM CORE.TBL_STG_YT_VIDEO_STATS; DELETE FROM CORE.TBL_STG_YT_CHANNEL_STATS;")
+    load_stage(warehouse, '2024-08-10')
+    SemanticAggregator(warehouse.connect()).run(etl_ts=ETL_TS)
+
+    # Not the latest snapshot of every video repeated under each date
+    assert engagement(warehouse) == [('2024-08-09', 2, 500), ('2024-08-10', 1, 1000)]
+    assert top_by_views(warehouse) == [('2024-08-09', 'v2', 400), ('2024-08-10', 'v1', 1000)]
+
+
+def test_backfill_recomputes_the_given_dates_with_an_empty_stage(warehouse):
+    rows = SemanticAggregator(warehouse.connect()).run(etl_ts=ETL_TS, dates=['2024-08-10', '2024-08-09'])
+
+    assert engagement(warehouse) == [('2024-08-09', 2, 500), ('2024-08-10', 1, 1000)]
+    assert warehouse.query("""
+        SELECT CAST(rptg_dt AS VARCHAR), new_subscribers FROM SEMANTIC.TBL_YT_CHANNEL_DAILY ORDER BY 1""") == [
+        ('2024-08-09', None), ('2024-08-10', 100)]
+    # Every upload month of TBL_YT_VIDEO_MD by default
+    assert warehouse.query("""
+        SELECT CAST(upload_month AS VARCHAR), video_count FROM SEMANTIC.TBL_YT_CHANNEL_MONTHLY_UPLOADS ORDER BY 1""") == [
+        ('2024-07-01', 1), ('2024-08-01', 1)]
+    assert warehouse.query("SELECT id, CAST(rptg_dt AS VARCHAR) FROM SEMANTIC.TBL_YT_VIDEO_LATEST ORDER BY 1") == [
+        ('v1', '2024-08-10'), ('v2', '2024-08-09')]
+    assert rows['TBL_YT_CHANNEL_ENGAGEMENT'] == 2
+
+
+def test_backfill_twice_gives_the_same_tables(warehouse):
+    aggregator = SemanticAggregator(warehouse.connect())
+    aggregator.run(etl_ts=ETL_TS, dates=['2024-08-09', '2024-08-10'])
+    first = engagement(warehouse), top_by_views(warehouse)
+    aggregator.run(etl_ts=ETL_TS, dates=['2024-08-09', '2024-08-10'], months=[])
+
+    assert (engagement(warehouse), top_by_views(warehouse)) == first
+    assert len(warehouse.query("SELECT * FROM SEMANTIC.TBL_YT_CHANNEL_MONTHLY_UPLOADS")) == 2
+
+
+def test_a_failed_statement_rolls_the_table_back(warehouse, monkeypatch):
+    aggregator = SemanticAggregator(warehouse.connect())
+    aggregator.run(etl_ts=ETL_TS, dates=['2024-08-09', '2024-08-10'])
+    before = engagement(warehouse)
+    # The DELETE runs, then the INSERT fails
+    monkeypatch.setattr(aggregator, 'channel_engagement_sql',
+                        lambda dates, etl_ts: ["DELETE FROM SEMANTIC.TBL_YT_CHANNEL_ENGAGEMENT;", "SELECT * FROM NO_SUCH_TABLE;"])
+
+    with pytest.raises(Exception):
+        aggregator.run(etl_ts=ETL_TS, dates=['2024-08-09', '2024-08-10'])
+    assert engagement(warehouse) == before
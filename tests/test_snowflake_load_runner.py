@@ -0,0 +1,152 @@
+# Tests of the concurrent table loads (SnowflakeLoadRunner) on the DuckDB warehouse of the
+# benchmarks (needs duckdb). Run from the repository root:
+#   python -m pytest -q tests
+
+import datetime
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from dags.utils import (DATASET_SCHEMAS, SnowflakeConnectionPool, SnowflakeLoader, SnowflakeLoadRunner,
+                        internal_stage, put_parquet)
+from benchmarks.bench_snowflake_load_runner import table_specs
+
+
+ETL_TS = datetime.datetime(2024, 8, 10, 10)
+RPTG_DT = datetime.date(2024, 8, 10)
+ROWS = {
+    'channel_md': {'channel_name': ['c1'], 'channel_id': ['UC1'], 'title': ['C1'], 'customUrl': ['@c1'],
+                   'publishedAt': [ETL_TS], 'country': ['SG'], 'etl_ts': [ETL_TS]},
+    'channel': {'channel_id': ['UC1'], 'rptg_dt': [RPTG_DT], 'viewCount': [10], 'subscriberCount': [5],
+                'videoCount': [2], 'etl_ts': [ETL_TS]},
+    'video_md': {'id': ['v1', 'v2'], 'channel_id': ['UC1', 'UC1'], 'title': ['One', 'Two'],
+                 'url': ['u1', 'u2'], 'publishedAt': [ETL_TS, ETL_TS], 'etl_ts': [ETL_TS, ETL_TS]},
+    'video': {'id': ['v1', 'v2'], 'channel_id': ['UC1', 'UC1'], 'rptg_dt': [RPTG_DT, RPTG_DT], 'views': [3, 7],
+              'likes': [1, 1], 'dislikes': [0, 0], 'comments': [0, 0], 'etl_ts': [ETL_TS, ETL_TS]},
+}
+CORE_TABLES = {'channel_md': 'TBL_YT_CHANNEL_MD', 'channel': 'TBL_YT_CHANNEL_STATS',
+               'video_md': 'TBL_YT_VIDEO_MD', 'video': 'TBL_YT_VIDEO_STATS'}
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    pytest.importorskip('duckdb')
+    from benchmarks.fake_warehouse import DuckDBWarehouse
+    return DuckDBWarehouse(str(tmp_path), latency=0.005)
+
+
+def make_specs(**overrides):
+    # overrides is {dataset: {spec key: value}}
+    return [{**spec, 's3_schema': DATASET_SCHEMAS[spec['dataset']], **overrides.get(spec['dataset'], {})}
+            for spec in table_specs()]
+
+
+def stage_files(warehouse, specs):
+    """Writes each dataset's file to its stage, returns the files of the runner."""
+    files = {}
+    for spec in specs:
+        path = f"dt=2024-08-10/run=1/{spec['dataset']}.parquet"
+        table = pa.table(ROWS[spec['dataset']], schema=DATASET_SCHEMAS[spec['dataset']])
+        if spec.get('load_backend') == 'direct':
+            put_parquet(warehouse.connect(), internal_stage('CORE', spec['stage_table_name']), path, table)
+        else:
+            local_path = os.path.join(warehouse.stage_dir(spec['s3_stage_name']), path)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            pq.write_table(table, local_path)
+        files[spec['dataset']] = [path]
+    return files
+
+
+def make_runner(warehouse, specs, connections, max_workers=None):
+    def connect():
+        conn = warehouse.connect()
+        connections.append(conn)
+        return conn
+    return SnowflakeLoadRunner(SnowflakeConnectionPool(connect, size=4), 'CORE', specs, max_workers=max_workers)
+
+
+def core_counts(warehouse):
+    return {dataset: warehouse.query(f"SELECT COUNT(*) FROM CORE.{table}")[0][0] for dataset, table in CORE_TABLES.items()}
+
+
+def staged_files(warehouse, spec):
+    stage_dir = warehouse.stage_dir(internal_stage('CORE', spec['stage_table_name']))
+    return sorted(os.path.relpath(os.path.join(root, name), stage_dir)
+                  for root, _, names in os.walk(stage_dir) for name in names)
+
+
+def test_a_table_loads_after_the_tables_it_depends_on(warehouse, monkeypatch):
+    events = []
+    lock = threading.Lock()
+
+    def recorded(name):
+        method = getattr(SnowflakeLoader, name)
+
+        def wrapper(self, *args, **kwargs):
+            with lock:
+                events.append((name, self.core_table_name))
+            return method(self, *args, **kwargs)
+        return wrapper
+
+    for name in ['s3_to_stg', 'stg_to_core']:
+        monkeypatch.setattr(SnowflakeLoader, name, recorded(name))
+    # The dependent table comes first, with one worker it must still not wait on a table never started
+    specs = make_specs(video={'depends_on': ['video_md', 'channel']})
+    specs = [specs[3]] + specs[:3]
+    files = stage_files(warehouse, specs)
+    make_runner(warehouse, specs, [], max_workers=1).run(files)
+
+    video_start = events.index(('s3_to_stg', 'TBL_YT_VIDEO_STATS'))
+    assert events.index(('stg_to_core', 'TBL_YT_VIDEO_MD')) < video_start
+    assert events.index(('stg_to_core', 'TBL_YT_CHANNEL_STATS')) < video_start
+    assert core_counts(warehouse) == {'channel_md': 1, 'channel': 1, 'video_md': 2, 'video': 2}
+
+
+def test_unknown_or_circular_dependencies_are_rejected(warehouse):
+    with pytest.raises(Exception, match='unknown dataset'):
+        make_runner(warehouse, make_specs(video={'depends_on': ['comments']}), [])
+    with pytest.raises(Exception, match='Circular'):
+        make_runner(warehouse, make_specs(video={'depends_on': ['video_md']}, video_md={'depends_on': ['video']}), [])
+
+
+def test_a_run_fetches_the_columns_of_all_tables_in_one_query(warehouse):
+    connections = []
+    specs = make_specs()
+    make_runner(warehouse, specs, connections).run(stage_files(warehouse, specs))
+
+    statements = [sql for conn in connections for sql in conn.statements]
+    assert sum('INFORMATION_SCHEMA' in sql for sql in statements) == 1
+    assert core_counts(warehouse) == {'channel_md': 1, 'channel': 1, 'video_md': 2, 'video': 2}
+
+
+def test_a_failed_table_does_not_stop_the_others(warehouse):
+    specs = make_specs()
+    files = stage_files(warehouse, specs)
+    # The channel stats file is missing, its COPY fails
+    files['channel'] = ['dt=2024-08-10/run=1/missing.parquet']
+
+    with pytest.raises(Exception, match='Snowflake load failed for channel\\.'):
+        make_runner(warehouse, specs, []).run(files)
+    assert core_counts(warehouse) == {'channel_md': 1, 'channel': 0, 'video_md': 2, 'video': 2}
+
+
+def test_direct_files_are_removed_once_every_table_loaded(warehouse):
+    specs = make_specs(video_md={'load_backend': 'direct'}, video={'load_backend': 'direct'})
+    direct = [spec for spec in specs if spec.get('load_backend') == 'direct']
+    files = stage_files(warehouse, specs)
+    good_files = dict(files)
+    files['channel'] = ['dt=2024-08-10/run=1/missing.parquet']
+
+    # video_md and video loaded, but a failed table keeps their files for the retry
+    with pytest.raises(Exception):
+        make_runner(warehouse, specs, []).run(files)
+    assert core_counts(warehouse)['video'] == 2
+    assert [staged_files(warehouse, spec) for spec in direct] == [
+        [os.path.join('dt=2024-08-10', 'run=1', 'video_md.parquet')], [os.path.join('dt=2024-08-10', 'run=1', 'video.parquet')]]
+
+    make_runner(warehouse, specs, []).run(good_files)
+    assert [staged_files(warehouse, spec) for spec in direct] == [[], []]
+    assert core_counts(warehouse) == {'channel_md': 1, 'channel': 1, 'video_md': 2, 'video': 2}
@@ -0,0 +1,140 @@
+# Tests of the SQL SnowflakeLoader generates for the core load, and of stg_to_core run on
+# the DuckDB warehouse of the benchmarks (needs duckdb). Run from the repository root:
+#   python -m pytest -q tests
+
+import re
+
+import pytest
+
+from dags.utils import SnowflakeLoader
+from benchmarks.fake_warehouse import RecordingConnection
+
+
+def make_loader(conn, core_table='TBL_YT_VIDEO_STATS', **kwargs):
+    stage_table = core_table.replace('TBL_', 'TBL_STG_')
+    return SnowflakeLoader(conn, 'CORE', 's3_stage', stage_table, core_table, s3_col_map={}, **kwargs)
+
+
+def merge_loader(conn, **kwargs):
+    return make_loader(conn, load_type='MERGE', merge_on_col=['id', 'rptg_dt'], **kwargs)
+
+
+def squash(sql):
+    return ' '.join(sql.split())
+
+
+def test_merge_detect_changes_compares_the_non_key_columns():
+    [sql] = merge_loader(RecordingConnection()).core_load_sql()
+    matched = re.search(r"WHEN MATCHED AND \((.*?)\) THEN UPDATE SET", squash(sql))
+    assert matched is not None
+    compared = [cond.split()[0] for cond in matched.group(1).split(' OR ')]
+    assert compared == ['t.CHANNEL_ID', 't.VIEW_COUNT', 't.LIKE_COUNT', 't.DISLIKE_COUNT', 't.COMMENT_COUNT']
+    assert all(re.fullmatch(r"t\.(\w+) IS DISTINCT FROM d\.\1", cond) for cond in matched.group(1).split(' OR '))
+    # etl_ts is updated with the row but never compared
+    assert 'ETL_TS = d.ETL_TS' in squash(sql)
+
+
+def test_merge_without_detect_changes_updates_every_match():
+    [sql] = merge_loader(RecordingConnection(), detect_changes=False).core_load_sql()
+    assert 'IS DISTINCT FROM' not in sql
+    assert 'WHEN MATCHED THEN UPDATE SET' in squash(sql)
+
+
+def test_merge_dedupes_the_stage_on_the_merge_keys():
+    [sql] = merge_loader(RecordingConnection()).core_load_sql()
+    assert 'QUALIFY ROW_NUMBER() OVER (PARTITION BY ID,RPTG_DT ORDER BY ETL_TS DESC) = 1' in squash(sql)
+
+
+def test_merge_dedupe_orders_by_the_first_key_without_etl_ts():
+    loader = make_loader(RecordingConnection(), 'TBL_YT_VIDEO_STATS_HOURLY', load_type='MERGE', merge_on_col=['id', 'rptg_ts'])
+    [sql] = loader.core_load_sql()
+    assert 'PARTITION BY ID,RPTG_TS ORDER BY ID DESC' in squash(sql)
+
+
+def test_merge_prunes_the_core_table_in_the_on_clause():
+    loader = merge_loader(RecordingConnection(), prune_on_col='rptg_dt')
+    [sql] = loader.core_load_sql(('2024-08-01', '2024-08-10'))
+    on_clause = squash(sql).split(' ON ', 1)[1].split(' WHEN ', 1)[0]
+    assert on_clause == "d.ID = t.ID AND d.RPTG_DT = t.RPTG_DT AND t.RPTG_DT BETWEEN '2024-08-01' AND '2024-08-10'"
+    # Without a stage range there is nothing to prune on
+    [sql] = loader.core_load_sql()
+    assert 'BETWEEN' not in sql
+
+
+def test_prune_on_col_must_be_a_merge_key():
+    with pytest.raises(Exception, match='prune_on_col'):
+        merge_loader(RecordingConnection(), prune_on_col='etl_ts')
+
+
+def test_full_load_is_one_insert_overwrite():
+    statements = make_loader(RecordingConnection(), 'TBL_YT_CHANNEL_MD').core_load_sql()
+    assert len(statements) == 1
+    assert squash(statements[0]) == squash(
+        "insert overwrite into CORE.TBL_YT_CHANNEL_MD (CHANNEL_NAME,CHANNEL_ID,TITLE,CUSTOM_URL,PUBLISHED_AT,COUNTRY,ETL_TS) "
+        "select CHANNEL_NAME,CHANNEL_ID,TITLE,CUSTOM_URL,PUBLISHED_AT,COUNTRY,ETL_TS from CORE.TBL_STG_YT_CHANNEL_MD;")
+
+
+def test_copy_files_are_sql_string_literals():
+    loader = SnowflakeLoader(RecordingConnection(), 'CORE', 's3_stage', 'TBL_STG_YT_VIDEO_STATS', 'TBL_YT_VIDEO_STATS',
+                             s3_col_map={'id': 'id'})
+    loader.s3_to_stg(files=["dt=2024-08-10/it's.parquet", 'dt=2024-08-10/a\\b.parquet'])
+    [copy] = [sql for sql in loader.conn.statements if 'COPY INTO' in sql]
+    assert "FILES = ('dt=2024-08-10/it''s.parquet', 'dt=2024-08-10/a\\\\b.parquet')" in copy
+    assert '"' not in copy
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    pytest.importorskip('duckdb')
+    from benchmarks.fake_warehouse import DuckDBWarehouse
+    return DuckDBWarehouse(str(tmp_path))
+
+
+def stage_video_stats(warehouse, rows):
+    warehouse.db.execute('DELETE FROM CORE.TBL_STG_YT_VIDEO_STATS')
+    for video_id, rptg_dt, views, etl_ts in rows:
+        warehouse.db.execute(f"INSERT INTO CORE.TBL_STG_YT_VIDEO_STATS VALUES "
+                             f"('{video_id}', 'UC1', DATE '{rptg_dt}', {views}, 0, 0, 0, TIMESTAMP '{etl_ts}')")
+
+
+def test_stg_to_core_counts_the_rows_touched(warehouse):
+    loader = merge_loader(warehouse.connect(), prune_on_col='rptg_dt')
+    stage_video_stats(warehouse, [('v1', '2024-08-09', 10, '2024-08-09 10:00:00'),
+                                  ('v2', '2024-08-09', 20, '2024-08-09 10:00:00')])
+    assert loader.stg_to_core() == {'rows_inserted': 2, 'rows_updated': 0}
+    # The same rows again touch nothing, a changed count is one update
+    assert loader.stg_to_core() == {'rows_inserted': 0, 'rows_updated': 0}
+    stage_video_stats(warehouse, [('v1', '2024-08-09', 11, '2024-08-09 11:00:00'),
+                                  ('v2', '2024-08-09', 20, '2024-08-09 11:00:00'),
+                                  ('v3', '2024-08-10', 30, '2024-08-10 11:00:00')])
+    assert loader.stg_to_core() == {'rows_inserted': 1, 'rows_updated': 1}
+    # The MERGE was bounded by the stage's MIN/MAX of rptg_dt
+    assert "BETWEEN '2024-08-09' AND '2024-08-10'" in squash(loader.conn.statements[-1])
+
+
+def test_stg_to_core_without_detect_changes_updates_every_match(warehouse):
+    loader = merge_loader(warehouse.connect(), detect_changes=False)
+    stage_video_stats(warehouse, [('v1', '2024-08-09', 10, '2024-08-09 10:00:00'),
+                                  ('v2', '2024-08-09', 20, '2024-08-09 10:00:00')])
+    loader.stg_to_core()
+    assert loader.stg_to_core() == {'rows_inserted': 0, 'rows_updated': 2}
+
+
+def test_stg_to_core_keeps_the_latest_duplicate(warehouse):
+    loader = merge_loader(warehouse.connect())
+    stage_video_stats(warehouse, [('v1', '2024-08-09', 10, '2024-08-09 10:00:00'),
+                                  ('v1', '2024-08-09', 12, '2024-08-09 12:00:00'),
+                                  ('v1', '2024-08-09', 11, '2024-08-09 11:00:00')])
+    assert loader.stg_to_core() == {'rows_inserted': 1, 'rows_updated': 0}
+    assert warehouse.query('SELECT VIEW_COUNT FROM CORE.TBL_YT_VIDEO_STATS') == [(12,)]
+
+
+def test_stg_to_core_full_load_replaces_the_table(warehouse):
+    loader = make_loader(warehouse.connect(), 'TBL_YT_CHANNEL_MD')
+    for names in [['a', 'b', 'c'], ['d']]:
+        warehouse.db.execute('DELETE FROM CORE.TBL_STG_YT_CHANNEL_MD')
+        for name in names:
+            warehouse.db.execute(f"INSERT INTO CORE.TBL_STG_YT_CHANNEL_MD VALUES "
+                                 f"('{name}', 'UC{name}', '{name}', '@{name}', TIMESTAMP '2010-01-01', 'SG', TIMESTAMP '2024-08-09')")
+        assert loader.stg_to_core() == {'rows_inserted': len(names), 'rows_updated': 0}
+    assert warehouse.query('SELECT CHANNEL_NAME FROM CORE.TBL_YT_CHANNEL_MD') == [('d',)]
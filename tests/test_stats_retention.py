@@ -0,0 +1,127 @@
+# Tests of the retention jobs of the stats tables (StatsRetention, HourlyStatsRetention) on
+# the DuckDB warehouse of the benchmarks (needs duckdb). Run from the repository root:
+#   python -m pytest -q tests
+
+import datetime
+
+import pytest
+
+from dags.utils import HourlyStatsRetention, StatsRetention
+
+
+AS_OF = datetime.date(2024, 8, 10)
+ETL_TS = '2024-08-10 12:00:00'
+DAYS = 400
+VIDEO_ROLLUP = 'SELECT ID, GRAIN, PERIOD_START, LAST_RPTG_DT, VIEW_COUNT, LIKE_COUNT, SNAPSHOT_COUNT FROM CORE.TBL_YT_VIDEO_STATS_ROLLUP ORDER BY 3, 2'
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    pytest.importorskip('duckdb')
+    from benchmarks.fake_warehouse import DuckDBWarehouse
+    warehouse = DuckDBWarehouse(str(tmp_path))
+    # A daily snapshot of v1 for each of the last 400 days, the counters grow with the date
+    for date in daily_dates():
+        day = date.toordinal()
+        warehouse.db.execute(f"INSERT INTO CORE.TBL_YT_VIDEO_STATS VALUES "
+                             f"('v1', 'UC1', DATE '{date}', {day}, {2 * day}, 0, 1, TIMESTAMP '{date} 10:00:00')")
+        warehouse.db.execute(f"INSERT INTO CORE.TBL_YT_CHANNEL_STATS VALUES "
+                             f"('UC1', DATE '{date}', {day}, {day // 10}, 1, TIMESTAMP '{date} 10:00:00')")
+    return warehouse
+
+
+def daily_dates():
+    return [AS_OF - datetime.timedelta(days=d) for d in range(1, DAYS + 1)]
+
+
+def expected_rollups(dates, daily_cutoff, weekly_cutoff):
+    """{(grain, period_start): [dates]} of the first run, which rolls the daily rows up directly."""
+    periods = {}
+    for date in dates:
+        if date < weekly_cutoff:
+            period = ('month', date.replace(day=1))
+        elif date < daily_cutoff:
+            period = ('week', date - datetime.timedelta(days=date.weekday()))
+        else:
+            continue
+        periods.setdefault(period, []).append(date)
+    return periods
+
+
+def daily_rows(warehouse):
+    return warehouse.query('SELECT * FROM CORE.TBL_YT_VIDEO_STATS ORDER BY RPTG_DT')
+
+
+def test_rollups_keep_the_last_snapshot_and_count_the_rows_they_replace(warehouse):
+    results = StatsRetention(warehouse.connect(), daily_days=90, weekly_days=365).run(as_of=AS_OF, etl_ts=ETL_TS)
+
+    daily_cutoff, weekly_cutoff = AS_OF - datetime.timedelta(days=90), AS_OF - datetime.timedelta(days=365)
+    periods = expected_rollups(daily_dates(), daily_cutoff, weekly_cutoff)
+    expected = sorted((('v1', grain, start, max(dates), max(dates).toordinal(), 2 * max(dates).toordinal(), len(dates))
+                       for (grain, start), dates in periods.items()), key=lambda row: (row[2], row[1]))
+    assert warehouse.query(VIDEO_ROLLUP) == expected
+    assert results['TBL_YT_VIDEO_STATS'] == {'rolled_up': len(periods), 'deleted': DAYS - 90}
+    # The channel rollups hold the same periods
+    assert warehouse.query('SELECT COUNT(*), SUM(SNAPSHOT_COUNT) FROM CORE.TBL_YT_CHANNEL_STATS_ROLLUP') == [(len(periods), DAYS - 90)]
+
+
+def test_rows_inside_the_daily_window_are_untouched(warehouse):
+    before = [row for row in daily_rows(warehouse) if row[2] >= AS_OF - datetime.timedelta(days=90)]
+    StatsRetention(warehouse.connect(), daily_days=90, weekly_days=365).run(as_of=AS_OF, etl_ts=ETL_TS)
+
+    assert daily_rows(warehouse) == before
+
+
+def test_a_second_run_changes_nothing(warehouse):
+    retention = StatsRetention(warehouse.connect(), daily_days=90, weekly_days=365)
+    retention.run(as_of=AS_OF, etl_ts=ETL_TS)
+    tables = daily_rows(warehouse), warehouse.query(VIDEO_ROLLUP)
+
+    results = retention.run(as_of=AS_OF, etl_ts='2024-08-10 13:00:00')
+    assert results['TBL_YT_VIDEO_STATS'] == {'rolled_up': 0, 'deleted': 0}
+    assert (daily_rows(warehouse), warehouse.query(VIDEO_ROLLUP)) == tables
+
+
+def test_aged_weekly_rows_merge_into_months_keeping_every_snapshot(warehouse):
+    retention = StatsRetention(warehouse.connect(), daily_days=90, weekly_days=365)
+    retention.run(as_of=AS_OF, etl_ts=ETL_TS)
+    # Two months later weeks fell out of the weekly window
+    retention.run(as_of=AS_OF + datetime.timedelta(days=60), etl_ts=ETL_TS)
+
+    rollups = warehouse.query(VIDEO_ROLLUP)
+    assert sum(row[6] for row in rollups) + len(daily_rows(warehouse)) == DAYS
+    # Every rollup row holds the counters of its last snapshot
+    assert all(view == last.toordinal() and like == 2 * last.toordinal() for _, _, _, last, view, like, _ in rollups)
+    months = [row for row in rollups if row[1] == 'month']
+    assert len(set(row[2] for row in months)) == len(months)
+
+
+def hourly_rows(warehouse):
+    return warehouse.query('SELECT ID, RPTG_TS, VIEW_COUNT FROM CORE.TBL_YT_VIDEO_STATS_HOURLY ORDER BY RPTG_TS')
+
+
+def test_old_hourly_rows_keep_the_last_snapshot_of_each_day(warehouse):
+    as_of = datetime.datetime(2024, 8, 10, 12)
+    # A snapshot every 3 hours for 100 days, the view count grows with the hour
+    timestamps = [as_of - datetime.timedelta(hours=h) for h in range(1, 100 * 24, 3)]
+    for i, ts in enumerate(timestamps):
+        warehouse.db.execute(f"INSERT INTO CORE.TBL_YT_VIDEO_STATS_HOURLY VALUES ('v1', TIMESTAMP '{ts}', {len(timestamps) - i}, 0, 0)")
+    full_cutoff, expire_cutoff = as_of - datetime.timedelta(days=7), as_of - datetime.timedelta(days=90)
+    before = {ts: views for _, ts, views in hourly_rows(warehouse)}
+    last_of_day = {}
+    for ts in before:
+        if expire_cutoff <= ts < full_cutoff:
+            last_of_day[ts.date()] = max(ts, last_of_day.get(ts.date(), ts))
+    expected = sorted([ts for ts in before if ts >= full_cutoff] + list(last_of_day.values()))
+
+    retention = HourlyStatsRetention(warehouse.connect(), full_days=7, downsample_hours=24, retention_days=90)
+    results = retention.run(as_of=as_of)
+
+    rows = hourly_rows(warehouse)
+    assert [ts for _, ts, _ in rows] == expected
+    # The kept rows are the snapshots as they were, the newest of each old day
+    assert all(views == before[ts] for _, ts, views in rows)
+    assert results['TBL_YT_VIDEO_STATS_HOURLY']['expired'] == sum(1 for ts in before if ts < expire_cutoff)
+
+    assert retention.run(as_of=as_of)['TBL_YT_VIDEO_STATS_HOURLY'] == {'downsampled': 0, 'expired': 0}
+    assert hourly_rows(warehouse) == rows
@@ -0,0 +1,149 @@
+# Tests of the YouTube request throttling: RateLimiter, the retry classification and the
+# retries with backoff of ThrottledYoutube. time.sleep is patched, nothing waits. Run from
+# the repository root:
+#   python -m pytest -q tests
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from benchmarks.fake_youtube import FakeYoutube, http_error, make_channels
+from dags.utils import QuotaBudgetExceededError, RateLimiter, ThrottledYoutube, YoutubeExtractor, _retry_reason
+
+
+class FakeRequest():
+    """Request whose execute() raises or returns the next of outcomes."""
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.executed = 0
+
+    def execute(self, *args, **kwargs):
+        self.executed += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class FakeClient():
+    """Youtube resource handing out the given requests from videos().list()."""
+    def __init__(self, *requests):
+        self.requests = list(requests)
+
+    def videos(self):
+        return self
+
+    def list(self, **params):
+        return self.requests.pop(0)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr('dags.utils.time.sleep', slept.append)
+    return slept
+
+
+@pytest.mark.parametrize('error, reason', [
+    (http_error(403, 'quotaExceeded'), 'quotaExceeded'),
+    (http_error(403, 'dailyLimitExceeded'), 'quotaExceeded'),
+    (http_error(429, 'rateLimitExceeded'), 'rateLimit'),
+    (http_error(403, 'rateLimitExceeded'), 'rateLimit'),
+    (http_error(403, 'userRateLimitExceeded'), 'rateLimit'),
+    (http_error(500, 'backendError'), 'serverError'),
+    (http_error(503, 'backendError'), 'serverError'),
+    (http_error(403, 'forbidden'), None),
+    (http_error(404, 'notFound'), None),
+    (TimeoutError(), 'timeout'),
+    (ConnectionResetError(), 'timeout'),
+    (ValueError('bad'), None),
+])
+def test_retry_reason(error, reason):
+    assert _retry_reason(error) == reason
+
+
+def test_retryable_errors_are_retried_with_jittered_backoff(sleeps):
+    request = FakeRequest([http_error(503, 'backendError'), http_error(503, 'backendError'),
+                           TimeoutError(), {'items': []}])
+    youtube = ThrottledYoutube(FakeClient(request), max_retries=5, backoff_base=1.0, backoff_max=3.0, channel='c1')
+
+    assert youtube.videos().list(id='v1').execute() == {'items': []}
+    assert request.executed == 4
+    # Full jitter below base * 2 ** attempt, capped at backoff_max
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= cap for delay, cap in zip(sleeps, [1.0, 2.0, 3.0]))
+    metrics = youtube.metrics()['c1']
+    assert (metrics['calls'], metrics['retries'], metrics['quota_units']) == (4, 3, 4)
+
+
+def test_retries_stop_after_max_retries(sleeps):
+    request = FakeRequest([http_error(503, 'backendError')] * 10)
+    youtube = ThrottledYoutube(FakeClient(request), max_retries=2)
+
+    with pytest.raises(HttpError):
+        youtube.videos().list(id='v1').execute()
+    assert request.executed == 3 and len(sleeps) == 2
+
+
+def test_other_errors_are_raised_at_once(sleeps):
+    request = FakeRequest([http_error(404, 'notFound')])
+    youtube = ThrottledYoutube(FakeClient(request))
+
+    with pytest.raises(HttpError):
+        youtube.videos().list(id='v1').execute()
+    assert request.executed == 1 and sleeps == []
+
+
+def test_rate_limit_errors_throttle_and_success_recovers(sleeps):
+    limiter = RateLimiter(max_requests_per_sec=40)
+    request = FakeRequest([http_error(429, 'rateLimitExceeded'), {'items': []}])
+    youtube = ThrottledYoutube(FakeClient(request), rate_limiter=limiter)
+
+    youtube.videos().list(id='v1').execute()
+    # Halved by the 429, then one recovery step of max / 50
+    assert limiter.requests_per_sec == pytest.approx(20.8)
+
+
+def test_throttle_and_recover_stay_within_the_bounds():
+    limiter = RateLimiter(max_requests_per_sec=10, min_requests_per_sec=2)
+    for _ in range(5):
+        limiter.throttle()
+    assert limiter.requests_per_sec == 2
+    for _ in range(100):
+        limiter.recover()
+    assert limiter.requests_per_sec == 10
+
+
+def test_acquire_checks_the_budget_before_spending():
+    limiter = RateLimiter(quota_budget=150)
+    limiter.acquire(100)
+    with pytest.raises(QuotaBudgetExceededError):
+        limiter.acquire(100)
+    # The refused call spent nothing, a cheaper one still fits
+    assert limiter.quota_used == 100
+    limiter.acquire(50)
+    assert limiter.quota_used == 150
+
+
+def test_quota_exceeded_stops_every_later_request_before_it_is_sent(sleeps):
+    first = FakeRequest([http_error(403, 'quotaExceeded')])
+    second = FakeRequest([{'items': []}])
+    youtube = ThrottledYoutube(FakeClient(first, second))
+
+    with pytest.raises(QuotaBudgetExceededError):
+        youtube.for_channel('c1').videos().list(id='v1').execute()
+    with pytest.raises(QuotaBudgetExceededError):
+        youtube.for_channel('c2').videos().list(id='v2').execute()
+    assert (first.executed, second.executed) == (1, 0)
+    assert sleeps == []
+    assert list(youtube.metrics()) == ['c1']
+
+
+def test_daily_quota_skips_the_queued_channels_without_api_calls():
+    # The channel lookups cost 100 units each, the quota is gone during the second one
+    fake = FakeYoutube(make_channels(5, 100), daily_quota=150)
+    extractor = YoutubeExtractor(service_account_info={}, youtube=fake, max_workers=1)
+    results, errors = extractor.extract([f"channel{c}" for c in range(5)], fetch_mode='playlist')
+
+    assert len(errors) + len(results) == 5 and all(isinstance(e, QuotaBudgetExceededError) for e in errors.values())
+    # After the 403 no further search.list is sent
+    assert fake.calls.get('search.list', 0) <= 2
@@ -0,0 +1,143 @@
+# Tests of the cross channel videos().list batching (VideoIdBatcher) against the fake
+# YouTube client of the benchmarks. Run from the repository root:
+#   python -m pytest -q tests
+
+import logging
+import time
+from concurrent.futures import wait
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from benchmarks.fake_youtube import FakeYoutube, http_error, make_channels
+from dags.utils import ThrottledYoutube, VideoIdBatcher, YoutubeDataError, YoutubeExtractor
+
+
+def channel_ids(channels, name, count=None):
+    return [video['id'] for video in channels[name].videos[:count]]
+
+
+class FailingYoutube(FakeYoutube):
+    # videos().list fails with a non retryable 400 for the requests holding failing_id
+    failing_id = None
+
+    def _videos_list(self, params):
+        if self.failing_id in params.get('id', '').split(','):
+            raise http_error(400, 'badRequest')
+        return super()._videos_list(params)
+
+
+@pytest.fixture
+def channels():
+    return make_channels(3, 30)
+
+
+@pytest.fixture
+def fake(channels):
+    return FailingYoutube(channels)
+
+
+def make_batcher(fake, **kwargs):
+    return VideoIdBatcher(ThrottledYoutube(fake), **kwargs)
+
+
+def test_full_requests_are_sent_without_waiting(channels, fake):
+    batcher = make_batcher(fake, ids_per_request=10, requests_per_batch=2, max_wait=30)
+    full = batcher.submit(channel_ids(channels, 'channel0', 20), channel='channel0')
+    partial = batcher.submit(channel_ids(channels, 'channel1', 5), channel='channel1')
+
+    # Waiting on the Future without result(), which would tell the batcher nothing more is coming
+    wait([full], timeout=5)
+    assert [video['id'] for video in full.result()] == channel_ids(channels, 'channel0', 20)
+    assert not partial.done()
+    assert (batcher.batches, batcher.requests, fake.http_requests) == (1, 2, 1)
+    batcher.close()
+
+
+def test_a_partial_request_is_sent_after_max_wait(channels, fake):
+    batcher = make_batcher(fake, ids_per_request=10, requests_per_batch=2, max_wait=0.2)
+    start = time.monotonic()
+    future = batcher.submit(channel_ids(channels, 'channel0', 5), channel='channel0')
+
+    wait([future], timeout=5)
+    assert future.done() and time.monotonic() - start >= 0.2
+    assert len(future.result()) == 5
+    assert (batcher.batches, batcher.requests) == (1, 1)
+    batcher.close()
+
+
+def test_a_partial_request_is_sent_once_every_producer_waits(channels, fake):
+    batcher = make_batcher(fake, ids_per_request=10, requests_per_batch=2, max_wait=30)
+    start = time.monotonic()
+    with batcher.producer():
+        future = batcher.submit(channel_ids(channels, 'channel0', 5), channel='channel0')
+        assert len(future.result(timeout=5)) == 5
+
+    assert time.monotonic() - start < 5
+    batcher.close()
+
+
+def test_a_failed_request_fails_every_channel_with_ids_in_it(channels, fake):
+    fake.failing_id = channel_ids(channels, 'channel1')[0]
+    batcher = make_batcher(fake, ids_per_request=10, requests_per_batch=2, max_wait=30)
+    # channel0 and channel1 share the failing request, channel2 fills the other one
+    futures = {name: batcher.submit(channel_ids(channels, name, count), channel=name)
+               for name, count in [('channel0', 5), ('channel1', 5), ('channel2', 10)]}
+
+    wait(futures.values(), timeout=5)
+    for name in ['channel0', 'channel1']:
+        with pytest.raises(HttpError):
+            futures[name].result()
+    assert len(futures['channel2'].result()) == 10
+    batcher.close()
+
+
+def test_close_sends_the_queued_ids_and_refuses_new_ones(channels, fake):
+    batcher = make_batcher(fake, ids_per_request=10, requests_per_batch=2, max_wait=30)
+    future = batcher.submit(channel_ids(channels, 'channel0', 5), channel='channel0')
+    batcher.close()
+
+    assert future.done() and len(future.result()) == 5
+    assert not batcher._thread.is_alive()
+    with pytest.raises(YoutubeDataError):
+        batcher.submit(channel_ids(channels, 'channel1', 5), channel='channel1')
+
+
+def test_a_request_is_accounted_to_the_channels_of_its_ids(channels, fake):
+    youtube = ThrottledYoutube(fake)
+    batcher = VideoIdBatcher(youtube, ids_per_request=50, requests_per_batch=1, max_wait=30)
+    futures = [batcher.submit(channel_ids(channels, 'channel0', 30), channel='channel0'),
+               batcher.submit(channel_ids(channels, 'channel1', 20), channel='channel1')]
+    wait(futures, timeout=5)
+    batcher.close()
+
+    metrics = youtube.metrics()
+    assert sorted(metrics) == ['channel0', 'channel1']
+    assert metrics['channel0']['calls_by_method'] == {'videos.list': 0.6}
+    assert metrics['channel1']['quota_by_method'] == {'videos.list': 0.4}
+    assert sum(m['calls'] for m in metrics.values()) == fake.calls['videos.list'] == 1
+
+
+def test_many_small_channels_need_fewer_requests():
+    # 40 channels of 5 videos, one videos().list request each without the batcher
+    fake = FakeYoutube(make_channels(40, 5), latency=0.01)
+    channel_list = [f"channel{c}" for c in range(40)]
+    logging.disable(logging.WARNING)
+    try:
+        runs = {}
+        for requests_per_batch in [None, 10]:
+            fake.reset_counters()
+            extractor = YoutubeExtractor(service_account_info={}, max_workers=8, youtube=fake,
+                                         requests_per_batch=requests_per_batch, batch_max_wait=0.5)
+            results, errors = extractor.extract(channel_list, fetch_mode='playlist')
+            assert not errors
+            runs[requests_per_batch] = (fake.calls['videos.list'], fake.http_requests,
+                                        {name: sorted(video['id'] for video in results[name][1]) for name in channel_list})
+    finally:
+        logging.disable(logging.NOTSET)
+
+    per_page, batched = runs[None], runs[10]
+    assert batched[2] == per_page[2]
+    # The 200 ids fit in 4 full requests, sent in a few HTTP batch requests
+    assert per_page[0] == 40 and batched[0] < 20
+    assert batched[1] < per_page[1] - 20
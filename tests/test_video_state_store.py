@@ -0,0 +1,116 @@
+# Tests of the incremental extraction state (VideoStateStore). Run from the repository root:
+#   python -m pytest -q tests
+
+import json
+
+from benchmarks.fake_s3 import LocalS3Client
+from dags.utils import VideoBatch, VideoStateStore, _iso_time
+
+
+DAY = 86400
+NOW = 1_750_000_000
+
+
+def item(video_id, published_epoch, title='A video', views=1):
+    return {'id': video_id, 'snippet': {'title': title, 'publishedAt': _iso_time(published_epoch)},
+            'statistics': {'viewCount': str(views)}}
+
+
+def stats_item(video_id, views=1):
+    return {'id': video_id, 'statistics': {'viewCount': str(views)}}
+
+
+def make_store(tmp_path, clock, **kwargs):
+    return VideoStateStore(str(tmp_path / 'state.json'), clock=lambda: clock[0], **kwargs)
+
+
+def test_plan_fetches_new_videos_in_full_and_due_ones_for_statistics(tmp_path):
+    clock = [NOW]
+    store = make_store(tmp_path, clock)
+    store.record_batch(VideoBatch.from_items([item('old', NOW - 100 * DAY), item('new', NOW - 3600)]))
+    clock[0] += 7 * 3600
+    assert store.plan(['old', 'new', 'unseen']) == (['unseen'], ['new'])
+
+
+def test_save_drops_videos_outside_the_window(tmp_path):
+    clock = [NOW]
+    store = make_store(tmp_path, clock, max_age_seconds=365 * DAY)
+    store.record_batch(VideoBatch.from_items([item('v1', NOW - 364 * DAY), item('v2', NOW - DAY)]))
+    store.save()
+    assert len(store) == 2
+    # A week later v1 is 371 days old
+    clock[0] += 7 * DAY
+    store.save()
+    assert len(store) == 1
+    with open(tmp_path / 'state.json') as f:
+        assert list(json.load(f)) == ['v2']
+    assert len(make_store(tmp_path, clock)) == 1
+
+
+def test_save_keeps_everything_without_max_age(tmp_path):
+    clock = [NOW]
+    store = make_store(tmp_path, clock, max_age_seconds=None)
+    store.record_batch(VideoBatch.from_items([item('v1', NOW - 1000 * DAY)]))
+    store.save()
+    assert len(store) == 1
+
+
+def test_metadata_changes_are_flagged(tmp_path):
+    clock = [NOW]
+    store = make_store(tmp_path, clock)
+    store.record_batch(VideoBatch.from_items([item('v1', NOW - DAY)]))
+    videos = VideoBatch.from_items([item('v1', NOW - DAY), item('v2', NOW - DAY, title='Renamed')])
+    store.record_batch(videos)
+    assert list(videos.md_changed) == [0, 1]
+    videos = VideoBatch.from_items([item('v2', NOW - DAY, title='Renamed again')])
+    store.record_batch(videos)
+    assert list(videos.md_changed) == [1]
+
+
+def test_statistics_rows_take_the_publish_time_from_the_state(tmp_path):
+    clock = [NOW]
+    store = make_store(tmp_path, clock)
+    store.record_batch(VideoBatch.from_items([item('v1', NOW - DAY)]))
+    videos = VideoBatch.from_items([stats_item('v1', views=5)])
+    store.record_batch(videos)
+    assert list(videos.md_changed) == [0]
+    assert videos.published[0] == NOW - DAY
+
+
+def test_statistics_row_without_state_is_recorded_as_new(tmp_path):
+    clock = [NOW]
+    store = make_store(tmp_path, clock)
+    videos = VideoBatch.from_items([stats_item('v1')])
+    store.record_batch(videos)
+    assert list(videos.md_changed) == [1]
+    # Its metadata is fetched on the next run
+    assert store.plan(['v1']) == (['v1'], [])
+    row = {'id': 'v2', 'title': None, 'publishedAt': None}
+    assert store.record(row) is True
+
+
+def test_save_drops_the_videos_of_channels_moved_away(tmp_path):
+    clock = [NOW]
+    store = make_store(tmp_path, clock)
+    store.record_batch(VideoBatch.from_items([item('v1', NOW - DAY, title='Old title')]), channel='channel0')
+    store.record_batch(VideoBatch.from_items([item('v2', NOW - DAY)]), channel='channel1')
+    # channel0 moved to another shard
+    store.save(channels=['channel1'])
+
+    store = make_store(tmp_path, clock)
+    assert len(store) == 1
+    # Back on this shard after its title changed and reverted, it is fetched in full
+    assert store.plan(['v1', 'v2']) == (['v1'], ['v2'])
+
+
+def test_state_on_s3_is_read_back_by_another_worker(tmp_path):
+    clock = [NOW]
+    s3_client = LocalS3Client(str(tmp_path / 's3'))
+    path = 's3://bucket/state/yt_video_state.shard-1.json'
+    store = VideoStateStore(path, clock=lambda: clock[0], s3_client=s3_client)
+    store.record_batch(VideoBatch.from_items([item('v1', NOW - DAY)]), channel='channel0')
+    store.save()
+
+    # Nothing on the local disk, another worker sees the same state
+    assert not (tmp_path / 'state').exists()
+    assert len(VideoStateStore(path, clock=lambda: clock[0], s3_client=s3_client)) == 1